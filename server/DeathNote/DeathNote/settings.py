@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "notes.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -127,4 +128,123 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+# Semantic search
+# Approximate nearest-neighbour (IVF) index, used by search_notes?mode=ann
+
+ANN_INDEX_PATH = BASE_DIR / "ann_index.npz"
+ANN_N_PROBE = 8  # inverted lists scanned per query; raise for recall, lower for speed
+ANN_REBUILD_RATIO = 0.2  # rebuild once inserts + tombstones exceed this share of the index
+ANN_SAVE_EVERY = 100  # persist the index after this many inserts/deletes
+SEARCH_HYBRID_CANDIDATES = 200  # keyword (BM25) hits reranked by embedding in mode=hybrid
+# Quantized copies of the embeddings (notes/quantized.py) for mode=int8 (1 byte per dimension)
+# and mode=binary (1 bit per dimension): candidates found on the codes are reranked exactly
+SEARCH_RERANK_CANDIDATES = {"int8": 50, "binary": 200}  # candidates per query (at least k)
+SEARCH_FLOAT_MATRIX = True  # False: no float32 matrix in memory (4 bytes per dimension per note);
+SEARCH_QUANTIZATION = None  # ...exact, hybrid and time-range searches then use this ("int8" or "binary")
+
+# Embedding cache: in-process LRU in front of an on-disk store
+EMBEDDING_CACHE_PATH = BASE_DIR / "cache" / "embeddings.sqlite3"
+EMBEDDING_CACHE_MAX_ITEMS = 10000  # in-process entries (~4 KB each)
+EMBEDDING_CACHE_MAX_BYTES = 256 * 1024 * 1024  # on-disk budget
+
+# Notes per embedder call / bulk insert in api/notes/import/
+IMPORT_BATCH_SIZE = 64
+
+# Local models (Whisper), loaded on first use by notes.registry.model_registry
+WHISPER_MODEL = "small"
+WHISPER_MODEL_SIZE_MB = 2000  # rough footprint used for the memory budget
+MODEL_DEVICE = None  # "cuda" or "cpu"; None picks the GPU when one is available
+MODEL_MEMORY_BUDGET_MB = 6000  # unload least recently used models beyond this
+MODEL_IDLE_SECONDS = 30 * 60  # unload models unused for this long; None keeps them
+MODEL_PREWARM = []  # e.g. ["whisper"] to load in the background at startup
+
+# Concurrent media processing in api/notes/summarize/: calls in flight per backend
+MEDIA_CONCURRENCY = {
+    "vision": 2,  # Ollama llama3.2-vision
+    "transcription": 1,  # Whisper; one shared model instance
+}
+
+# Background summarize jobs (api/notes/summarize/jobs/)
+SUMMARIZE_WORKERS = 2
+SUMMARIZE_JOB_MEDIA_DIR = BASE_DIR / "job_uploads"  # uploads kept until their job finishes
+SUMMARIZE_JOB_HEARTBEAT_SECONDS = 10  # how often running jobs are marked alive
+SUMMARIZE_JOB_STALE_SECONDS = 60  # a "running" job not marked alive for this long lost its worker and is requeued
+
+# Title and embedding of notes from api/notes/create/, generated after the note is saved (notes/enrichment.py)
+ENRICHMENT_WORKERS = 2
+
+# Chat working memory: past summaries sent to the LLM with each chat message
+CHAT_MEMORY_TOKEN_BUDGET = 3000
+CHAT_MEMORY_RECENT = 3  # latest summaries always included
+CHAT_MEMORY_TOP_K = 8  # most relevant older summaries added while the budget allows
+
+# Server-side chat sessions (api/chat/sessions/)
+CHAT_SESSION_TTL_SECONDS = 7 * 24 * 3600  # idle time before a session expires; 0 to keep sessions until deleted
+CHAT_SESSION_TOKEN_BUDGET = 2000  # recent turns + summary size that triggers compaction
+CHAT_SESSION_KEEP_MESSAGES = 6  # latest messages left uncompacted (keep even: user/assistant pairs)
+
+# Uploads up to this size are kept in memory and media is decoded straight from
+# the buffer; larger ones are spooled by Django to a temporary file it deletes itself
+FILE_UPLOAD_MAX_MEMORY_SIZE = 20 * 2**20
+
+# Images are resized and re-encoded before the vision model sees them (notes/images.py).
+# max_side: longest side in pixels (llama3.2-vision reads at most 2x2 tiles of 560 px);
+# quality: starting JPEG quality, lowered until the image fits max_bytes. Unlisted models get the original.
+IMAGE_PREPROCESSING = {
+    "llama3.2-vision": {"max_side": 1120, "quality": 85, "max_bytes": 400_000},
+}
+
+# Audio transcription (notes/transcription.py): speech is cut out of each recording by an
+# energy-based voice activity detector and decoded by Whisper in batches
+TRANSCRIPTION_BATCH_SIZE = 8  # 30 s chunks per Whisper forward pass
+VAD_MARGIN_DB = 10  # frames this far above the recording's noise floor count as speech
+VAD_SPEECH_RANGE_DB = 25  # ...or within this range of its loud frames, for memos without pauses
+VAD_MIN_DB = -50  # never speech below this level (room noise, digital silence)
+VAD_MIN_SILENCE_MS = 600  # shorter pauses stay inside a segment
+VAD_PAD_MS = 200  # audio kept around each segment
+
+# Image descriptions and audio transcriptions by content hash, so re-sent media skips the models
+MEDIA_CACHE_PATH = BASE_DIR / "cache" / "media.sqlite3"
+MEDIA_CACHE_MAX_ITEMS = 2000  # in-process entries
+MEDIA_CACHE_MAX_BYTES = 64 * 1024 * 1024  # on-disk budget
+
+# LLM servers per role (notes/backends.py). "api" is "openai" for OpenAI-compatible servers
+# (LM Studio, vLLM, llama.cpp) or "ollama". Requests go to the endpoint with the fewest in
+# flight, so listing a second machine under a role adds its capacity to that role.
+LMSTUDIO_ENDPOINT = {"url": "http://localhost:1234/v1", "api": "openai", "api_key": "lm-studio"}
+OLLAMA_ENDPOINT = {"url": "http://localhost:11434", "api": "ollama"}
+LLM_BACKENDS = {
+    "chat": {"model": "meta-llama-3.1-8b-instruct-abliterated", "temperature": 0.7, "endpoints": [LMSTUDIO_ENDPOINT]},
+    "summarize": {"model": "meta-llama-3.1-8b-instruct-abliterated", "temperature": 0.7, "endpoints": [LMSTUDIO_ENDPOINT]},
+    "title": {"model": "tarruda/neuraldaredevil-8b-abliterated:fp16", "endpoints": [OLLAMA_ENDPOINT]},
+    "vision": {"model": "llama3.2-vision", "endpoints": [OLLAMA_ENDPOINT]},
+    "embed": {"model": "mxbai-embed-large", "endpoints": [OLLAMA_ENDPOINT]},
+}
+LLM_TIMEOUT_SECONDS = 300  # per request; local models can be slow on long prompts
+LLM_CONNECT_TIMEOUT_SECONDS = 5
+LLM_MAX_CONNECTIONS = 32  # pooled HTTP connections per endpoint
+LLM_MAX_RETRIES = 2  # further attempts, on other endpoints when there are any
+LLM_RETRY_BACKOFF_SECONDS = 0.5  # doubled after each retry
+LLM_BREAKER_FAILURES = 3  # consecutive failures that take an endpoint out of rotation...
+LLM_BREAKER_RESET_SECONDS = 30  # ...for this long
+
+# Single-text embeddings from concurrent requests are merged into batched calls (notes/coalescer.py)
+EMBED_BATCH_WINDOW_MS = 5  # how long the first text of a batch waits for company
+EMBED_MAX_BATCH = 32  # texts per embed call
+EMBED_MAX_INFLIGHT = 2  # batches out at once; texts arriving meanwhile join the next one
+
+# Request instrumentation (notes/metrics.py): histograms are served at /metrics; the
+# Server-Timing header shows each response's stage timings in browser dev tools
+SERVER_TIMING = DEBUG
+
+# parse_entry context from past summaries (notes/digests.py): the latest ones verbatim, older
+# ones as cached day, then week, then month digests, so long diaries keep the prompt bounded
+SUMMARY_MEMORY_RECENT = 5  # summaries given as they are
+SUMMARY_MEMORY_DAYS = 7  # days before the entry digested day by day...
+SUMMARY_MEMORY_WEEKS = 4  # ...then week by week...
+SUMMARY_MEMORY_MONTHS = 6  # ...then month by month; older summaries are left out
+SUMMARY_MEMORY_UNDATED = 5  # latest summaries with unreadable timestamps given as they are; more are left out
+SUMMARY_DIGEST_MAX_TOKENS = 200  # periods shorter than this go in without a digest
+SUMMARY_DIGEST_MAX_WORDS = 120  # length asked of each digest
@@ -18,7 +18,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from notes.views import metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('api/', include('notes.urls')),  # Include the notes app API
+    path('metrics', metrics, name='metrics'),  # Prometheus scrape target
 ]
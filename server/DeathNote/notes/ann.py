@@ -0,0 +1,324 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .vector_index import load_note_embeddings, normalize, top_k
+
+logger = logging.getLogger(__name__)
+
+KMEANS_ITERATIONS = 10
+SAMPLES_PER_LIST = 64  # k-means training points per inverted list
+ASSIGN_CHUNK = 4096  # rows scored against the centroids at once
+
+
+def _assign(vectors, centroids):
+    """Index of the closest centroid (by inner product) for every row"""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = vectors[start:start + ASSIGN_CHUNK]
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def train_centroids(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means over a sample of the (normalized) vectors"""
+    rng = np.random.default_rng(seed)
+    n_lists = max(1, min(n_lists, len(vectors)))
+    sample_size = min(len(vectors), n_lists * SAMPLES_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=n_lists) == 0
+        sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]  # reseed empty lists
+        centroids = normalize(sums)
+    return centroids
+
+
+def default_n_lists(n_vectors):
+    return int(min(4096, max(1, np.sqrt(n_vectors))))
+
+
+class IVFIndex:
+    """
+    Inverted-file ("IVF-flat") index: vectors are bucketed by their closest
+    k-means centroid and a query only scores the buckets of its n_probe
+    closest centroids. Inserts go to the closest existing bucket; deletes
+    leave a tombstone until the next rebuild.
+    """
+
+    def __init__(self, centroids, dim):
+        self.centroids = centroids
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._assignment = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._rows = {}  # note id -> row of its live vector
+        self._lists = [[] for _ in range(len(centroids))]  # rows per centroid
+        self._list_arrays = {}  # cached np.array of self._lists[i]
+        self.tombstones = 0
+        self.inserts = 0  # rows added after the initial build
+
+    @classmethod
+    def build(cls, ids, vectors, n_lists=None):
+        if not len(ids):
+            return None
+        centroids = train_centroids(vectors, n_lists or default_n_lists(len(ids)))
+        index = cls(centroids, vectors.shape[1])
+        index._extend(ids, vectors, _assign(vectors, centroids))
+        return index
+
+    def _extend(self, ids, vectors, assignment):
+        needed = self._size + len(ids)
+        if needed > len(self._ids):
+            capacity = max(64, needed, 2 * len(self._ids))
+            for name, dtype, shape in (('_vectors', np.float32, (capacity, self.dim)),
+                                       ('_ids', np.int64, (capacity,)),
+                                       ('_alive', bool, (capacity,)),
+                                       ('_assignment', np.int64, (capacity,))):
+                grown = np.zeros(shape, dtype=dtype)
+                grown[:self._size] = getattr(self, name)[:self._size]
+                setattr(self, name, grown)
+        rows = np.arange(self._size, needed)
+        self._vectors[rows] = vectors
+        self._ids[rows] = ids
+        self._alive[rows] = True
+        self._assignment[rows] = assignment
+        self._size = needed
+        for row, note_id, list_id in zip(rows.tolist(), np.asarray(ids).tolist(), np.asarray(assignment).tolist()):
+            old = self._rows.get(note_id)
+            if old is not None:
+                self._alive[old] = False
+                self.tombstones += 1
+            self._rows[note_id] = row
+            self._lists[list_id].append(row)
+            self._list_arrays.pop(list_id, None)
+
+    def add(self, note_id, vector):
+        vector = vector.reshape(1, -1)
+        self._extend([note_id], vector, _assign(vector, self.centroids))
+        self.inserts += 1
+
+    def remove(self, note_id):
+        row = self._rows.pop(note_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self.tombstones += 1
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _list_rows(self, list_id):
+        rows = self._list_arrays.get(list_id)
+        if rows is None:
+            rows = self._list_arrays[list_id] = np.array(self._lists[list_id], dtype=np.int64)
+        return rows
+
+    def search(self, query, k, n_probe):
+        """Return (ids, scores) of the approximate top-k rows, best first"""
+        n_probe = min(n_probe, len(self.centroids))
+        probe = top_k(self.centroids @ query, n_probe)
+        rows = np.concatenate([self._list_rows(list_id) for list_id in probe.tolist()])
+        rows = rows[self._alive[rows]]
+        scores = self._vectors[rows] @ query
+        top = top_k(scores, k)
+        return self._ids[rows[top]], scores[top]
+
+    def snapshot(self):
+        """Copies of the live rows and centroids, as saved to disk"""
+        live = np.flatnonzero(self._alive[:self._size])
+        return {'centroids': self.centroids.copy(), 'ids': self._ids[live],
+                'vectors': self._vectors[live], 'assignment': self._assignment[live]}
+
+    @staticmethod
+    def write(path, snapshot):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **snapshot)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(data['centroids'], data['centroids'].shape[1])
+            index._extend(data['ids'], data['vectors'], data['assignment'])
+        return index
+
+
+class ANNIndex:
+    """
+    Process-wide IVF index over note embeddings. It is loaded from disk (or
+    built from the database) in a background thread on the first ANN search,
+    then kept in sync by create_note and delete_note, persisted next to the
+    database, and rebuilt in the background once inserts and tombstones make
+    up more than ANN_REBUILD_RATIO of it. search() returns None until the
+    index is ready so callers can fall back to exact search.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None
+        self._ready = False
+        self._started = False
+        self._building = False
+        self._pending = None  # mutations made while a rebuild is running
+        self._unsaved = 0
+
+    @property
+    def path(self):
+        return settings.ANN_INDEX_PATH
+
+    def _start(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._pending = []
+        threading.Thread(target=self._load_or_build, daemon=True).start()
+
+    def _load_or_build(self):
+        try:
+            index = IVFIndex.load(self.path) if os.path.exists(self.path) else None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Discarding unreadable ANN index %s: %s", self.path, e)
+            index = None
+        if index is None:
+            self.rebuild()
+            return
+        try:
+            self._reconcile(index)
+        finally:
+            connection.close()
+
+    def _reconcile(self, index):
+        """Apply the notes created or deleted since the index file was written"""
+        from .models import Note
+        stored = set(Note.objects.exclude(embeddings=None).values_list('id', flat=True))
+        for note_id in set(index._rows) - stored:
+            index.remove(note_id)
+        for note_id, embedding in Note.objects.filter(id__in=stored - set(index._rows)).values_list('id', 'embeddings'):
+            if len(embedding) == index.dim:
+                index.add(note_id, normalize(embedding))
+        self._install(index)
+        self._maybe_rebuild()
+
+    def _install(self, index):
+        """Replay the mutations recorded while index was being prepared, then swap it in"""
+        with self._lock:
+            for note_id, vector in self._pending or []:
+                if vector is None:
+                    if index is not None:
+                        index.remove(note_id)
+                elif index is None:
+                    index = IVFIndex.build(np.array([note_id]), vector.reshape(1, -1))
+                elif index.dim == len(vector):
+                    index.add(note_id, vector)
+            self._index = index
+            self._pending = None
+            self._ready = True
+        return index
+
+    def rebuild(self, n_lists=None):
+        """Rebuild the index from the database in a background thread"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            if self._pending is None:
+                self._pending = []
+        threading.Thread(target=self._rebuild, args=(n_lists,), daemon=True).start()
+
+    def _rebuild(self, n_lists):
+        try:
+            ids, vectors = load_note_embeddings()
+            index = self._install(IVFIndex.build(ids, vectors, n_lists))
+            if index is not None:
+                self.save()
+            logger.info("Rebuilt ANN index with %d notes", len(index) if index else 0)
+        except Exception:
+            logger.exception("ANN index rebuild failed")
+        finally:
+            with self._lock:
+                self._building = False
+                self._pending = None
+            connection.close()
+
+    def _maybe_rebuild(self):
+        index = self._index
+        if index is None or self._building:
+            return
+        churn = index.inserts + index.tombstones
+        if churn > settings.ANN_REBUILD_RATIO * max(len(index), 1000):
+            self.rebuild()
+
+    def save(self):
+        with self._lock:
+            if self._index is None:
+                return
+            snapshot = self._index.snapshot()
+            self._unsaved = 0
+        IVFIndex.write(self.path, snapshot)
+
+    def _mutated(self):
+        self._unsaved += 1
+        if self._unsaved >= settings.ANN_SAVE_EVERY:
+            self._unsaved = 0
+            threading.Thread(target=self.save, daemon=True).start()
+        self._maybe_rebuild()
+
+    def add(self, note_id, embedding):
+        """Insert or replace the embedding of a note (nothing to do before the first ANN search)"""
+        if not self._started or embedding is None or not len(embedding):
+            return  # the load reconciles the index with the database
+        vector = normalize(embedding)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((note_id, vector))
+            if self._index is None:
+                if self._ready:
+                    # First note of an empty index: start it with this one rather than rebuild
+                    self._index = IVFIndex.build(np.array([note_id]), vector.reshape(1, -1))
+                    self._mutated()
+                return
+            if self._index.dim == len(vector):
+                self._index.add(note_id, vector)
+                self._mutated()
+
+    def remove(self, note_id):
+        """Tombstone a deleted note"""
+        if not self._started:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((note_id, None))
+            if self._index is not None:
+                self._index.remove(note_id)
+                self._mutated()
+
+    def search(self, query_embedding, k=10, threshold=0.5, n_probe=None):
+        """
+        Return up to k approximate (note_id, score) pairs above threshold,
+        best first, or None while the index is not ready yet.
+        """
+        self._start()
+        query = normalize(query_embedding)
+        with self._lock:
+            if not self._ready:
+                return None
+            if self._index is None or self._index.dim != len(query):
+                return []
+            ids, scores = self._index.search(query, k, n_probe or settings.ANN_N_PROBE)
+        return [(int(note_id), float(score)) for note_id, score in zip(ids, scores) if score > threshold]
+
+
+ann_index = ANNIndex()
@@ -1,6 +1,27 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class NotesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "notes"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .metrics import instrument_connection
+        connection_created.connect(instrument_connection)
+
+        # Background work only in serving processes, not for migrate, tests or the runserver autoreloader parent
+        command = sys.argv[1] if os.path.basename(sys.argv[0]) == "manage.py" and len(sys.argv) > 1 else None
+        if not (command is None or (command == "runserver" and os.environ.get("RUN_MAIN"))):
+            return
+        if settings.MODEL_PREWARM:
+            from .registry import model_registry
+            from . import utils  # registers the models
+            model_registry.prewarm(settings.MODEL_PREWARM)
+        # Jobs queued or running when the server last stopped are picked up by the queue's heartbeat
+        from .jobs import job_queue
+        job_queue.start()
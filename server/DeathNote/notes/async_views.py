@@ -0,0 +1,139 @@
+# Async versions of the LLM-bound endpoints, served through DeathNote/asgi.py
+# (e.g. `uvicorn DeathNote.asgi:application`). While waiting on Ollama or LM Studio
+# they hold no thread; media transcription/description still runs in the media pool.
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .enrichment import enrichment_queue
+from .models import Note
+from .pipeline import build_entry_text, chat_media_message, process_items
+from .retrieval import select_working_memory
+from .sessions import get_session, record_turn, use_session
+from .streaming import achat_sse_events, sse_response
+from .serializers import NoteSerializer
+from .utils import achat_with_shinigami, aparse_entry, astream_chat_with_shinigami, is_truthy
+
+
+def _request_data(request):
+    """Form fields, or the JSON body (as DRF's request.data would give)"""
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+async def _arecord_stream(session, message, events):
+    """Async counterpart of sessions.record_stream"""
+    async for kind, value in events:
+        if kind == "done":
+            reply, _ = value
+            await sync_to_async(record_turn)(session, message, reply)
+            value = (reply, None)
+        yield kind, value
+
+
+@csrf_exempt
+@require_POST
+async def chat_async(request):
+    """Async counterpart of views.chat; same request and response format"""
+    data = _request_data(request)
+    working_memory = data.get('working_memory', '')
+    updated_messages_str = data.get('updated_messages', '[]')
+    settings_str = data.get('settings', '{}')
+    message_type = data.get('message_type')
+    message_content = data.get('message_content') or request.FILES.get('message_content')
+
+    if not message_type or not message_content:
+        return JsonResponse({"error": "Missing message_type or message_content"}, status=400)
+
+    try:
+        updated_messages = json.loads(updated_messages_str)
+        user_settings = json.loads(settings_str)
+    except json.JSONDecodeError as e:
+        return JsonResponse({"error": f"Invalid JSON in updated_messages or settings: {str(e)}"}, status=400)
+
+    session = None
+    if data.get('session_id'):
+        session = await sync_to_async(get_session)(data.get('session_id'))
+        if session is None:
+            return JsonResponse({"error": "Chat session not found or expired"}, status=404)
+
+    if message_type == 'text':
+        message = message_content
+    elif message_type in ('audio', 'image'):
+        if 'message_content' not in request.FILES:
+            return JsonResponse({"error": f"No {message_type} file provided"}, status=400)
+        message = await sync_to_async(chat_media_message, thread_sensitive=False)(
+            message_type, request.FILES['message_content'])
+    else:
+        return JsonResponse({"error": f"Unsupported message_type: {message_type}"}, status=400)
+
+    if session is not None:
+        updated_messages, user_settings, working_memory = await sync_to_async(use_session)(
+            session, user_settings, working_memory)
+    working_memory = await sync_to_async(select_working_memory, thread_sensitive=False)(working_memory, message)
+
+    if is_truthy(data.get('stream') or request.GET.get('stream')):
+        events = astream_chat_with_shinigami(
+            working_memory=working_memory,
+            chat_messages=updated_messages,
+            message=message,
+            user_settings=user_settings
+        )
+        if session is not None:
+            return sse_response(achat_sse_events(_arecord_stream(session, message, events), session_id=session.id))
+        return sse_response(achat_sse_events(events))
+
+    text_reply, updated_messages = await achat_with_shinigami(
+        working_memory=working_memory,
+        chat_messages=updated_messages,
+        message=message,
+        user_settings=user_settings
+    )
+    if session is not None:
+        await sync_to_async(record_turn)(session, message, text_reply)
+        return JsonResponse({"text_reply": text_reply, "session_id": str(session.id)})
+    return JsonResponse({"text_reply": text_reply, "updated_messages": updated_messages})
+
+
+@csrf_exempt
+@require_POST
+async def create_note_async(request):
+    """Async counterpart of views.create_note"""
+    content = _request_data(request).get('content', '')
+    if not content:
+        return JsonResponse({'error': 'Content is required'}, status=400)
+
+    note = await Note.objects.acreate(title='', content=content, enrichment_status=Note.PENDING)
+    await sync_to_async(enrichment_queue.submit)(note.id)
+    return JsonResponse(NoteSerializer(note).data, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def summarize_note_async(request):
+    """Async counterpart of views.NoteUploadView; same request and response format"""
+    note_data_str = request.POST.get('noteData')
+    user_settings_str = request.POST.get('settings')
+    old_summaries = request.POST.get("previousSummaries")
+    if not note_data_str or not user_settings_str:
+        return JsonResponse({"error": "Missing noteData or settings field"}, status=400)
+
+    note_data = json.loads(note_data_str)
+    user_settings = json.loads(user_settings_str)
+    old_summaries = json.loads(old_summaries)
+    items = note_data.get('items', [])
+    timestamp = note_data.get('timestamp', None)
+
+    results = await sync_to_async(process_items, thread_sensitive=False)(items, request.FILES)
+    current_entry, raw_text = await sync_to_async(build_entry_text)(old_summaries, results, timestamp)
+    title, summary = await aparse_entry(text=raw_text, user_settings=user_settings)
+    return JsonResponse({
+        "summary": summary,
+        "timestamp": timestamp,
+        "raw_text": current_entry,
+        "title": title,
+    })
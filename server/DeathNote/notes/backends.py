@@ -0,0 +1,424 @@
+import asyncio
+import base64
+import logging
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import ollama
+import openai
+from django.conf import settings
+
+from .images import read_image_bytes
+from .metrics import estimate_tokens, message_tokens, record, record_tokens, span
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class BackendUnavailable(Exception):
+    """No endpoint of a role could serve the request"""
+
+
+def is_retryable(error):
+    """Connection problems, timeouts and overloaded/failing servers; not bad requests"""
+    if isinstance(error, (httpx.TransportError, openai.APIConnectionError, ConnectionError, TimeoutError)):
+        return True
+    return getattr(error, 'status_code', None) in RETRYABLE_STATUS
+
+
+def openai_messages(messages):
+    """Ollama-style messages (images listed under "images") in the OpenAI content-parts format"""
+    converted = []
+    for message in messages:
+        images = message.get('images')
+        if not images:
+            converted.append({'role': message['role'], 'content': message['content']})
+            continue
+        parts = [{'type': 'text', 'text': message['content']}]
+        for image in images:
+            data = read_image_bytes(image)
+            mime = 'image/png' if data.startswith(b'\x89PNG') else 'image/jpeg'
+            parts.append({'type': 'image_url',
+                          'image_url': {'url': f"data:{mime};base64,{base64.b64encode(data).decode()}"}})
+        converted.append({'role': message['role'], 'content': parts})
+    return converted
+
+
+class Endpoint:
+    """
+    One server: an OpenAI-compatible API (LM Studio, vLLM, llama.cpp...) or
+    Ollama. Keeps a pooled HTTP client (one for sync code, one per event loop
+    for async code, as async connections cannot cross loops) and the
+    counters the pool balances and breaks circuits on.
+    """
+
+    def __init__(self, url, api='openai', api_key=None):
+        self.url = url
+        self.api = api
+        self.api_key = api_key or 'none'
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.consecutive_failures = 0
+        self.opened_at = None  # when the circuit breaker tripped
+        self.probing = False  # a half-open circuit's one trial request is in flight
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> client
+        self._lock = threading.Lock()
+
+    def _http_options(self):
+        limits = httpx.Limits(max_connections=settings.LLM_MAX_CONNECTIONS,
+                              max_keepalive_connections=settings.LLM_MAX_CONNECTIONS)
+        timeout = httpx.Timeout(settings.LLM_TIMEOUT_SECONDS, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS)
+        return limits, timeout
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                limits, timeout = self._http_options()
+                if self.api == 'ollama':
+                    self._client = ollama.Client(host=self.url, timeout=timeout, limits=limits)
+                else:
+                    self._client = openai.OpenAI(base_url=self.url, api_key=self.api_key, max_retries=0,
+                                                 timeout=timeout, http_client=httpx.Client(limits=limits))
+            return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                limits, timeout = self._http_options()
+                if self.api == 'ollama':
+                    client = ollama.AsyncClient(host=self.url, timeout=timeout, limits=limits)
+                else:
+                    client = openai.AsyncOpenAI(base_url=self.url, api_key=self.api_key, max_retries=0,
+                                                timeout=timeout, http_client=httpx.AsyncClient(limits=limits))
+                self._async_clients[loop] = client
+            return self._async_clients[loop]
+
+    def circuit(self, now):
+        if self.opened_at is None:
+            return 'closed'
+        # After the reset period, requests are let through again as a trial
+        return 'half-open' if now - self.opened_at >= settings.LLM_BREAKER_RESET_SECONDS else 'open'
+
+    def stats(self, now):
+        return {
+            'url': self.url,
+            'api': self.api,
+            'circuit': self.circuit(now),
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'mean_seconds': round(self.busy_seconds / self.requests, 3) if self.requests else None,
+        }
+
+
+class BackendPool:
+    """
+    The endpoints serving one role. Each request goes to the available
+    endpoint with the fewest requests in flight. A retryable failure is
+    retried on another endpoint after an exponential backoff; after
+    LLM_BREAKER_FAILURES consecutive failures an endpoint's circuit opens and
+    it gets no requests for LLM_BREAKER_RESET_SECONDS. Then a single trial
+    request goes through: its success closes the circuit, its failure opens
+    it again.
+    """
+
+    def __init__(self, role, model, endpoints, temperature=None):
+        self.role = role
+        self.model = model
+        self.temperature = temperature
+        self.endpoints = [Endpoint(**endpoint) for endpoint in endpoints]
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried):
+        now = time.monotonic()
+        with self._lock:
+            circuits = {e: e.circuit(now) for e in self.endpoints}
+            available = [e for e, circuit in circuits.items()
+                         if circuit == 'closed' or (circuit == 'half-open' and not e.probing)]
+            if not available:
+                raise BackendUnavailable(f"Every {self.role} endpoint is failing; "
+                                         f"retrying in at most {settings.LLM_BREAKER_RESET_SECONDS}s")
+            candidates = [e for e in available if e not in tried] or available
+            endpoint = min(candidates, key=lambda e: (e.outstanding, random.random()))
+            endpoint.outstanding += 1
+            endpoint.probing = circuits[endpoint] == 'half-open'
+            return endpoint
+
+    def _release(self, endpoint, started, failed=False):
+        """
+        failed: True for a failure the breaker counts, False for a success,
+        None when the request failed for its own sake (a bad request), which
+        says nothing about the endpoint's health.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            endpoint.busy_seconds += time.perf_counter() - started
+            probing, endpoint.probing = endpoint.probing, False
+            if failed is None:
+                return
+            if not failed:
+                endpoint.consecutive_failures = 0
+                endpoint.opened_at = None
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            if probing or endpoint.consecutive_failures >= settings.LLM_BREAKER_FAILURES:
+                if endpoint.opened_at is None:
+                    logger.warning("Opening circuit for %s endpoint %s", self.role, endpoint.url)
+                endpoint.opened_at = time.monotonic()
+
+    def _failed(self, endpoint, started, error, tried):
+        """Release after an error; returns whether to retry"""
+        retryable = is_retryable(error)
+        self._release(endpoint, started, failed=True if retryable else None)
+        if retryable:
+            tried.add(endpoint)
+            logger.warning("%s request to %s failed: %s", self.role, endpoint.url, error)
+        return retryable
+
+    def _backoff(self, attempt):
+        return settings.LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def _gave_up(self, tried, error):
+        return BackendUnavailable(f"{self.role} request failed on {len(tried)} endpoint(s): {error}")
+
+    def _run(self, call):
+        tried, error = set(), None
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(self._backoff(attempt - 1))
+            endpoint = self._acquire(tried)
+            started = time.perf_counter()
+            try:
+                with span(f'llm.{self.role}'):
+                    result = call(endpoint)
+            except Exception as e:
+                if not self._failed(endpoint, started, e, tried):
+                    raise
+                error = e
+                continue
+            self._release(endpoint, started)
+            return result
+        raise self._gave_up(tried, error) from error
+
+    async def _arun(self, call):
+        tried, error = set(), None
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff(attempt - 1))
+            endpoint = self._acquire(tried)
+            started = time.perf_counter()
+            try:
+                with span(f'llm.{self.role}'):
+                    result = await call(endpoint)
+            except Exception as e:
+                if not self._failed(endpoint, started, e, tried):
+                    raise
+                error = e
+                continue
+            self._release(endpoint, started)
+            return result
+        raise self._gave_up(tried, error) from error
+
+    def _ollama_options(self):
+        return {'temperature': self.temperature} if self.temperature is not None else None
+
+    def _openai_options(self):
+        return {'temperature': self.temperature} if self.temperature is not None else {}
+
+    def _ollama_reply(self, messages, response):
+        """The reply text of an Ollama chat response, recording its token counts"""
+        content = response["message"]["content"]
+        record_tokens(self.role, response.get("prompt_eval_count") or message_tokens(messages),
+                      response.get("eval_count") or estimate_tokens(content))
+        return content
+
+    def _openai_reply(self, messages, completion):
+        content = completion.choices[0].message.content
+        usage = completion.usage
+        record_tokens(self.role, usage.prompt_tokens if usage else message_tokens(messages),
+                      usage.completion_tokens if usage else estimate_tokens(content or ''))
+        return content
+
+    def chat(self, messages):
+        """The reply to a list of chat messages"""
+        def call(endpoint):
+            if endpoint.api == 'ollama':
+                response = endpoint.client.chat(model=self.model, messages=messages, options=self._ollama_options())
+                return self._ollama_reply(messages, response)
+            completion = endpoint.client.chat.completions.create(
+                model=self.model, messages=openai_messages(messages), **self._openai_options())
+            return self._openai_reply(messages, completion)
+        return self._run(call)
+
+    async def achat(self, messages):
+        async def call(endpoint):
+            if endpoint.api == 'ollama':
+                response = await endpoint.async_client.chat(model=self.model, messages=messages,
+                                                            options=self._ollama_options())
+                return self._ollama_reply(messages, response)
+            completion = await endpoint.async_client.chat.completions.create(
+                model=self.model, messages=openai_messages(messages), **self._openai_options())
+            return self._openai_reply(messages, completion)
+        return await self._arun(call)
+
+    def _vectors(self, inputs, vectors):
+        # Vectors cannot be matched to texts when some are missing; callers would store the wrong ones
+        if len(vectors) != len(inputs):
+            raise ValueError(f"Embedder returned {len(vectors)} vectors for {len(inputs)} texts")
+        return vectors
+
+    def embed(self, inputs):
+        """Embedding vectors (lists of floats) for a list of texts, in order"""
+        def call(endpoint):
+            if endpoint.api == 'ollama':
+                return endpoint.client.embed(model=self.model, input=inputs)["embeddings"]
+            response = endpoint.client.embeddings.create(model=self.model, input=inputs)
+            return [item.embedding for item in response.data]
+        return self._vectors(inputs, self._run(call))
+
+    async def aembed(self, inputs):
+        async def call(endpoint):
+            if endpoint.api == 'ollama':
+                return (await endpoint.async_client.embed(model=self.model, input=inputs))["embeddings"]
+            response = await endpoint.async_client.embeddings.create(model=self.model, input=inputs)
+            return [item.embedding for item in response.data]
+        return self._vectors(inputs, await self._arun(call))
+
+    def _tokens(self, endpoint, messages):
+        # Each streamed chunk carries about one token; Ollama's last chunk has the real counts
+        chunks, last = 0, {}
+        if endpoint.api == 'ollama':
+            for last in endpoint.client.chat(model=self.model, messages=messages, stream=True,
+                                             options=self._ollama_options()):
+                if last["message"]["content"]:
+                    chunks += 1
+                    yield last["message"]["content"]
+        else:
+            stream = endpoint.client.chat.completions.create(
+                model=self.model, messages=openai_messages(messages), stream=True, **self._openai_options())
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+        record_tokens(self.role, last.get("prompt_eval_count") or message_tokens(messages),
+                      last.get("eval_count") or chunks)
+
+    async def _atokens(self, endpoint, messages):
+        chunks, last = 0, {}
+        if endpoint.api == 'ollama':
+            async for last in await endpoint.async_client.chat(model=self.model, messages=messages, stream=True,
+                                                               options=self._ollama_options()):
+                if last["message"]["content"]:
+                    chunks += 1
+                    yield last["message"]["content"]
+        else:
+            stream = await endpoint.async_client.chat.completions.create(
+                model=self.model, messages=openai_messages(messages), stream=True, **self._openai_options())
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+        record_tokens(self.role, last.get("prompt_eval_count") or message_tokens(messages),
+                      last.get("eval_count") or chunks)
+
+    def stream_chat(self, messages):
+        """
+        Yield the reply token by token. Failures before the first token are
+        retried like other requests; once tokens were sent the error is raised.
+        """
+        tried, error = set(), None
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(self._backoff(attempt - 1))
+            endpoint = self._acquire(tried)
+            started = time.perf_counter()
+            tokens = self._tokens(endpoint, messages)
+            try:
+                first = next(tokens, None)
+            except Exception as e:
+                if not self._failed(endpoint, started, e, tried):
+                    raise
+                error = e
+                continue
+            failed = False
+            try:
+                if first is not None:
+                    yield first
+                yield from tokens
+            except Exception as e:
+                failed = True if is_retryable(e) else None
+                raise
+            finally:
+                record(f'llm.{self.role}', time.perf_counter() - started)
+                self._release(endpoint, started, failed=failed)
+            return
+        raise self._gave_up(tried, error) from error
+
+    async def astream_chat(self, messages):
+        tried, error = set(), None
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff(attempt - 1))
+            endpoint = self._acquire(tried)
+            started = time.perf_counter()
+            tokens = self._atokens(endpoint, messages)
+            try:
+                first = await anext(tokens, None)
+            except Exception as e:
+                if not self._failed(endpoint, started, e, tried):
+                    raise
+                error = e
+                continue
+            failed = False
+            try:
+                if first is not None:
+                    yield first
+                async for token in tokens:
+                    yield token
+            except Exception as e:
+                failed = True if is_retryable(e) else None
+                raise
+            finally:
+                record(f'llm.{self.role}', time.perf_counter() - started)
+                self._release(endpoint, started, failed=failed)
+            return
+        raise self._gave_up(tried, error) from error
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {'model': self.model, 'endpoints': [endpoint.stats(now) for endpoint in self.endpoints]}
+
+
+class Backends:
+    """The BackendPool of each role in settings.LLM_BACKENDS, created on first use"""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, role):
+        with self._lock:
+            if role not in self._pools:
+                config = settings.LLM_BACKENDS[role]
+                self._pools[role] = BackendPool(role, config['model'], config['endpoints'],
+                                                temperature=config.get('temperature'))
+            return self._pools[role]
+
+    def stats(self):
+        return {role: self[role].stats() for role in settings.LLM_BACKENDS}
+
+
+llm_backends = Backends()
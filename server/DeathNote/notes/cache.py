@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+EVICT_CHECK_EVERY = 64  # disk writes between size checks
+
+
+class LRUCache:
+    """Bounded in-process mapping that drops the least recently used entry first"""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    Persistent bytes store in its own SQLite file, evicting the least recently
+    read entries once the stored values exceed max_bytes. Entries written
+    under a different version are dropped when the file is opened.
+    """
+
+    def __init__(self, path, max_bytes, version=''):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.version = version
+        self._conn = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                         "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                conn.execute("DELETE FROM entries")
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            return bytes(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                         (key, value, len(value), time.time()))
+            self._writes += 1
+            if self._writes % EVICT_CHECK_EVERY == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop the oldest entries until back under 90% of the budget
+        excess = total - int(0.9 * self.max_bytes)
+        cutoff = conn.execute(
+            "SELECT accessed FROM (SELECT accessed, SUM(size) OVER (ORDER BY accessed) AS running "
+            "FROM entries) WHERE running >= ? LIMIT 1", (excess,)).fetchone()
+        if cutoff is not None:
+            conn.execute("DELETE FROM entries WHERE accessed <= ?", cutoff)
+
+    def size(self):
+        with self._lock:
+            row = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'entries': row[0], 'bytes': row[1]}
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM entries")
+
+
+class TwoTierCache:
+    """
+    In-process LRU in front of a DiskCache, with hit/miss counters. Values
+    are bytes; what they encode is up to the caller.
+    """
+
+    def __init__(self, path, max_items, max_bytes, version=''):
+        self.memory = LRUCache(max_items)
+        self.disk = DiskCache(path, max_bytes, version)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        value = self.disk.get(key)
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': len(self.memory),
+            'disk': self.disk.size(),
+        }
+
+
+class ResultCache:
+    """
+    TwoTierCache of JSON-serializable results that also stores how long each
+    one took to compute, so hits can report the time they saved.
+    """
+
+    def __init__(self, path, max_items, max_bytes, version=''):
+        self.cache = TwoTierCache(path, max_items, max_bytes, version)
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        entry = json.loads(value)
+        with self._lock:
+            self.seconds_saved += entry['seconds']
+        return entry['result']
+
+    def set(self, key, result, seconds):
+        self.cache.set(key, json.dumps({'result': result, 'seconds': seconds}).encode())
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return {**self.cache.stats(), 'seconds_saved': round(self.seconds_saved, 2)}
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+
+from .backends import llm_backends
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCoalescer:
+    """
+    Merges the single texts that concurrent requests want embedded into
+    batched embed calls. A dispatcher thread takes the first waiting text,
+    keeps collecting for EMBED_BATCH_WINDOW_MS or until EMBED_MAX_BATCH texts
+    are waiting, and sends them in one call; each caller waits on a Future for
+    its own vector. At most EMBED_MAX_INFLIGHT batches are out at once, and
+    texts arriving meanwhile join the next one, so batches grow with load.
+    """
+
+    def __init__(self, role='embed'):
+        self.role = role
+        self._queue = queue.SimpleQueue()  # (text, future, enqueued at)
+        self._pending = {}  # text -> Future, so identical texts in flight share one slot
+        self._lock = threading.Lock()
+        self._slots = None
+        self._executor = None
+        self.requests = 0
+        self.shared = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.largest_batch = 0
+        self.wait_seconds = 0.0
+
+    def _start(self):
+        # Called with self._lock held
+        if self._executor is None:
+            self._slots = threading.BoundedSemaphore(settings.EMBED_MAX_INFLIGHT)
+            self._executor = ThreadPoolExecutor(max_workers=settings.EMBED_MAX_INFLIGHT,
+                                                thread_name_prefix='embed-batch')
+            threading.Thread(target=self._dispatch, name='embed-coalescer', daemon=True).start()
+
+    def submit(self, text):
+        """Queue a text; the Future resolves to its embedding (a list of floats)"""
+        with self._lock:
+            self._start()
+            self.requests += 1
+            future = self._pending.get(text)
+            if future is not None:
+                self.shared += 1
+                return future
+            future = self._pending[text] = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    async def aembed(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        """Block for the first waiting text, then gather more until the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        max_batch = settings.EMBED_MAX_BATCH
+        deadline = time.perf_counter() + settings.EMBED_BATCH_WINDOW_MS / 1000
+        while len(batch) < max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        self._slots.acquire()
+        # Texts that arrived while every slot was busy ride along without further waiting
+        while len(batch) < max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            now = time.perf_counter()
+            with self._lock:
+                self.batches += 1
+                self.batched_texts += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.wait_seconds += sum(now - enqueued for _, _, enqueued in batch)
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            # Raises when the embedder returns fewer vectors than texts; every future then fails
+            vectors = llm_backends[self.role].embed([text for text, _, _ in batch])
+        except Exception as e:
+            logger.warning("Batched embed of %d texts failed: %s", len(batch), e)
+            results = [(future, None, e) for _, future, _ in batch]
+        else:
+            results = [(future, vector, None) for (_, future, _), vector in zip(batch, vectors)]
+        finally:
+            self._slots.release()
+        with self._lock:
+            for text, _, _ in batch:
+                self._pending.pop(text, None)
+        for future, vector, error in results:
+            if error is None:
+                future.set_result(vector)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'shared': self.shared,
+                'batches': self.batches,
+                'mean_batch': round(self.batched_texts / self.batches, 2) if self.batches else None,
+                'largest_batch': self.largest_batch,
+                'mean_wait_ms': round(1000 * self.wait_seconds / self.batched_texts, 2) if self.batched_texts else None,
+            }
+
+
+embed_coalescer = EmbeddingCoalescer()
@@ -0,0 +1,222 @@
+"""
+Bounded parse_entry context from a long diary. The latest past summaries go
+in verbatim; older ones are condensed into one digest per day, and days
+further back are rolled up into weekly, then monthly digests made from those
+day digests. Digests are stored under the hash of their inputs (Digest.key),
+so each is generated once, and a new summary only changes the digests of the
+periods it falls in. Periods whose summaries already fit
+SUMMARY_DIGEST_MAX_TOKENS go in as they are, without an LLM call.
+
+Requests only read stored digests. A missing one is stood in for by the
+start of its text, and the missing digests are generated in the background
+on the enrichment pool, for the next entry.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+
+from .enrichment import enrichment_queue
+from .metrics import estimate_tokens
+from .models import Digest
+from .utils import DIGEST_PROMPT_VERSION, TIMESTAMP_FORMAT, digest_summaries
+
+logger = logging.getLogger(__name__)
+
+# The app formats summary timestamps with Intl.DateTimeFormat('en-US'): "Saturday, March 1,
+# 2025 at 11:23 PM", depending on the platform with ", " for " at " and U+202F before PM
+CLIENT_TIME_SEPARATOR = re.compile(r'(?:,| at)\s+(?=\d{1,2}:\d{2})')
+DATE_FORMAT = '%A, %B %d, %Y'
+
+_scheduled = set()  # keys of the digests being generated in the background
+_scheduled_lock = threading.Lock()
+
+
+def normalize_timestamp(text):
+    """A client-formatted timestamp in format_timestamp's format"""
+    text = " ".join(text.replace('\u202f', ' ').replace('\xa0', ' ').split())
+    return CLIENT_TIME_SEPARATOR.sub(' ', text)
+
+
+def entry_date(timestamp):
+    """
+    Calendar date of a note or summary timestamp: milliseconds since the
+    epoch, ISO 8601, format_timestamp's format or the app's. None when
+    unreadable.
+    """
+    if timestamp is None or timestamp == '':
+        return None
+    text = str(timestamp).strip()
+    try:
+        if isinstance(timestamp, (int, float)) or text.lstrip('-').isdigit():
+            return datetime.fromtimestamp(int(timestamp) / 1000).date()  # local time, like format_timestamp
+        return datetime.fromisoformat(text).date()
+    except (ValueError, OverflowError, OSError):
+        pass
+    text = normalize_timestamp(text)
+    for date_format in (TIMESTAMP_FORMAT, DATE_FORMAT):
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def months_before(day, months):
+    """First day of the month `months` months before day's"""
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return date(year, month + 1, 1)
+
+
+def format_summary(summary):
+    return f"{summary['timestamp']}:\n <title>{summary['title']}</title> <summary>{summary['summary']}</summary>"
+
+
+def needs_digest(parts):
+    return sum(estimate_tokens(part) for part in parts) > settings.SUMMARY_DIGEST_MAX_TOKENS
+
+
+def digest_key(level, period, parts):
+    return hashlib.sha256(json.dumps([DIGEST_PROMPT_VERSION, level, period, parts]).encode()).hexdigest()
+
+
+def condense(level, period_start, period, parts, generate=True):
+    """
+    Digest text of a period's parts, from the Digest table or, with
+    generate, the LLM. None when it is not stored and generate is false.
+    """
+    key = digest_key(level, period, parts)
+    digest = Digest.objects.filter(key=key).first()
+    if digest is None:
+        if not generate:
+            return None
+        source_tokens = sum(estimate_tokens(part) for part in parts)
+        started = time.perf_counter()
+        text = digest_summaries(period, parts)
+        digest, _ = Digest.objects.get_or_create(key=key, defaults={
+            'level': level, 'period_start': period_start, 'text': text, 'source_tokens': source_tokens})
+        logger.info("Digested %s (%d parts, ~%d tokens) into ~%d tokens in %.1fs", period, len(parts),
+                    source_tokens, estimate_tokens(text), time.perf_counter() - started)
+    return digest.text
+
+
+def truncate(parts):
+    """Stand-in for a digest not generated yet: the first SUMMARY_DIGEST_MAX_WORDS words of its parts"""
+    words = " ".join(parts).split()
+    text = " ".join(words[:settings.SUMMARY_DIGEST_MAX_WORDS])
+    return text + " ..." if len(words) > settings.SUMMARY_DIGEST_MAX_WORDS else text
+
+
+def refresh_digests(old_summaries, timestamp, keys):
+    """Generate the digests summary_memory found missing (on the enrichment pool)"""
+    try:
+        summary_memory(old_summaries, timestamp, generate=True)
+    finally:
+        with _scheduled_lock:
+            _scheduled.difference_update(keys)
+
+
+def digest_block(period, text):
+    return f"Digest of {period}:\n <summary>{text}</summary>"
+
+
+def summary_memory(old_summaries, timestamp=None, generate=False):
+    """
+    The old summaries (oldest first, as sent to api/notes/summarize/) as
+    blocks of parse_entry context, oldest first. Relative to the entry's
+    timestamp: the SUMMARY_MEMORY_RECENT latest summaries verbatim, then
+    day digests for the last SUMMARY_MEMORY_DAYS days, week digests back to
+    SUMMARY_MEMORY_WEEKS weeks and month digests back to
+    SUMMARY_MEMORY_MONTHS months. Anything older is left out, and so are
+    summaries whose date cannot be read beyond the SUMMARY_MEMORY_UNDATED
+    latest, which go in verbatim after the digests. Without generate, digests
+    that are not stored yet are truncated text, and are generated in the
+    background.
+    """
+    recent_count = min(settings.SUMMARY_MEMORY_RECENT, len(old_summaries))
+    recent = old_summaries[len(old_summaries) - recent_count:]
+    older = old_summaries[:len(old_summaries) - recent_count]
+    reference = entry_date(timestamp) or date.today()
+    oldest = months_before(reference, settings.SUMMARY_MEMORY_MONTHS)
+    first_daily = reference - timedelta(days=settings.SUMMARY_MEMORY_DAYS)
+    first_weekly = week_start(reference) - timedelta(weeks=settings.SUMMARY_MEMORY_WEEKS)
+
+    by_day = defaultdict(list)
+    undated = []
+    for summary in older:
+        day = entry_date(summary.get('timestamp'))
+        if day is None:
+            undated.append(format_summary(summary))
+        elif day >= oldest:
+            by_day[day].append(format_summary(summary))
+
+    missing = set()
+
+    def digest(level, start, period, parts):
+        """Digest text of the parts; truncated when it is not stored yet"""
+        text = condense(level, start, period, parts, generate)
+        if text is None:
+            missing.add(digest_key(level, period, parts))
+            text = truncate(parts)
+        return text
+
+    # Each day as one digest, or its summaries as they are when they are short
+    day_blocks, day_texts = {}, {}
+    for day, parts in by_day.items():
+        period = day.strftime(DATE_FORMAT)
+        if needs_digest(parts):
+            day_texts[day] = digest(Digest.DAY, day, period, parts)
+            day_blocks[day] = [digest_block(period, day_texts[day])]
+        else:
+            day_texts[day] = "\n".join(parts)
+            day_blocks[day] = parts
+
+    groups = defaultdict(list)  # (level, period start) -> days, rolled up from the day digests
+    for day in sorted(by_day):
+        if day >= first_daily:
+            groups[(Digest.DAY, day)].append(day)
+        elif day >= first_weekly:
+            groups[(Digest.WEEK, week_start(day))].append(day)
+        else:
+            groups[(Digest.MONTH, day.replace(day=1))].append(day)
+
+    blocks = []
+    for (level, start), days in sorted(groups.items(), key=lambda item: item[1][0]):
+        if level == Digest.DAY:
+            blocks.extend(day_blocks[days[0]])
+            continue
+        period = f"the week of {start:%B %d, %Y}" if level == Digest.WEEK else f"{start:%B %Y}"
+        parts = [f"{day:%A, %B %d}: {day_texts[day]}" for day in days]
+        if needs_digest(parts):
+            blocks.append(digest_block(period, digest(level, start, period, parts)))
+        else:
+            blocks.extend(block for day in days for block in day_blocks[day])
+
+    if missing:
+        with _scheduled_lock:
+            new = missing - _scheduled
+            _scheduled.update(new)
+        if new:
+            logger.info("parse_entry memory: generating %d digests in the background", len(new))
+            enrichment_queue.defer(refresh_digests, old_summaries, timestamp, new)
+
+    if len(undated) > settings.SUMMARY_MEMORY_UNDATED:
+        logger.warning("parse_entry memory: left out %d summaries with unreadable timestamps",
+                       len(undated) - settings.SUMMARY_MEMORY_UNDATED)
+        undated = undated[len(undated) - settings.SUMMARY_MEMORY_UNDATED:]
+    blocks.extend(undated)
+    blocks.extend(format_summary(summary) for summary in recent)
+    logger.info("parse_entry memory: %d summaries (~%d tokens) as %d blocks (~%d tokens)",
+                len(old_summaries), sum(estimate_tokens(format_summary(s)) for s in old_summaries),
+                len(blocks), sum(estimate_tokens(block) for block in blocks))
+    return blocks
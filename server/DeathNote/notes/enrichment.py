@@ -0,0 +1,119 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .indexing import index_note
+from .models import Note
+from .utils import get_title, submit_embedding
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentQueue:
+    """
+    Gives saved notes their missing title and embedding on a local thread
+    pool, so create_note and import_notes return as soon as the rows exist.
+    Other LLM work that requests should not wait for (digests of past
+    summaries) runs on the same pool through defer.
+    The work to do is the note's enrichment_status, so pending notes (and
+    running ones, whose process may have died; enriching twice is harmless)
+    are picked up again when the queue starts in a new process.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.enriched = 0
+        self.failed = 0
+
+    def start(self):
+        """Create the worker pool and requeue unfinished notes (once per process)"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=settings.ENRICHMENT_WORKERS,
+                                                thread_name_prefix='enrich')
+        unfinished = Note.objects.filter(enrichment_status__in=[Note.PENDING, Note.RUNNING])
+        unfinished.update(enrichment_status=Note.PENDING)
+        for note_id in unfinished.order_by('id').values_list('id', flat=True):
+            self._executor.submit(self._run, note_id)
+
+    def submit(self, note_id):
+        """Queue a note saved with enrichment_status PENDING"""
+        self.start()
+        self._executor.submit(self._run, note_id)
+
+    def defer(self, function, *args):
+        """Run function(*args) on the pool, with its own database connection"""
+        self.start()
+        self._executor.submit(self._call, function, *args)
+
+    def _call(self, function, *args):
+        close_old_connections()
+        try:
+            function(*args)
+        except Exception:
+            logger.exception("Background %s failed", function.__name__)
+        finally:
+            connection.close()
+
+    def retry(self, note):
+        """Queue a failed note again. Returns False when it is not failed"""
+        if not Note.objects.filter(id=note.id, enrichment_status=Note.FAILED).update(
+                enrichment_status=Note.PENDING, enrichment_error=''):
+            return False
+        self.submit(note.id)
+        return True
+
+    def _run(self, note_id):
+        close_old_connections()
+        try:
+            # Claim the note; another worker may have taken it already
+            if not Note.objects.filter(id=note_id, enrichment_status=Note.PENDING).update(
+                    enrichment_status=Note.RUNNING):
+                return
+            content, title, stored = Note.objects.values_list('content', 'title', 'embeddings').get(id=note_id)
+            # Only what is missing (imports bring embeddings); the embedding joins the
+            # coalescer's next batch while the title is generated
+            embedding = submit_embedding(content) if stored is None or not len(stored) else None
+            # Each part is kept when it succeeds, so a retry only redoes the one that failed
+            fields, errors = {}, []
+            if not title:
+                try:
+                    fields['title'] = get_title(content)
+                except Exception as e:
+                    logger.exception("Titling note %s failed", note_id)
+                    errors.append(f"title: {e}")
+            if embedding is not None:
+                try:
+                    fields['embeddings'] = embedding.result()
+                except Exception as e:
+                    logger.exception("Embedding note %s failed", note_id)
+                    errors.append(f"embedding: {e}")
+            if errors:
+                fields['enrichment_status'] = Note.FAILED
+                fields['enrichment_error'] = "; ".join(errors)
+                self.failed += 1
+            else:
+                fields['enrichment_status'] = Note.DONE
+                self.enriched += 1
+            # The note may have been deleted meanwhile; update() then touches nothing
+            if Note.objects.filter(id=note_id).update(**fields) and 'embeddings' in fields:
+                index_note(note_id, fields['embeddings'])
+        except Note.DoesNotExist:
+            pass
+        finally:
+            connection.close()
+
+    def stats(self):
+        return {
+            'workers': settings.ENRICHMENT_WORKERS,
+            'enriched': self.enriched,
+            'failed': self.failed,
+        }
+
+
+enrichment_queue = EnrichmentQueue()
@@ -0,0 +1,154 @@
+"""
+A stand-in LLM server for tests and load experiments: speaks enough of the
+OpenAI-compatible and Ollama HTTP APIs for notes.backends (chat, streaming
+chat, embeddings) and answers deterministically after a configurable delay,
+serving at most `slots` requests at a time like a single GPU would.
+"""
+import functools
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=65536)
+def word_vector(word, dim):
+    seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    vector.flags.writeable = False
+    return vector
+
+
+def fake_embedding(text, dim):
+    """Bag-of-words unit vector (float32): texts sharing words point the same way, equal texts embed equally"""
+    vector = np.sum([word_vector(word, dim) for word in text.lower().split() or ['']], axis=0)
+    return vector / np.linalg.norm(vector)
+
+
+def fake_reply(messages):
+    """A reply in the shape each prompt of notes.utils asks for"""
+    system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+    last = messages[-1]['content'] if messages else ''
+    if isinstance(last, list):  # OpenAI content parts
+        last = " ".join(part.get('text', '') for part in last)
+    if '<title>' in system:
+        return f"<title> Fake title </title> <summary> Fake commentary on {len(last)} characters. </summary>"
+    return f"Fake reply to: {last[:60]}"
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.2, token_latency=0.005, slots=1, dim=1024, fail_rate=0.0):
+        super().__init__(address, FakeLLMHandler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.dim = dim
+        self.fail_rate = fail_rate
+        self.slots = threading.BoundedSemaphore(slots)
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        with server.slots:
+            server.requests += 1
+            time.sleep(server.latency)
+            if random.random() < server.fail_rate:
+                return self._send_json({'error': 'fake overload'}, status=503)
+            routes = {
+                '/v1/chat/completions': self._openai_chat,
+                '/v1/embeddings': self._openai_embeddings,
+                '/api/chat': self._ollama_chat,
+                '/api/embed': self._ollama_embed,
+            }
+            handler = routes.get(self.path.split('?')[0])
+            if handler is None:
+                return self._send_json({'error': f'unknown path {self.path}'}, status=404)
+            handler(request)
+
+    def _tokens(self, request):
+        for word in fake_reply(request.get('messages', [])).split(' '):
+            time.sleep(self.server.token_latency)
+            yield word + ' '
+
+    def _openai_chat(self, request):
+        base = {'id': 'fake', 'created': int(time.time()), 'model': request.get('model', 'fake')}
+        if not request.get('stream'):
+            content = "".join(self._tokens(request)).strip()
+            return self._send_json({**base, 'object': 'chat.completion', 'choices': [
+                {'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}]})
+        self._start_stream('text/event-stream')
+        for token in self._tokens(request):
+            chunk = {**base, 'object': 'chat.completion.chunk',
+                     'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _openai_embeddings(self, request):
+        inputs = request.get('input', [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self._send_json({'object': 'list', 'model': request.get('model', 'fake'),
+                         'data': [{'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, self.server.dim).tolist()}
+                                  for i, text in enumerate(inputs)],
+                         'usage': {'prompt_tokens': 0, 'total_tokens': 0}})
+
+    def _ollama_chat(self, request):
+        base = {'model': request.get('model', 'fake'), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        if not request.get('stream', True):
+            content = "".join(self._tokens(request)).strip()
+            return self._send_json({**base, 'message': {'role': 'assistant', 'content': content}, 'done': True})
+        self._start_stream('application/x-ndjson')
+        for token in self._tokens(request):
+            line = {**base, 'message': {'role': 'assistant', 'content': token}, 'done': False}
+            self._write_chunk(json.dumps(line).encode() + b"\n")
+        self._write_chunk(json.dumps({**base, 'message': {'role': 'assistant', 'content': ''}, 'done': True}).encode() + b"\n")
+        self._write_chunk(b"")
+
+    def _ollama_embed(self, request):
+        inputs = request.get('input', [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self._send_json({'model': request.get('model', 'fake'),
+                         'embeddings': [fake_embedding(text, self.server.dim).tolist() for text in inputs]})
+
+
+def start_fake_server(host='127.0.0.1', port=0, **options):
+    """Serve a FakeLLMServer from a background thread (port 0: any free port)"""
+    server = FakeLLMServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
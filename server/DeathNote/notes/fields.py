@@ -0,0 +1,77 @@
+import base64
+import struct
+
+import numpy as np
+from django.db import models
+
+# Blob layout: magic, dtype code, padding, dimension, then the raw little-endian values
+HEADER = struct.Struct('<2sBxI')
+MAGIC = b'EV'
+DTYPES = {1: np.dtype('<f2'), 2: np.dtype('<f4')}
+DTYPE_CODES = {'float16': 1, 'float32': 2}
+
+
+def encode_embedding(vector, dtype='float32'):
+    """Pack a vector into the header + raw values blob stored in the database"""
+    code = DTYPE_CODES[dtype]
+    values = np.asarray(vector, dtype=DTYPES[code]).ravel()
+    return HEADER.pack(MAGIC, code, values.shape[0]) + values.tobytes()
+
+
+def decode_embedding(blob):
+    """
+    Unpack a blob into a read-only float array. The array is a view on the
+    blob's buffer, so no values are copied or parsed.
+    """
+    if len(blob) < HEADER.size:
+        raise ValueError("Not an embedding blob")
+    magic, code, dim = HEADER.unpack_from(blob)
+    if magic != MAGIC or code not in DTYPES:
+        raise ValueError("Not an embedding blob")
+    return np.frombuffer(blob, dtype=DTYPES[code], count=dim, offset=HEADER.size)
+
+
+class EmbeddingField(models.BinaryField):
+    """
+    Vector embedding stored as a compact binary blob (float32 or float16 with
+    a dimension/dtype header) and loaded as a NumPy array.
+    """
+
+    def __init__(self, *args, storage_dtype='float32', **kwargs):
+        if storage_dtype not in DTYPE_CODES:
+            raise ValueError(f"Unsupported storage_dtype: {storage_dtype}")
+        self.storage_dtype = storage_dtype
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.storage_dtype != 'float32':
+            kwargs['storage_dtype'] = self.storage_dtype
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decode_embedding(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):
+            value = base64.b64decode(value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return decode_embedding(value)
+        return np.asarray(value, dtype=np.float32)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return super().get_prep_value(value)
+        if not len(value):
+            return None
+        return super().get_prep_value(encode_embedding(value, self.storage_dtype))
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        if value is None:
+            return None
+        return base64.b64encode(encode_embedding(value, self.storage_dtype)).decode('ascii')
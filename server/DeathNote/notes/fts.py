@@ -0,0 +1,54 @@
+import re
+
+from django.db import connection
+
+from .models import Note
+
+FTS_TABLE = 'notes_note_fts'  # created by migration 0010 on SQLite
+TITLE_WEIGHT = 2.0  # BM25 weight of a title match relative to a content match
+CONTENT_WEIGHT = 1.0
+
+WORD = re.compile(r'\w+')
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for free text: each word as a quoted prefix term,
+    any of them matching, so user input never hits FTS5 query syntax. None
+    when the query has no words.
+    """
+    words = WORD.findall(query.lower())
+    return " OR ".join(f'"{word}"*' for word in words) or None
+
+
+def keyword_search(query, limit, since=None, until=None, unenriched=False):
+    """
+    Up to `limit` (note_id, score) pairs for notes whose title or content
+    contain words of the query, best BM25 match first (higher scores are
+    better), optionally within since <= timestamp < until. With unenriched,
+    only notes still waiting for their embedding (see notes.enrichment).
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    sql = [f"SELECT n.id, -bm25({FTS_TABLE}, %s, %s) AS score FROM {FTS_TABLE} "
+           f"JOIN notes_note n ON n.id = {FTS_TABLE}.rowid WHERE {FTS_TABLE} MATCH %s"]
+    params = [TITLE_WEIGHT, CONTENT_WEIGHT, expression]
+    if since is not None:
+        sql.append("AND n.timestamp >= %s")
+        params.append(connection.ops.adapt_datetimefield_value(since))
+    if until is not None:
+        sql.append("AND n.timestamp < %s")
+        params.append(connection.ops.adapt_datetimefield_value(until))
+    if unenriched:
+        sql.append("AND n.enrichment_status != %s")
+        params.append(Note.DONE)
+    sql.append("ORDER BY score DESC LIMIT %s")
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(" ".join(sql), params)
+        return [(note_id, score) for note_id, score in cursor.fetchall()]
@@ -0,0 +1,111 @@
+import io
+import logging
+import threading
+import time
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+MIN_QUALITY = 40  # lowest JPEG quality tried to get under max_bytes
+
+
+class PreprocessStats:
+    """Totals over the images preprocessed by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pixels_in = 0
+        self.pixels_out = 0
+        self.seconds = 0.0
+
+    def record(self, bytes_in, bytes_out, pixels_in, pixels_out, seconds):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.pixels_in += pixels_in
+            self.pixels_out += pixels_out
+            self.seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'images': self.images,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved': self.bytes_in - self.bytes_out,
+                'pixels_in': self.pixels_in,
+                'pixels_out': self.pixels_out,
+                'preprocess_seconds': round(self.seconds, 3),
+            }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def read_image_bytes(image):
+    """image: a file path or the raw bytes of an image file"""
+    if isinstance(image, bytes):
+        return image
+    with open(image, 'rb') as f:
+        return f.read()
+
+
+def encode_jpeg(img, quality, max_bytes):
+    """JPEG bytes at the highest quality, from `quality` down, that fits max_bytes"""
+    while True:
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if max_bytes is None or buffer.tell() <= max_bytes or quality <= MIN_QUALITY:
+            return buffer.getvalue()
+        quality -= 10
+
+
+@span('image.preprocess')
+def preprocess_image(image, model):
+    """
+    Shrink an image to what the vision model actually looks at, following
+    IMAGE_PREPROCESSING[model]: rotate it upright from its EXIF orientation,
+    fit it within max_side pixels, and re-encode it as a JPEG within
+    max_bytes, which also drops EXIF/GPS metadata. Returns the bytes to send;
+    models without a config, and small images the re-encode would only grow,
+    get the image unchanged.
+    """
+    config = settings.IMAGE_PREPROCESSING.get(model)
+    if config is None:
+        return image
+    started = time.perf_counter()
+    data = read_image_bytes(image)
+    try:
+        img = Image.open(io.BytesIO(data))
+        pixels_in = img.width * img.height
+        has_exif = bool(img.getexif())
+        # JPEGs can be decoded straight at a reduced scale, far cheaper than a full decode
+        img.draft('RGB', (config['max_side'], config['max_side']))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha: flatten transparency onto white
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.convert('RGBA').getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((config['max_side'], config['max_side']), Image.LANCZOS)
+        out = encode_jpeg(img, config.get('quality', 85), config.get('max_bytes'))
+        if len(out) >= len(data) and not has_exif and img.width * img.height == pixels_in:
+            out = data  # already small and clean; re-encoding would only grow it
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning("Could not preprocess image for %s, sending it unchanged", model, exc_info=True)
+        return data
+    seconds = time.perf_counter() - started
+    preprocess_stats.record(len(data), len(out), pixels_in, img.width * img.height, seconds)
+    logger.info("Preprocessed image for %s: %d -> %d bytes, %d -> %dx%d px in %.0f ms",
+                model, len(data), len(out), pixels_in, img.width, img.height, seconds * 1000)
+    return out
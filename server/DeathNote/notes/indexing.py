@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .ann import ann_index
+from .quantized import quantized_indexes
+from .vector_index import embedding_matrix
+
+
+def similarity_index():
+    """
+    The index serving exact-mode, hybrid and time-range searches: the float
+    matrix, or the SEARCH_QUANTIZATION codes (with exact rerank) when
+    SEARCH_FLOAT_MATRIX is off.
+    """
+    if settings.SEARCH_FLOAT_MATRIX:
+        return embedding_matrix
+    if settings.SEARCH_QUANTIZATION not in quantized_indexes:
+        raise ImproperlyConfigured("SEARCH_FLOAT_MATRIX = False needs SEARCH_QUANTIZATION set to 'int8' or 'binary'")
+    return quantized_indexes[settings.SEARCH_QUANTIZATION]
+
+
+def index_note(note_id, embedding):
+    """Add or refresh a note in every in-memory search index"""
+    if settings.SEARCH_FLOAT_MATRIX:
+        embedding_matrix.add(note_id, embedding)
+    for index in quantized_indexes.values():
+        index.add(note_id, embedding)
+    ann_index.add(note_id, embedding)
+
+
+def unindex_note(note_id):
+    """Remove a deleted note from every in-memory search index"""
+    if settings.SEARCH_FLOAT_MATRIX:
+        embedding_matrix.remove(note_id)
+    for index in quantized_indexes.values():
+        index.remove(note_id)
+    ann_index.remove(note_id)
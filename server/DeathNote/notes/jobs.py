@@ -0,0 +1,160 @@
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import SummarizeJob
+from .pipeline import summarize_note
+
+logger = logging.getLogger(__name__)
+
+
+def job_media_dir(job_id):
+    return os.path.join(settings.SUMMARIZE_JOB_MEDIA_DIR, str(job_id))
+
+
+class JobQueue:
+    """
+    Runs SummarizeJob rows on a local thread pool. Jobs live in the database
+    and the queue starts with the server (NotesConfig.ready), so queued jobs
+    survive a restart. While a job runs, a heartbeat refreshes its updated_at
+    every SUMMARIZE_JOB_HEARTBEAT_SECONDS; a running job left unrefreshed for
+    SUMMARIZE_JOB_STALE_SECONDS lost its worker and is requeued by whichever
+    process notices first.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._running = set()  # ids of the jobs this process's workers hold
+        self._stopped = None
+
+    def start(self):
+        """Create the worker pool and the heartbeat, which picks up unfinished jobs (once per process)"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=settings.SUMMARIZE_WORKERS,
+                                                thread_name_prefix='summarize')
+            self._stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(self._stopped,), name='summarize-heartbeat', daemon=True).start()
+
+    def stop(self):
+        """Stop the heartbeat and wait for the running jobs"""
+        with self._lock:
+            if self._executor is None:
+                return
+            self._stopped.set()
+            executor, self._executor = self._executor, None
+        executor.shutdown(wait=True)
+
+    def _heartbeat(self, stopped):
+        first = True
+        while True:
+            close_old_connections()
+            try:
+                if first:
+                    # Queued jobs of an earlier process
+                    for job_id in SummarizeJob.objects.filter(status=SummarizeJob.QUEUED).order_by('created_at').values_list('id', flat=True):
+                        self._executor.submit(self._run, job_id)
+                    first = False
+                self.beat()
+            except Exception:
+                logger.exception("Summarize job heartbeat failed")
+            finally:
+                connection.close()
+            if stopped.wait(settings.SUMMARIZE_JOB_HEARTBEAT_SECONDS):
+                return
+
+    def beat(self):
+        """Refresh this process's running jobs and requeue the running jobs nobody refreshes"""
+        with self._lock:
+            running = list(self._running)
+        now = timezone.now()
+        if running:
+            SummarizeJob.objects.filter(id__in=running, status=SummarizeJob.RUNNING).update(updated_at=now)
+        stale = now - timedelta(seconds=settings.SUMMARIZE_JOB_STALE_SECONDS)
+        abandoned = SummarizeJob.objects.filter(status=SummarizeJob.RUNNING, updated_at__lt=stale).exclude(id__in=running)
+        for job_id in abandoned.values_list('id', flat=True):
+            # Conditional, so only one process requeues (and runs) it
+            if SummarizeJob.objects.filter(id=job_id, status=SummarizeJob.RUNNING, updated_at__lt=stale).update(
+                    status=SummarizeJob.QUEUED):
+                logger.warning("Requeuing summarize job %s, whose worker stopped", job_id)
+                self._executor.submit(self._run, job_id)
+
+    def submit(self, note_data, user_settings, old_summaries, files, idempotency_key=None):
+        """
+        Persist a job with its uploaded files and queue it. Returns (job, created);
+        an idempotency key that was already used returns the existing job instead.
+        """
+        self.start()
+        if idempotency_key:
+            existing = SummarizeJob.objects.filter(idempotency_key=idempotency_key).first()
+            if existing is not None:
+                return existing, False
+        job = SummarizeJob(idempotency_key=idempotency_key or None, note_data=note_data,
+                           settings=user_settings, previous_summaries=old_summaries)
+        media_dir = job_media_dir(job.id)
+        os.makedirs(media_dir, exist_ok=True)
+        for field_name, uploaded_file in files.items():
+            extension = os.path.splitext(uploaded_file.name)[1]
+            path = os.path.join(media_dir, f"{field_name}{extension}")
+            with open(path, 'wb') as destination:
+                for chunk in uploaded_file.chunks():
+                    destination.write(chunk)
+            job.media[field_name] = path
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # Same idempotency key submitted concurrently
+            shutil.rmtree(media_dir, ignore_errors=True)
+            return SummarizeJob.objects.get(idempotency_key=idempotency_key), False
+        self._executor.submit(self._run, job.id)
+        return job, True
+
+    def _run(self, job_id):
+        close_old_connections()
+        try:
+            # Claim the job; another worker may have taken it already
+            claimed = SummarizeJob.objects.filter(id=job_id, status=SummarizeJob.QUEUED).update(
+                status=SummarizeJob.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now())
+            if not claimed:
+                return
+            with self._lock:
+                self._running.add(job_id)
+            try:
+                self._process(job_id)
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+        finally:
+            connection.close()
+
+    def _process(self, job_id):
+        job = SummarizeJob.objects.get(id=job_id)
+        files = {field_name: File(open(path, 'rb'), name=path) for field_name, path in job.media.items()
+                 if os.path.exists(path)}
+        try:
+            job.result = summarize_note(job.note_data, job.settings, job.previous_summaries, files)
+            job.status = SummarizeJob.SUCCEEDED
+        except Exception as e:
+            logger.exception("Summarize job %s failed", job_id)
+            job.status = SummarizeJob.FAILED
+            job.error = str(e)
+        finally:
+            for file in files.values():
+                file.close()
+        job.save(update_fields=['result', 'status', 'error', 'updated_at'])
+        shutil.rmtree(job_media_dir(job_id), ignore_errors=True)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,312 @@
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from notes.fake_llm import fake_embedding, start_fake_server
+
+FORMAT_VERSION = 1
+SCENARIOS = ['get_notes', 'search_exact', 'search_ann', 'search_keyword', 'search_hybrid', 'create_note', 'upload',
+             'search_int8', 'search_binary']
+TOPICS = 200
+WORDS_PER_TOPIC = 8
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sha', 'to', 'vi', 'de', 'ath', 'no', 'te', 'ry', 'uk', 'ki', 'ra']
+
+
+def vocabulary(rng):
+    """TOPICS groups of made-up words; notes draw from one group, so notes of a topic embed close together"""
+    words = set()
+    while len(words) < TOPICS * WORDS_PER_TOPIC:
+        words.add("".join(rng.choice(SYLLABLES, size=rng.integers(2, 4))))
+    return np.array(sorted(words)).reshape(TOPICS, WORDS_PER_TOPIC)
+
+
+def note_text(rng, topics, n_words=24):
+    return " ".join(rng.choice(topics[rng.integers(TOPICS)], size=n_words))
+
+
+def query_text(rng, topics):
+    return " ".join(rng.choice(topics[rng.integers(TOPICS)], size=4, replace=False))
+
+
+def seed_notes(n, dim, topics, batch_size=2000):
+    """Bulk-insert n notes spread over the last three years, embedded as the fake embedder would"""
+    from notes.models import Note
+    rng = np.random.default_rng(0)
+    start = datetime.now(dt_timezone.utc) - timedelta(days=3 * 365)
+    step = timedelta(days=3 * 365) / max(n, 1)
+    for offset in range(0, n, batch_size):
+        notes = []
+        for i in range(offset, min(n, offset + batch_size)):
+            content = note_text(rng, topics)
+            notes.append(Note(title=f"Note {i}", content=content, timestamp=start + i * step,
+                              embeddings=fake_embedding(content, dim)))
+        Note.objects.bulk_create(notes)
+
+
+def test_image(i):
+    """A distinct 1600x1200 JPEG per request, so the media cache never answers for the vision model"""
+    from PIL import Image
+    rng = np.random.default_rng(i)
+    pixels = np.repeat(np.repeat(rng.integers(0, 256, size=(60, 80, 3), dtype=np.uint8), 20, axis=0), 20, axis=1)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_requests(scenario, count, topics, dim):
+    """`count` ready-made (method, path, data) requests for a scenario, generated up front"""
+    rng = np.random.default_rng(SCENARIOS.index(scenario) + 1)
+    now = datetime.now(dt_timezone.utc)
+    user_settings = json.dumps({'name': 'Kira', 'sex': 'male', 'language': 'English'})
+    requests = []
+    for i in range(count):
+        if scenario == 'get_notes':
+            until = now - timedelta(days=float(rng.uniform(0, 3 * 365)))
+            requests.append(('get', '/api/notes/', {'limit': 50, 'until': until.isoformat()}))
+        elif scenario.startswith('search_'):
+            mode = scenario.split('_')[1]
+            # Unique per request, so every query goes to the embedder rather than the cache
+            requests.append(('get', '/api/notes/search/', {'q': f"{query_text(rng, topics)} {scenario}{i}", 'mode': mode}))
+        elif scenario == 'create_note':
+            requests.append(('post', '/api/notes/create/', {'content': f"{note_text(rng, topics)} new{i}"}))
+        elif scenario == 'upload':
+            note_data = {'timestamp': str(int(now.timestamp() * 1000)), 'items': [
+                {'type': 'text', 'text': note_text(rng, topics, n_words=80)},
+                {'type': 'image', 'fieldName': 'file_0'},
+            ]}
+            file = io.BytesIO(test_image(i))
+            file.name = f'photo_{i}.jpg'
+            requests.append(('post', '/api/notes/summarize/', {
+                'noteData': json.dumps(note_data), 'settings': user_settings,
+                'previousSummaries': json.dumps([
+                    {'timestamp': f"Day {day}", 'title': f"Day {day}", 'summary': note_text(rng, topics)} for day in range(5)]),
+                'file_0': file}))
+    return requests
+
+
+def send(client, request):
+    method, path, data = request
+    if 'file_0' in data:
+        data['file_0'].seek(0)
+    response = getattr(client, method)(path, data)
+    return response.status_code < 400
+
+
+def run_scenario(requests, concurrency):
+    """Latency percentiles and throughput of the requests at the given concurrency"""
+    latencies, failures = [], []
+    lock = threading.Lock()
+    clients = threading.local()
+
+    def one(request):
+        if not hasattr(clients, 'client'):
+            clients.client = Client(raise_request_exception=False)
+        started = time.perf_counter()
+        ok = send(clients.client, request)
+        with lock:
+            (latencies if ok else failures).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, requests))
+    elapsed = time.perf_counter() - started
+    row = {'requests': len(requests), 'concurrency': concurrency, 'ok': len(latencies), 'failed': len(failures),
+           'seconds': round(elapsed, 3), 'requests_per_second': round(len(latencies) / elapsed, 2) if elapsed else None}
+    for percentile in (50, 95, 99):
+        row[f'p{percentile}_ms'] = round(float(np.percentile(latencies, percentile)) * 1000, 2) if latencies else None
+    return row
+
+
+def peak_memory(requests):
+    """Peak Python heap growth (bytes) while serving the requests one at a time, as seen by tracemalloc"""
+    client = Client(raise_request_exception=False)
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for request in requests:
+            send(client, request)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def wait_for_ann(timeout=600):
+    """Start the ANN index build and block until searches use it; returns the seconds it took"""
+    from notes.ann import ann_index
+    started = time.perf_counter()
+    while ann_index.search(np.ones(1, dtype=np.float32)) is None:
+        if time.perf_counter() - started > timeout:
+            raise CommandError("ANN index was not ready in time")
+        time.sleep(0.05)
+    return time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Benchmark search, listing, note creation and summarize uploads against seeded test "
+            "databases of each size, with a local fake LLM server standing in for every model. "
+            "Writes latency, throughput and peak memory as JSON; --baseline compares with an earlier run.")
+    # Checks would import the views, and with them the caches, before their paths are redirected
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', default='1000,10000,100000', help="Comma-separated database sizes")
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset of " + ", ".join(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=100, help="Requests per scenario (uploads: a fifth of it)")
+        parser.add_argument('--concurrency', type=int, default=1, help="Requests in flight")
+        parser.add_argument('--memory-requests', type=int, default=10, help="Requests replayed under tracemalloc")
+        parser.add_argument('--dim', type=int, default=1024, help="Embedding dimension of the fake embedder")
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds the fake LLM server takes per call")
+        parser.add_argument('--json', dest='json_path', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="JSON file of an earlier run to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fail when p50 latency grows by more than this fraction over the baseline")
+
+    def handle(self, *args, **options):
+        sizes = [int(value) for value in options['notes'].split(',')]
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        if len(sizes) == 1:
+            runs = [self.run_size(sizes[0], scenarios, options)]
+        else:
+            # One process per size, so indexes, caches and peak memory do not carry over
+            runs = [self.run_child(size, options) for size in sizes]
+        report = {
+            'format': FORMAT_VERSION,
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': {key: options[key] for key in ('requests', 'concurrency', 'memory_requests', 'dim', 'latency')},
+            'runs': runs,
+        }
+        self.print_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def run_child(self, size, options):
+        self.stdout.write(f"Benchmarking {size} notes ...")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.json')
+            command = [sys.executable, '-m', 'django', 'benchmark', '--notes', str(size), '--json', path,
+                       '--scenarios', options['scenarios']]
+            for key in ('requests', 'concurrency', 'memory_requests', 'dim', 'latency'):
+                command += [f"--{key.replace('_', '-')}", str(options[key])]
+            env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'DeathNote.settings')}
+            result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL)
+            if result.returncode != 0:
+                raise CommandError(f"Benchmark of {size} notes failed (exit code {result.returncode})")
+            with open(path) as f:
+                return json.load(f)['runs'][0]
+
+    def run_size(self, size, scenarios, options):
+        dim = options['dim']
+        topics = vocabulary(np.random.default_rng(0))
+        server = start_fake_server(latency=options['latency'], token_latency=0, slots=64, dim=dim)
+        fake = {'url': f"{server.url}/v1", 'api': 'openai'}
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                DEBUG=False,  # DEBUG keeps every SQL query in memory
+                LLM_BACKENDS={role: {**config, 'endpoints': [fake]} for role, config in settings.LLM_BACKENDS.items()},
+                EMBEDDING_CACHE_PATH=os.path.join(directory, 'embeddings.sqlite3'),
+                MEDIA_CACHE_PATH=os.path.join(directory, 'media.sqlite3'),
+                ANN_INDEX_PATH=os.path.join(directory, 'ann_index.npz'),
+                MODEL_PREWARM=[]):
+            setup_test_environment()
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                return self.measure(size, scenarios, topics, options, directory)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                server.shutdown()
+
+    def measure(self, size, scenarios, topics, options, directory):
+        from notes.indexing import similarity_index
+
+        run = {'notes': size, 'dim': options['dim']}
+        started = time.perf_counter()
+        seed_notes(size, options['dim'], topics)
+        run['seed_seconds'] = round(time.perf_counter() - started, 2)
+        run['db_bytes'] = os.path.getsize(connection.settings_dict['NAME'])
+        started = time.perf_counter()
+        len(similarity_index())  # loads the matrix, as the first search after a restart would
+        run['matrix_load_seconds'] = round(time.perf_counter() - started, 3)
+        run['matrix_bytes'] = similarity_index().stats()['bytes']
+        if 'search_ann' in scenarios:
+            run['ann_build_seconds'] = round(wait_for_ann(), 3)
+
+        run['scenarios'] = {}
+        for scenario in scenarios:
+            count = max(1, options['requests'] // 5) if scenario == 'upload' else options['requests']
+            requests = make_requests(scenario, 1 + count + options['memory_requests'], topics, options['dim'])
+            send(Client(raise_request_exception=False), requests[0])  # warm-up: URLconf, imports, first connection
+            row = run_scenario(requests[1:count + 1], options['concurrency'])
+            row['peak_alloc_bytes'] = peak_memory(requests[count + 1:])
+            run['scenarios'][scenario] = row
+        run['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return run
+
+    def print_report(self, report):
+        self.stdout.write(f"{'notes':>8}  {'scenario':<14}{'ok':>6}{'failed':>8}{'req/s':>9}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'peak MB':>9}")
+        for run in report['runs']:
+            for scenario, row in run['scenarios'].items():
+                self.stdout.write(f"{run['notes']:>8}  {scenario:<14}{row['ok']:>6}{row['failed']:>8}"
+                                  f"{row['requests_per_second'] or 0:>9.1f}{row['p50_ms'] or 0:>9.2f}"
+                                  f"{row['p95_ms'] or 0:>9.2f}{row['p99_ms'] or 0:>9.2f}"
+                                  f"{row['peak_alloc_bytes'] / 2**20:>9.1f}")
+            self.stdout.write(f"{run['notes']:>8}  seeded in {run['seed_seconds']}s, matrix load "
+                              f"{run['matrix_load_seconds']}s ({run.get('matrix_bytes', 0) / 2**20:.1f} MB), max RSS {run['max_rss_bytes'] / 2**20:.0f} MB")
+
+    def compare(self, report, baseline_path, tolerance):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        before = {(run['notes'], scenario): row for run in baseline['runs'] for scenario, row in run['scenarios'].items()}
+        regressions = []
+        self.stdout.write(f"Compared with {baseline_path} (commit {baseline.get('commit')}):")
+        if baseline.get('options') != report['options']:
+            self.stdout.write(f"  note: run with different options: {baseline.get('options')} vs. {report['options']}")
+        for run in report['runs']:
+            for scenario, row in run['scenarios'].items():
+                old = before.get((run['notes'], scenario))
+                if not old or not old['p50_ms'] or not row['p50_ms']:
+                    continue
+                ratio = row['p50_ms'] / old['p50_ms']
+                flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+                self.stdout.write(f"{run['notes']:>8}  {scenario:<14} p50 {old['p50_ms']:.2f} -> "
+                                  f"{row['p50_ms']:.2f} ms ({ratio:.2f}x){flag}")
+                if flag:
+                    regressions.append(f"{scenario} at {run['notes']} notes")
+        if regressions:
+            raise CommandError(f"p50 latency regressed by more than {tolerance:.0%}: {', '.join(regressions)}")
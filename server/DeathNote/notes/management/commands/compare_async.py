@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+ENDPOINTS = {
+    # name: (sync path, async path, form body)
+    'chat': ('api/chat', 'api/async/chat', {
+        'message_type': 'text',
+        'message_content': "Ryük, what have I been up to lately?",
+        'updated_messages': '[]',
+        'settings': json.dumps({'name': 'Kira', 'sex': 'male', 'language': 'English'}),
+    }),
+    'create': ('api/notes/create/', 'api/async/notes/create/', {
+        'content': "Went for a long walk by the lake and forgot my phone at home.",
+    }),
+}
+
+
+def run_load(url, body, requests, concurrency, timeout):
+    """Send `requests` POSTs with `concurrency` in flight; returns throughput and latency figures"""
+    data = urllib.parse.urlencode(body).encode()
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, data=data, timeout=timeout) as response:
+                response.read()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            with lock:
+                failures.append(str(e))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        'ok': len(latencies),
+        'failed': len(failures),
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_s': float(np.percentile(latencies, 50)) if latencies else None,
+        'p95_s': float(np.percentile(latencies, 95)) if latencies else None,
+        'first_error': failures[0] if failures else None,
+    }
+
+
+class Command(BaseCommand):
+    help = ("Compare concurrent-request throughput of the sync views and their async "
+            "counterparts on a running server (start it with an ASGI server, e.g. "
+            "`uvicorn DeathNote.asgi:application`, so both paths are served the same way)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='chat')
+        parser.add_argument('--requests', type=int, default=64)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--timeout', type=float, default=300)
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        sync_path, async_path, body = ENDPOINTS[options['endpoint']]
+        report = {'endpoint': options['endpoint'], 'requests': options['requests'],
+                  'concurrency': options['concurrency']}
+        for name, path in (('sync', sync_path), ('async', async_path)):
+            url = urllib.parse.urljoin(options['base_url'], path)
+            self.stdout.write(f"{name}: {url} ...")
+            report[name] = run_load(url, body, options['requests'], options['concurrency'], options['timeout'])
+            if not report[name]['ok']:
+                raise CommandError(f"Every {name} request failed: {report[name]['first_error']}")
+
+        self.stdout.write(f"{'path':<7}{'ok':>5}{'failed':>8}{'req/s':>9}{'p50 s':>9}{'p95 s':>9}")
+        for name in ('sync', 'async'):
+            row = report[name]
+            self.stdout.write(f"{name:<7}{row['ok']:>5}{row['failed']:>8}{row['requests_per_second']:>9.2f}"
+                              f"{row['p50_s']:>9.2f}{row['p95_s']:>9.2f}")
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
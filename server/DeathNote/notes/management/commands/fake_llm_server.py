@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from notes.fake_llm import FakeLLMServer
+
+
+class Command(BaseCommand):
+    help = ("Run a fake OpenAI-compatible/Ollama server that answers deterministically after a delay. "
+            "Point LLM_BACKENDS endpoints at it to test the backend pool without real models.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1234)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds spent on each request")
+        parser.add_argument('--token-latency', type=float, default=0.005, help="Extra seconds per reply token")
+        parser.add_argument('--slots', type=int, default=1, help="Requests served at once (like one GPU)")
+        parser.add_argument('--dim', type=int, default=1024, help="Embedding dimension")
+        parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests answered with a 503")
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer((options['host'], options['port']), latency=options['latency'],
+                               token_latency=options['token_latency'], slots=options['slots'],
+                               dim=options['dim'], fail_rate=options['fail_rate'])
+        self.stdout.write(f"Fake LLM server on {server.url} (OpenAI API under /v1, Ollama API under /api)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,55 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.images import preprocess_image, read_image_bytes
+from notes.utils import VISION_MODEL, describe_image
+
+
+class Command(BaseCommand):
+    help = "Report bytes and latency saved by preprocessing images before the vision model"
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', help="Image files to measure")
+        parser.add_argument('--model', default=VISION_MODEL, help="IMAGE_PREPROCESSING entry to apply")
+        parser.add_argument('--describe', action='store_true',
+                            help="Also time the vision model on the original and the preprocessed image")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        rows = []
+        for path in options['images']:
+            try:
+                original = read_image_bytes(path)
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+            start = time.perf_counter()
+            processed = preprocess_image(original, options['model'])
+            row = {
+                'image': path,
+                'bytes_in': len(original),
+                'bytes_out': len(processed),
+                'preprocess_ms': (time.perf_counter() - start) * 1000,
+            }
+            if options['describe']:
+                start = time.perf_counter()
+                describe_image(original, preprocess=False)
+                row['original_ms'] = (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                describe_image(processed, preprocess=False)
+                row['preprocessed_ms'] = (time.perf_counter() - start) * 1000
+                row['saved_ms'] = row['original_ms'] - row['preprocessed_ms'] - row['preprocess_ms']
+            rows.append(row)
+
+        self.stdout.write(f"{'image':<40}{'bytes in':>11}{'bytes out':>11}{'prep ms':>9}"
+                          + (f"{'orig ms':>10}{'prep+ ms':>10}{'saved ms':>10}" if options['describe'] else ""))
+        for row in rows:
+            line = (f"{row['image'][-40:]:<40}{row['bytes_in']:>11}{row['bytes_out']:>11}"
+                    f"{row['preprocess_ms']:>9.1f}")
+            if options['describe']:
+                line += f"{row['original_ms']:>10.0f}{row['preprocessed_ms']:>10.0f}{row['saved_ms']:>10.0f}"
+            self.stdout.write(line)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(rows, f, indent=2)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notes.sessions import delete_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete chat sessions whose TTL has run out, with their messages (e.g. from a daily cron job)"
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_sessions()
+        self.stdout.write(f"Deleted {deleted} expired chat sessions")
@@ -0,0 +1,100 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.ann import IVFIndex, default_n_lists
+from notes.quantized import KINDS, approximate_scores, bytes_per_vector, quantize
+from notes.vector_index import load_note_embeddings, normalize, top_k
+
+
+def synthetic_embeddings(n, dim, n_clusters=256, seed=0):
+    """Clustered unit vectors, roughly shaped like real sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(n_clusters, size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return np.arange(1, n + 1, dtype=np.int64), normalize(vectors)
+
+
+def measure(search, queries, truth, k):
+    """Mean recall@k against the exact results and latency percentiles in ms"""
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(found.tolist()) & set(expected.tolist())) / len(expected))
+    return {
+        'recall': float(np.mean(recalls)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+class Command(BaseCommand):
+    help = ("Report recall@k, latency and memory per note of the approximate and quantized search "
+            "indexes against exact search")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200, help="Number of sampled queries")
+        parser.add_argument('--n-lists', type=int, default=None, help="IVF lists (default: sqrt of the note count)")
+        parser.add_argument('--n-probe', default='1,2,4,8,16,32', help="Comma-separated n_probe values to try")
+        parser.add_argument('--rerank', default='10,20,50,100,200,500',
+                            help="Comma-separated candidate counts reranked exactly after the quantized scan")
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help="Use this many synthetic vectors instead of the stored notes")
+        parser.add_argument('--dim', type=int, default=1024, help="Dimension of synthetic vectors")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        k = options['k']
+        if options['synthetic']:
+            ids, vectors = synthetic_embeddings(options['synthetic'], options['dim'])
+        else:
+            ids, vectors = load_note_embeddings()
+        if len(ids) <= k:
+            raise CommandError(f"Need more than k={k} embeddings, found {len(ids)}")
+
+        # Queries are stored vectors with noise, so they look like real lookups without being exact hits
+        rng = np.random.default_rng(1)
+        picks = rng.choice(len(ids), size=min(options['queries'], len(ids)), replace=False)
+        queries = normalize(vectors[picks] + 0.05 * rng.normal(size=(len(picks), vectors.shape[1])))
+        truth = [ids[top_k(vectors @ query, k)] for query in queries]
+
+        dim = vectors.shape[1]
+        results = [dict(mode='exact', bytes_per_note=bytes_per_vector('exact', dim),
+                        **measure(lambda q: ids[top_k(vectors @ q, k)], queries, truth, k))]
+        report = {'notes': int(len(ids)), 'dim': int(dim), 'k': k, 'results': results}
+
+        n_lists = options['n_lists'] or default_n_lists(len(ids))
+        start = time.perf_counter()
+        index = IVFIndex.build(ids, vectors, n_lists)
+        report['ann_build_s'] = time.perf_counter() - start
+        for n_probe in (int(value) for value in options['n_probe'].split(',')):
+            row = measure(lambda q: index.search(q, k, n_probe)[0], queries, truth, k)
+            results.append(dict(mode='ann', n_lists=len(index.centroids), n_probe=n_probe,
+                                bytes_per_note=bytes_per_vector('exact', dim), **row))
+
+        # Scan the codes, then rerank the best candidates on the float vectors, as QuantizedIndex does
+        for kind in KINDS:
+            codes, scales = quantize(kind, vectors)
+            for n_candidates in (max(k, int(value)) for value in options['rerank'].split(',')):
+                def search(query):
+                    rows = top_k(approximate_scores(kind, codes, scales, query), n_candidates)
+                    return ids[rows[top_k(vectors[rows] @ query, k)]]
+                results.append(dict(mode=kind, rerank=n_candidates, bytes_per_note=bytes_per_vector(kind, dim),
+                                    **measure(search, queries, truth, k)))
+
+        self.stdout.write(f"{report['notes']} notes, dim {report['dim']}, recall@{k}, "
+                          f"IVF build {report['ann_build_s']:.2f}s")
+        self.stdout.write(f"{'mode':<8}{'n_lists':>8}{'n_probe':>8}{'rerank':>8}{'B/note':>8}"
+                          f"{'recall':>9}{'p50 ms':>9}{'p95 ms':>9}")
+        for row in results:
+            self.stdout.write(f"{row['mode']:<8}{row.get('n_lists', ''):>8}{row.get('n_probe', ''):>8}"
+                              f"{row.get('rerank', ''):>8}{row['bytes_per_note']:>8}"
+                              f"{row['recall']:>9.3f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}")
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,185 @@
+"""
+Lightweight request instrumentation. span() times one stage of the work
+(an LLM call, an embedding, a transcription, a query...) into the
+deathnote_stage_seconds histogram and, while MetricsMiddleware is serving a
+request, into that request's Server-Timing header. render() writes every
+metric in the Prometheus text format for the /metrics endpoint.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Histogram:
+    """Prometheus histogram with one series per combination of label values"""
+
+    def __init__(self, name, help, labelnames, buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (last: +Inf), sum]
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            label_text = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return "\n".join(lines)
+
+
+stage_seconds = Histogram('deathnote_stage_seconds', "Time spent in each stage of the work", ['stage'],
+                          LATENCY_BUCKETS)
+request_seconds = Histogram('deathnote_request_seconds', "Time to produce each response", ['route', 'method', 'status'],
+                            LATENCY_BUCKETS)
+llm_tokens = Histogram('deathnote_llm_tokens', "Tokens per LLM call (estimated when the server reports none)",
+                       ['role', 'kind'], TOKEN_BUCKETS)
+
+
+def render():
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English)"""
+    return len(text) // 4 + 1
+
+
+def message_tokens(messages):
+    """Estimated prompt tokens of chat messages (text parts only)"""
+    return sum(estimate_tokens(m['content']) for m in messages if isinstance(m.get('content'), str))
+
+
+def record_tokens(role, prompt_tokens, completion_tokens):
+    llm_tokens.observe(prompt_tokens, role, 'prompt')
+    llm_tokens.observe(completion_tokens, role, 'completion')
+
+
+class RequestTiming:
+    """Seconds and calls per stage while serving one request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}  # stage -> [seconds, calls]
+
+    def add(self, stage, seconds):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def header(self, total_seconds):
+        """Server-Timing value; stages that ran concurrently can add up to more than the total"""
+        with self._lock:
+            parts = [f'{stage};dur={seconds * 1000:.1f}' + (f';desc="{calls} calls"' if calls > 1 else '')
+                     for stage, (seconds, calls) in self.stages.items()]
+        return ", ".join(parts + [f"total;dur={total_seconds * 1000:.1f}"])
+
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+def record(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block (or decorated function) as `stage`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def time_query(execute, sql, params, many, context):
+    with span('db'):
+        return execute(sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver: time every query the connection runs"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class MetricsMiddleware:
+    """
+    Times each request into deathnote_request_seconds and collects the spans
+    it runs, in this thread, its sync_to_async calls and the media workers,
+    into a Server-Timing header when settings.SERVER_TIMING is on. Spans of
+    a streamed body run after the headers are sent and only reach the histograms.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing, started = RequestTiming(), time.perf_counter()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    async def __acall__(self, request):
+        timing, started = RequestTiming(), time.perf_counter()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    def finish(self, request, response, timing, started):
+        seconds = time.perf_counter() - started
+        match = request.resolver_match
+        # The route pattern rather than the path, so ids do not make a series each
+        route = match.route if match else 'unmatched'
+        request_seconds.observe(seconds, route, request.method, str(response.status_code))
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timing.header(seconds)
+        return response
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:12
+
+from django.db import migrations
+
+import notes.fields
+
+BATCH_SIZE = 500
+
+
+def json_to_binary(apps, schema_editor):
+    Note = apps.get_model("notes", "Note")
+    batch = []
+    for note in Note.objects.only("id", "embeddings").iterator(chunk_size=BATCH_SIZE):
+        note.embeddings_blob = note.embeddings or None
+        batch.append(note)
+        if len(batch) == BATCH_SIZE:
+            Note.objects.bulk_update(batch, ["embeddings_blob"])
+            batch = []
+    if batch:
+        Note.objects.bulk_update(batch, ["embeddings_blob"])
+
+
+def binary_to_json(apps, schema_editor):
+    Note = apps.get_model("notes", "Note")
+    batch = []
+    for note in Note.objects.only("id", "embeddings_blob").iterator(chunk_size=BATCH_SIZE):
+        note.embeddings = [] if note.embeddings_blob is None else note.embeddings_blob.tolist()
+        batch.append(note)
+        if len(batch) == BATCH_SIZE:
+            Note.objects.bulk_update(batch, ["embeddings"])
+            batch = []
+    if batch:
+        Note.objects.bulk_update(batch, ["embeddings"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0003_rename_created_at_note_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="embeddings_blob",
+            field=notes.fields.EmbeddingField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name="note",
+            name="embeddings",
+        ),
+        migrations.RenameField(
+            model_name="note",
+            old_name="embeddings_blob",
+            new_name="embeddings",
+        ),
+    ]
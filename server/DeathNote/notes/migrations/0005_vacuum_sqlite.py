@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+def vacuum(apps, schema_editor):
+    # Give the space freed by the JSON -> binary conversion back to the filesystem
+    if schema_editor.connection.vendor == "sqlite":
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("VACUUM")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("notes", "0004_note_embeddings_binary"),
+    ]
+
+    operations = [
+        migrations.RunPython(vacuum, migrations.RunPython.noop, atomic=False),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 11:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0005_vacuum_sqlite"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="note",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
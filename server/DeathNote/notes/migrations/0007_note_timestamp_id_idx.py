@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0006_alter_note_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="note",
+            index=models.Index(
+                fields=["timestamp", "id"], name="note_timestamp_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:05
+
+from django.db import migrations
+
+# External-content FTS5 index over notes_note: it stores only the index, reads the
+# text from notes_note, and the triggers keep it in step with every write (bulk ones too)
+CREATE_SQL = [
+    """CREATE VIRTUAL TABLE notes_note_fts USING fts5(
+        title, content, content='notes_note', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER notes_note_fts_insert AFTER INSERT ON notes_note BEGIN
+        INSERT INTO notes_note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER notes_note_fts_delete AFTER DELETE ON notes_note BEGIN
+        INSERT INTO notes_note_fts(notes_note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER notes_note_fts_update AFTER UPDATE OF title, content ON notes_note BEGIN
+        INSERT INTO notes_note_fts(notes_note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO notes_note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    "INSERT INTO notes_note_fts(notes_note_fts) VALUES ('rebuild')",  # index the existing notes
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS notes_note_fts_insert",
+    "DROP TRIGGER IF EXISTS notes_note_fts_delete",
+    "DROP TRIGGER IF EXISTS notes_note_fts_update",
+    "DROP TABLE IF EXISTS notes_note_fts",
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite-only; other databases get no keyword index (see notes.fts)
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        with schema_editor.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0009_chatsession_chatmessage"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(CREATE_SQL), run_sqlite(DROP_SQL)),
+    ]
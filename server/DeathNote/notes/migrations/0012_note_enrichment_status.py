@@ -0,0 +1,61 @@
+# Generated by Django 5.1.2 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+# Adding columns makes SQLite copy notes_note into a new table, which drops the
+# notes_note_fts triggers of 0010; they are recreated after the copy either way
+TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS notes_note_fts_insert",
+    "DROP TRIGGER IF EXISTS notes_note_fts_delete",
+    "DROP TRIGGER IF EXISTS notes_note_fts_update",
+    """CREATE TRIGGER notes_note_fts_insert AFTER INSERT ON notes_note BEGIN
+        INSERT INTO notes_note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER notes_note_fts_delete AFTER DELETE ON notes_note BEGIN
+        INSERT INTO notes_note_fts(notes_note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER notes_note_fts_update AFTER UPDATE OF title, content ON notes_note BEGIN
+        INSERT INTO notes_note_fts(notes_note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO notes_note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+
+def restore_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in TRIGGER_SQL:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0011_digest"),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name="note",
+            name="enrichment_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("running", "Running"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="done",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="enrichment_error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,114 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+from .fields import EmbeddingField
 
 # Create your models here.
 class Note(models.Model):
+    # Title and embedding are filled in after the note is saved (notes.enrichment)
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    ENRICHMENT_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
     title = models.CharField(max_length=255)
     content = models.TextField()
-    embeddings = models.JSONField(default=list)  # Store vector embeddings
-    timestamp = models.DateTimeField(auto_now_add=True)  # Timestamp when note is created
+    embeddings = EmbeddingField(null=True, blank=True)  # Store vector embeddings as a binary blob
+    timestamp = models.DateTimeField(default=timezone.now)  # Timestamp when note is created (kept as-is on import)
+    enrichment_status = models.CharField(max_length=16, choices=ENRICHMENT_CHOICES, default=DONE, db_index=True)
+    enrichment_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='note_timestamp_id_idx'),  # keyset pagination and time ranges
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.timestamp}"
+
+
+class SummarizeJob(models.Model):
+    """A queued api/notes/summarize/ request, processed by notes.jobs workers"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    note_data = models.JSONField()
+    settings = models.JSONField()
+    previous_summaries = models.JSONField(default=list)
+    media = models.JSONField(default=dict)  # fieldName -> path of the uploaded file saved for the job
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.id} - {self.status}"
+
+
+class ChatSession(models.Model):
+    """Server-side chat conversation; its messages are ChatMessage rows"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    settings = models.JSONField(default=dict)  # user settings, as sent to the chat endpoint
+    working_memory = models.TextField(blank=True)  # past summaries, as sent to the chat endpoint
+    summary = models.TextField(blank=True)  # compacted earlier turns
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    ttl_seconds = models.PositiveIntegerField(null=True, blank=True)  # idle time before the session expires
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)  # None: kept until deleted
+
+    def __str__(self):
+        return f"{self.id} - {self.updated_at}"
+
+
+class ChatMessage(models.Model):
+    """One turn of a ChatSession. Rows are only appended; compaction just flags them"""
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=16)  # "user" or "assistant"
+    content = models.TextField()
+    compacted = models.BooleanField(default=False)  # folded into session.summary
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'compacted', 'id'], name='chatmessage_session_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
+
+
+class Digest(models.Model):
+    """
+    A condensed run of past summaries (a day, week or month of them) for the
+    parse_entry prompt, stored under the hash of what it was made from so
+    each one is generated once (see notes.digests).
+    """
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+    LEVEL_CHOICES = [(DAY, 'Day'), (WEEK, 'Week'), (MONTH, 'Month')]
+
+    key = models.CharField(max_length=64, unique=True)  # SHA-256 of the prompt version, period and source texts
+    level = models.CharField(max_length=8, choices=LEVEL_CHOICES)
+    period_start = models.DateField()
+    text = models.TextField()
+    source_tokens = models.PositiveIntegerField(default=0)  # estimated tokens of the texts it condenses
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['level', 'period_start'], name='digest_level_period_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.title} - {self.timestamp}"
\ No newline at end of file
+        return f"{self.level} of {self.period_start}"
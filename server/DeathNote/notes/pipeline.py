@@ -0,0 +1,207 @@
+import contextvars
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .cache import ResultCache
+from .digests import summary_memory
+from .metrics import span
+from .registry import model_registry
+from .transcription import transcribe_batch, transcription_version
+from .utils import IMAGE_PROMPT_VERSION, VISION_MODEL, decode_audio, describe_image, format_timestamp, parse_entry
+
+_executor = None
+_executor_lock = threading.Lock()
+_limits = {}
+
+# Image descriptions and audio transcriptions by (media bytes, model, prompt/settings version)
+media_cache = ResultCache(
+    path=settings.MEDIA_CACHE_PATH,
+    max_items=settings.MEDIA_CACHE_MAX_ITEMS,
+    max_bytes=settings.MEDIA_CACHE_MAX_BYTES,
+)
+
+
+def _backend_limit(backend):
+    """Semaphore capping the calls in flight to one backend (settings.MEDIA_CONCURRENCY)"""
+    with _executor_lock:
+        if backend not in _limits:
+            _limits[backend] = threading.BoundedSemaphore(settings.MEDIA_CONCURRENCY[backend])
+        return _limits[backend]
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Enough workers for every backend to run at its limit at once
+            _executor = ThreadPoolExecutor(max_workers=sum(settings.MEDIA_CONCURRENCY.values()),
+                                           thread_name_prefix='media')
+        return _executor
+
+
+@contextmanager
+def media_input(uploaded_file):
+    """
+    What the media models read an upload from: its bytes, or a path when it
+    is larger than FILE_UPLOAD_MAX_MEMORY_SIZE. Django already spools such
+    uploads to a temporary file, which is used in place; other large files
+    are copied to one that is removed on exit.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        yield uploaded_file.temporary_file_path()
+    elif uploaded_file.size <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        uploaded_file.seek(0)
+        yield uploaded_file.read()
+    else:
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(uploaded_file.name)[1]) as spooled:
+            for chunk in uploaded_file.chunks():
+                spooled.write(chunk)
+            spooled.flush()
+            yield spooled.name
+
+
+def media_cache_key(uploaded_file, model, version):
+    """SHA-256 of the upload's bytes, the model and the version of its prompt/settings"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return hashlib.sha256(f"{model}\n{version}\n{digest.hexdigest()}".encode()).hexdigest()
+
+
+def describe_upload(uploaded_file):
+    """Description of an uploaded image, from the media cache when the same bytes were seen before"""
+    key = media_cache_key(uploaded_file, VISION_MODEL, IMAGE_PROMPT_VERSION)
+    image_text = media_cache.get(key)
+    if image_text is None:
+        started = time.perf_counter()
+        with media_input(uploaded_file) as image, _backend_limit('vision'):
+            image_text = describe_image(image)
+        media_cache.set(key, image_text, time.perf_counter() - started)
+    return image_text
+
+
+def transcribe_uploads(uploaded_files, durations=None):
+    """
+    Transcribe all the audio uploads of a note as one batch; returns a text
+    per upload. Uploads already in the media cache are not transcribed again.
+    """
+    durations = durations or [None] * len(uploaded_files)
+    keys = [media_cache_key(uploaded_file, settings.WHISPER_MODEL, transcription_version())
+            for uploaded_file in uploaded_files]
+    texts = [media_cache.get(key) for key in keys]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if not missing:
+        return texts
+
+    started = time.perf_counter()
+    audios = []
+    for i in missing:
+        with media_input(uploaded_files[i]) as audio:
+            audios.append(decode_audio(audio))
+    with _backend_limit('transcription'):
+        with span('whisper'), model_registry.use('whisper') as transcription_model:
+            transcribed = transcribe_batch(transcription_model, audios, [durations[i] for i in missing])
+    # The batch is shared, so each recording is credited with its share of the time by length
+    elapsed, total = time.perf_counter() - started, sum(len(audio) for audio in audios) or 1
+    for i, audio, text in zip(missing, audios, transcribed):
+        texts[i] = text
+        media_cache.set(keys[i], text, elapsed * len(audio) / total)
+    return texts
+
+
+def parse_duration(value):
+    """The duration (seconds) a noteData audio item declares, or None"""
+    try:
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def process_items(items, files):
+    """
+    Turn the items of a note into prompt fragments, in the original item
+    order. Image descriptions run concurrently, bounded per backend, next to
+    a single batched transcription of all the audio items, so the note takes
+    about as long as its slowest part rather than the sum of them.
+    """
+    results = [""] * len(items)
+    futures = {}
+    audio_items = []  # (index, upload, declared duration)
+    for i, item in enumerate(items):
+        item_type = item.get('type')
+        if item_type == 'text':
+            results[i] = item.get('text', '') + "\n\n"
+        elif item_type in ('image', 'audio'):
+            field_name = item.get('fieldName')
+            if field_name not in files:
+                continue  # Handle missing file gracefully
+            if item_type == 'image':
+                # Run in a copy of this context, so the worker's spans count towards this request
+                futures[i] = get_executor().submit(contextvars.copy_context().run, describe_upload, files[field_name])
+            else:
+                audio_items.append((i, files[field_name], parse_duration(item.get('duration'))))
+    if audio_items:
+        transcriptions = get_executor().submit(contextvars.copy_context().run, transcribe_uploads,
+                                               [upload for _, upload, _ in audio_items],
+                                               [duration for _, _, duration in audio_items])
+    for i, future in futures.items():
+        results[i] = "<image transcription start> " + future.result() + "<image transcription end>\n\n"
+    if audio_items:
+        for (i, _, _), audio_text in zip(audio_items, transcriptions.result()):
+            results[i] = "<audio transcription start>" + audio_text + "<audio transcription end>\n\n"
+    return results
+
+
+def chat_media_message(message_type, uploaded_file):
+    """Chat message text for an 'audio' or 'image' upload: its transcription or description"""
+    if message_type == 'audio':
+        message, = transcribe_uploads([uploaded_file])
+        return f"<audio transcription start>{message}<audio transcription end>"
+    message = describe_upload(uploaded_file)
+    return f"<image transcription start>{message}<image transcription end>"
+
+
+def build_entry_text(old_summaries, results, timestamp):
+    """
+    Returns (current_entry, raw_text): the processed items of the note joined
+    in order, and the full parse_entry input with the old summaries. Reads
+    stored digests of older summaries, so run it off the event loop.
+    """
+    if len(old_summaries) == 0:
+        prepend = "<old summaries start> Old summaries NOT AVAILABLE <old summaries end>"
+    else:
+        # Older summaries come condensed into day/week/month digests (notes/digests.py)
+        prepend = "<old summaries start>"
+        for block in summary_memory(old_summaries, timestamp):
+            prepend += "\n\n " + block
+        prepend += "<old summaries end>"
+    current_entry = "".join(r if r is not None else "" for r in results).strip()
+    raw_text = prepend + "\n\n\n" + "<current entry start>\n" + format_timestamp(int(timestamp)) + ": \n" + current_entry + "<current entry end>"
+    return current_entry, raw_text
+
+
+def summarize_note(note_data, user_settings, old_summaries, files):
+    """
+    The whole summarize flow for one note: process its media items, then ask
+    the LLM for a title and commentary. Returns the summarize response body.
+    """
+    items = note_data.get('items', [])
+    timestamp = note_data.get('timestamp', None)
+    results = process_items(items, files)
+    with span('prompt.build'):
+        current_entry, raw_text = build_entry_text(old_summaries, results, timestamp)
+    title, summary = parse_entry(text=raw_text, user_settings=user_settings)
+    return {
+        "summary": summary,
+        "timestamp": timestamp,
+        "raw_text": current_entry,
+        "title": title,
+    }
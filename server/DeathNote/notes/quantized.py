@@ -0,0 +1,232 @@
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .vector_index import normalize, top_k
+
+KINDS = ('int8', 'binary')
+SCAN_ROWS = 256  # codes scored per step; their float copy stays in the CPU cache
+LOAD_ROWS = 2000  # embeddings read from the database per step on load
+
+
+def quantize(kind, vectors):
+    """
+    Compact codes of L2-normalized float32 rows. Returns (codes, scales):
+    int8 codes with one float32 scale per row (its largest |value| maps to
+    127), or for binary the sign bits packed 8 per byte and no scales.
+    """
+    vectors = np.atleast_2d(vectors)
+    if kind == 'binary':
+        return np.packbits(vectors > 0, axis=1), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def approximate_scores(kind, codes, scales, query):
+    """
+    First-pass score of every row of codes for a normalized query, higher
+    is closer: approximate cosine similarity for int8, minus the Hamming
+    distance between sign bits for binary.
+    """
+    scores = np.empty(len(codes), dtype=np.float32)
+    if kind == 'binary':
+        query_bits = np.packbits(query > 0)
+        for start in range(0, len(codes), SCAN_ROWS):
+            chunk = codes[start:start + SCAN_ROWS]
+            scores[start:start + len(chunk)] = -np.bitwise_count(chunk ^ query_bits).sum(axis=1, dtype=np.int32)
+        return scores
+    buffer = np.empty((min(SCAN_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+    for start in range(0, len(codes), SCAN_ROWS):
+        chunk = codes[start:start + SCAN_ROWS]
+        floats = buffer[:len(chunk)]
+        np.copyto(floats, chunk, casting='unsafe')
+        np.matmul(floats, query, out=scores[start:start + len(chunk)])
+    return scores * scales
+
+
+def bytes_per_vector(kind, dim):
+    """Memory of one note in an index: float32 for 'exact', else its codes (and scale)"""
+    if kind == 'int8':
+        return dim + 4
+    if kind == 'binary':
+        return (dim + 7) // 8
+    return dim * 4
+
+
+def float_vectors(note_ids):
+    """
+    (ids, normalized float32 rows) of those notes, from the float matrix when
+    it is in memory, else read from the database.
+    """
+    from .models import Note
+    from .vector_index import embedding_matrix
+    found = embedding_matrix.vectors(note_ids)
+    if found is not None:
+        return found
+    ids, vectors = [], []
+    for note_id, embedding in Note.objects.filter(id__in=note_ids).values_list('id', 'embeddings'):
+        if embedding is not None and len(embedding):
+            ids.append(note_id)
+            vectors.append(embedding)
+    if not ids:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    dim = len(vectors[0])
+    keep = [i for i, vector in enumerate(vectors) if len(vector) == dim]
+    return np.array([ids[i] for i in keep], dtype=np.int64), normalize([vectors[i] for i in keep])
+
+
+class QuantizedIndex:
+    """
+    Compact in-memory copy of the note embeddings, as int8 or binary codes
+    (1/4 and 1/32 of float32), for search_notes?mode=int8|binary. A scan of
+    the codes picks SEARCH_RERANK_CANDIDATES notes, which are reranked by
+    exact cosine similarity on their float embeddings. Loaded from the
+    database in chunks on first use, so the float matrix is never needed in
+    memory, and kept in sync through notes.indexing.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.dim = 0
+        self._codes = np.zeros((0, 0), dtype=np.uint8 if self.kind == 'binary' else np.int8)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}  # note id -> row index
+        self._size = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        from .models import Note
+        with self._lock:
+            if self._loaded:
+                return
+            self._reset()
+            ids, vectors = [], []
+            for note_id, embedding in Note.objects.values_list('id', 'embeddings').iterator(chunk_size=LOAD_ROWS):
+                if embedding is not None and len(embedding):
+                    ids.append(note_id)
+                    vectors.append(embedding)
+                if len(ids) == LOAD_ROWS:
+                    self._append(ids, vectors)
+                    ids, vectors = [], []
+            if ids:
+                self._append(ids, vectors)
+            self._loaded = True
+
+    def _append(self, ids, vectors):
+        """Quantize and add new rows; called with the lock held"""
+        if not self.dim:
+            self.dim = len(vectors[0])
+        keep = [i for i, vector in enumerate(vectors) if len(vector) == self.dim]  # other models' embeddings cannot be compared
+        if not keep:
+            return
+        codes, scales = quantize(self.kind, normalize([vectors[i] for i in keep]))
+        end = self._size + len(keep)
+        if end > len(self._ids):
+            self._grow(end)
+        self._codes[self._size:end] = codes
+        if scales is not None:
+            self._scales[self._size:end] = scales
+        self._ids[self._size:end] = [ids[i] for i in keep]
+        for row in range(self._size, end):
+            self._rows[int(self._ids[row])] = row
+        self._size = end
+
+    def _grow(self, needed):
+        capacity = max(64, needed, 2 * len(self._ids))
+        width = (self.dim + 7) // 8 if self.kind == 'binary' else self.dim
+        codes = np.zeros((capacity, width), dtype=self._codes.dtype)
+        scales = np.zeros(capacity if self.kind == 'int8' else 0, dtype=np.float32)  # binary codes have none
+        ids = np.zeros(capacity, dtype=np.int64)
+        if self._size:
+            codes[:self._size] = self._codes[:self._size]
+            if self.kind == 'int8':
+                scales[:self._size] = self._scales[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+        self._codes, self._scales, self._ids = codes, scales, ids
+
+    def add(self, note_id, embedding):
+        """Insert or replace the embedding of a note (nothing to do before the first load)"""
+        if embedding is None or not len(embedding):
+            return
+        with self._lock:
+            if not self._loaded:
+                return  # the load reads it from the database
+            if self.dim and len(embedding) != self.dim:
+                return
+            row = self._rows.get(note_id)
+            if row is None:
+                self._append([note_id], [embedding])
+                return
+            codes, scales = quantize(self.kind, normalize(embedding))
+            self._codes[row] = codes[0]
+            if scales is not None:
+                self._scales[row] = scales[0]
+
+    def remove(self, note_id):
+        """Drop a note, moving the last row into its slot"""
+        with self._lock:
+            row = self._rows.pop(note_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                self._codes[row] = self._codes[last]
+                if self.kind == 'int8':
+                    self._scales[row] = self._scales[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._size = last
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._size
+
+    def search(self, query_embedding, k=10, threshold=0.5, ids=None):
+        """
+        Return up to k (note_id, score) pairs with exact cosine similarity
+        above threshold, best match first. With ids, only those notes are
+        considered.
+        """
+        self._ensure_loaded()
+        query = normalize(query_embedding)
+        with self._lock:
+            if not self._size or query.shape[0] != self.dim:
+                return []
+            if ids is None:  # slices, so a full scan copies nothing
+                rows = slice(0, self._size)
+            else:
+                rows = np.array([self._rows[note_id] for note_id in ids if note_id in self._rows], dtype=np.int64)
+            codes, row_ids = self._codes[rows], self._ids[rows]
+            scales = self._scales[rows] if self.kind == 'int8' else None
+            n_candidates = max(k, settings.SEARCH_RERANK_CANDIDATES[self.kind])
+            if len(codes) > n_candidates:
+                row_ids = row_ids[top_k(approximate_scores(self.kind, codes, scales, query), n_candidates)]
+            candidates = row_ids.tolist()
+        note_ids, vectors = float_vectors(candidates)
+        if not len(note_ids) or vectors.shape[1] != query.shape[0]:
+            return []
+        scores = vectors @ query
+        top = top_k(scores, k)
+        return [(int(note_ids[row]), float(scores[row])) for row in top if scores[row] > threshold]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'notes': self._size,
+                'dim': self.dim,
+                'bytes_per_note': bytes_per_vector(self.kind, self.dim) if self.dim else None,
+                'bytes': self._codes.nbytes + self._scales.nbytes + self._ids.nbytes,
+            }
+
+
+quantized_indexes = {kind: QuantizedIndex(kind) for kind in KINDS}
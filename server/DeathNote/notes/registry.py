@@ -0,0 +1,185 @@
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def resident_memory_mb():
+    """Current resident set size of this process, in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak, in KB on Linux
+
+
+def pick_device():
+    """settings.MODEL_DEVICE if set, else "cuda" when a GPU is usable, else "cpu" """
+    device = settings.MODEL_DEVICE
+    if device:
+        return device
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+class _LoadedModel:
+    def __init__(self, model, device, size_mb, load_seconds, rss_delta_mb):
+        self.model = model
+        self.device = device
+        self.size_mb = size_mb
+        self.load_seconds = load_seconds
+        self.rss_delta_mb = rss_delta_mb
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class ModelRegistry:
+    """
+    Local models (e.g. Whisper) loaded on first use instead of at import
+    time. Loaded models are evicted least-recently-used first when the
+    declared sizes would exceed MODEL_MEMORY_BUDGET_MB, and after
+    MODEL_IDLE_SECONDS without use. Models in use are never evicted.
+    """
+
+    def __init__(self):
+        self._specs = {}  # name -> (loader, size_mb)
+        self._loaded = {}  # name -> _LoadedModel
+        self._lock = threading.RLock()
+        self._load_locks = {}
+        self._janitor = None
+
+    def register(self, name, loader, size_mb):
+        """loader(device) returns the model; size_mb is its expected memory footprint"""
+        with self._lock:
+            self._specs[name] = (loader, size_mb)
+            self._load_locks[name] = threading.Lock()
+
+    def _load(self, name):
+        loader, size_mb = self._specs[name]
+        with self._load_locks[name]:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                return entry
+            self._make_room(size_mb, keep=name)
+            device = pick_device()
+            rss_before = resident_memory_mb()
+            started = time.perf_counter()
+            model = loader(device)
+            entry = _LoadedModel(model, device, size_mb, time.perf_counter() - started,
+                                 resident_memory_mb() - rss_before)
+            logger.info("Loaded model %s on %s in %.1fs (+%.0f MB resident)",
+                        name, device, entry.load_seconds, entry.rss_delta_mb)
+            with self._lock:
+                self._loaded[name] = entry
+            self._start_janitor()
+            return entry
+
+    def _make_room(self, size_mb, keep):
+        budget = settings.MODEL_MEMORY_BUDGET_MB
+        if budget is None:
+            return
+        with self._lock:
+            idle = sorted((entry.last_used, name) for name, entry in self._loaded.items()
+                          if name != keep and not entry.in_use)
+            used = sum(entry.size_mb for entry in self._loaded.values())
+            for _, name in idle:
+                if used + size_mb <= budget:
+                    break
+                used -= self._loaded[name].size_mb
+                self._unload(name)
+
+    def _unload(self, name):
+        entry = self._loaded.pop(name, None)
+        if entry is None:
+            return
+        del entry
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        logger.info("Unloaded model %s", name)
+
+    @contextmanager
+    def use(self, name):
+        """Borrow a model, loading it if needed; it cannot be evicted until the block exits"""
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                entry.in_use += 1
+        if entry is None:
+            entry = self._load(name)
+            with self._lock:
+                entry.in_use += 1
+        try:
+            yield entry.model
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def prewarm(self, names):
+        """Load models in a background thread so the first request does not pay for it"""
+        def load_all():
+            for name in names:
+                try:
+                    self._load(name)
+                except Exception:
+                    logger.exception("Prewarming model %s failed", name)
+        threading.Thread(target=load_all, daemon=True).start()
+
+    def evict_idle(self):
+        idle_seconds = settings.MODEL_IDLE_SECONDS
+        if idle_seconds is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for name, entry in list(self._loaded.items()):
+                if not entry.in_use and now - entry.last_used > idle_seconds:
+                    self._unload(name)
+
+    def _start_janitor(self):
+        with self._lock:
+            if self._janitor is not None or settings.MODEL_IDLE_SECONDS is None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(max(1, settings.MODEL_IDLE_SECONDS / 4))
+                    self.evict_idle()
+            self._janitor = threading.Thread(target=run, daemon=True)
+            self._janitor.start()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                name: {
+                    'loaded': name in self._loaded,
+                    'declared_mb': size_mb,
+                    **({
+                        'device': self._loaded[name].device,
+                        'load_seconds': round(self._loaded[name].load_seconds, 3),
+                        'rss_delta_mb': round(self._loaded[name].rss_delta_mb, 1),
+                        'idle_seconds': round(now - self._loaded[name].last_used, 1),
+                        'in_use': self._loaded[name].in_use,
+                    } if name in self._loaded else {}),
+                }
+                for name, (_, size_mb) in self._specs.items()
+            }
+        return {'resident_mb': round(resident_memory_mb(), 1), 'models': models}
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,64 @@
+import logging
+import re
+
+from django.conf import settings
+
+from .metrics import estimate_tokens
+from .utils import get_embeddings
+from .vector_index import normalize, top_k
+
+logger = logging.getLogger(__name__)
+
+# Each past summary in working_memory ends with its </summary> tag
+SUMMARY_END = re.compile(r'(?<=</summary>)\s*')
+
+
+def split_working_memory(working_memory):
+    """The past-summary blocks of a chat working_memory string, oldest first"""
+    return [block.strip() for block in SUMMARY_END.split(working_memory) if block.strip()]
+
+
+def select_working_memory(working_memory, message):
+    """
+    Bound the past summaries sent with a chat message to
+    CHAT_MEMORY_TOKEN_BUDGET tokens. The CHAT_MEMORY_RECENT latest summaries
+    are always kept; the rest of the budget goes to the CHAT_MEMORY_TOP_K
+    summaries most similar to the message. Kept summaries stay in
+    chronological order. A working_memory already within budget is returned
+    as is.
+    """
+    budget = settings.CHAT_MEMORY_TOKEN_BUDGET
+    if estimate_tokens(working_memory) <= budget:
+        return working_memory
+    blocks = split_working_memory(working_memory)
+    costs = [estimate_tokens(block) for block in blocks]
+
+    chosen = set()
+    used = 0
+    for i in range(len(blocks) - 1, max(len(blocks) - settings.CHAT_MEMORY_RECENT, 0) - 1, -1):
+        if used + costs[i] > budget:
+            break
+        chosen.add(i)
+        used += costs[i]
+
+    older = [i for i in range(len(blocks)) if i not in chosen]
+    if older and used < budget:
+        try:
+            # Summaries repeat from one message to the next, so after the first
+            # message their embeddings come from the embedding cache
+            vectors = normalize(get_embeddings([message] + [blocks[i] for i in older]))
+            scores = vectors[1:] @ vectors[0]
+            for j in top_k(scores, min(settings.CHAT_MEMORY_TOP_K, len(older))):
+                i = older[j]
+                if used + costs[i] <= budget:
+                    chosen.add(i)
+                    used += costs[i]
+        except Exception:
+            # Without embeddings, fall back to the most recent summaries that fit
+            logger.exception("Ranking past summaries failed, keeping the most recent ones")
+            for i in reversed(older):
+                if used + costs[i] <= budget:
+                    chosen.add(i)
+                    used += costs[i]
+
+    return "\n\n".join(blocks[i] for i in sorted(chosen)) + "\n\n"
@@ -1,7 +1,28 @@
+import base64
+
 from rest_framework import serializers
+from .fields import encode_embedding, decode_embedding
 from .models import Note
 
+
+class EmbeddingSerializerField(serializers.Field):
+    """Embedding as base64 of its binary blob, so it never goes through a JSON float list"""
+
+    def to_representation(self, value):
+        return base64.b64encode(encode_embedding(value)).decode('ascii')
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            return data
+        try:
+            return decode_embedding(base64.b64decode(data))
+        except (TypeError, ValueError) as e:
+            raise serializers.ValidationError(f"Invalid embedding: {e}")
+
+
 class NoteSerializer(serializers.ModelSerializer):
+    embeddings = EmbeddingSerializerField(allow_null=True, required=False)
+
     class Meta:
         model = Note
         fields = '__all__'  # Include title, content, and embeddings
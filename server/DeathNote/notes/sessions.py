@@ -0,0 +1,131 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ChatMessage, ChatSession
+from .metrics import estimate_tokens
+from .utils import compact_chat
+
+logger = logging.getLogger(__name__)
+
+_compacting = set()  # ids of sessions with a compaction in progress
+_compacting_lock = threading.Lock()
+
+
+def create_session(user_settings=None, working_memory='', ttl_seconds=None):
+    """ttl_seconds defaults to CHAT_SESSION_TTL_SECONDS; 0 keeps the session until it is deleted"""
+    if ttl_seconds is None:
+        ttl_seconds = settings.CHAT_SESSION_TTL_SECONDS
+    return ChatSession.objects.create(
+        settings=user_settings or {},
+        working_memory=working_memory or '',
+        ttl_seconds=ttl_seconds or None,
+        expires_at=timezone.now() + timedelta(seconds=ttl_seconds) if ttl_seconds else None,
+    )
+
+
+def get_session(session_id):
+    """The session, or None if it does not exist or has expired"""
+    try:
+        return ChatSession.objects.exclude(expires_at__lt=timezone.now()).filter(id=session_id).first()
+    except (ValidationError, ValueError):
+        return None
+
+
+def delete_expired_sessions():
+    _, deleted = ChatSession.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted.get('notes.ChatSession', 0)
+
+
+def session_history(session):
+    """The chat messages to send with the next message: the compacted summary, then the recent turns"""
+    messages = list(session.messages.filter(compacted=False).order_by('id').values('role', 'content'))
+    if session.summary:
+        messages.insert(0, {'role': 'system', 'content': f"Summary of the earlier conversation: {session.summary}"})
+    return messages
+
+
+def use_session(session, user_settings=None, working_memory=None):
+    """
+    Store the settings and working memory of a request that sent new ones.
+    Returns (chat_messages, user_settings, working_memory) for the LLM call.
+    """
+    changed = []
+    if user_settings and user_settings != session.settings:
+        session.settings = user_settings
+        changed.append('settings')
+    if working_memory and working_memory != session.working_memory:
+        session.working_memory = working_memory
+        changed.append('working_memory')
+    if changed:
+        session.save(update_fields=changed + ['updated_at'])
+    return session_history(session), session.settings, session.working_memory
+
+
+def record_turn(session, message, reply):
+    """Append a user message and the reply to it, then compact the session if it grew over budget"""
+    ChatMessage.objects.bulk_create([
+        ChatMessage(session=session, role='user', content=message),
+        ChatMessage(session=session, role='assistant', content=reply),
+    ])
+    fields = ['updated_at']
+    if session.ttl_seconds:
+        session.expires_at = timezone.now() + timedelta(seconds=session.ttl_seconds)
+        fields.append('expires_at')
+    session.save(update_fields=fields)
+    maybe_compact(session)
+
+
+def record_stream(session, message, events):
+    """
+    Pass the events of stream_chat_with_shinigami through, recording the
+    turn once the reply is complete. The "done" event carries no message list.
+    """
+    for kind, value in events:
+        if kind == "done":
+            reply, _ = value
+            record_turn(session, message, reply)
+            value = (reply, None)
+        yield kind, value
+
+
+def maybe_compact(session):
+    """
+    Once the recent turns and summary of a session exceed
+    CHAT_SESSION_TOKEN_BUDGET, fold all but the last
+    CHAT_SESSION_KEEP_MESSAGES messages into the summary, in a background
+    thread so the reply is not held up by it.
+    """
+    contents = session.messages.filter(compacted=False).values_list('content', flat=True)
+    tokens = estimate_tokens(session.summary) + sum(estimate_tokens(content) for content in contents)
+    if tokens <= settings.CHAT_SESSION_TOKEN_BUDGET:
+        return
+    with _compacting_lock:
+        if session.id in _compacting:
+            return
+        _compacting.add(session.id)
+    threading.Thread(target=_compact, args=(session.id,), daemon=True).start()
+
+
+def _compact(session_id):
+    try:
+        session = ChatSession.objects.get(id=session_id)
+        rows = list(session.messages.filter(compacted=False).order_by('id').values_list('id', 'role', 'content'))
+        old = rows[:max(len(rows) - settings.CHAT_SESSION_KEEP_MESSAGES, 0)]
+        if not old:
+            return
+        summary = compact_chat(session.summary, [{'role': role, 'content': content} for _, role, content in old])
+        with transaction.atomic():
+            ChatSession.objects.filter(id=session_id).update(summary=summary)
+            ChatMessage.objects.filter(id__in=[message_id for message_id, _, _ in old]).update(compacted=True)
+    except Exception:
+        logger.exception("Compacting chat session %s failed", session_id)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(session_id)
+        connection.close()
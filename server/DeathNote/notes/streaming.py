@@ -0,0 +1,56 @@
+import json
+import logging
+
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    """One Server-Sent Events frame carrying data as JSON"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _done_data(value, session_id):
+    text_reply, updated_messages = value
+    if session_id is not None:
+        return {"text_reply": text_reply, "session_id": str(session_id)}
+    return {"text_reply": text_reply, "updated_messages": updated_messages}
+
+
+def chat_sse_events(events, session_id=None):
+    """
+    Turn the ("token", text) / ("done", (reply, messages)) pairs of a
+    stream_chat_with_shinigami generator into SSE frames: a "token" event per
+    piece of the reply, then a "done" event with text_reply and
+    updated_messages, or session_id for a server-side chat session (or an
+    "error" event if the LLM call fails).
+    """
+    try:
+        for kind, value in events:
+            if kind == "token":
+                yield sse_event("token", {"delta": value})
+            else:
+                yield sse_event("done", _done_data(value, session_id))
+    except Exception as e:
+        logger.exception("Streaming chat reply failed")
+        yield sse_event("error", {"error": str(e)})
+
+
+async def achat_sse_events(events, session_id=None):
+    try:
+        async for kind, value in events:
+            if kind == "token":
+                yield sse_event("token", {"delta": value})
+            else:
+                yield sse_event("done", _done_data(value, session_id))
+    except Exception as e:
+        logger.exception("Streaming chat reply failed")
+        yield sse_event("error", {"error": str(e)})
+
+
+def sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let nginx pass events through unbuffered
+    return response
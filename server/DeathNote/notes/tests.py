@@ -1,3 +1,469 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .ann import ann_index
+from .backends import BackendPool, BackendUnavailable, llm_backends
+from .cache import DiskCache, LRUCache
+from .coalescer import EmbeddingCoalescer
+from . import digests
+from .digests import entry_date, summary_memory
+from .enrichment import enrichment_queue
+from .fake_llm import start_fake_server
+from .fts import keyword_search
+from .indexing import index_note
+from .jobs import JobQueue, job_queue
+from .models import Digest, Note, SummarizeJob
+from .pipeline import media_cache
+from .quantized import quantized_indexes
+from .utils import EMBEDDING_MODEL, embedding_cache, get_embeddings
+from .vector_index import embedding_matrix
+
+
+DIM = 64
+
+
+class FakeLLMMixin:
+    """
+    Every LLM role served by a fake_llm server, caches in a temporary
+    directory, and the process-wide search indexes emptied before each test.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_fake_server(latency=0, token_latency=0, slots=16, dim=DIM)
+        cls.directory = tempfile.mkdtemp()
+        fake = {'url': f"{cls.server.url}/v1", 'api': 'openai'}
+        cls.settings_override = override_settings(
+            LLM_BACKENDS={role: {**config, 'endpoints': [fake]} for role, config in settings.LLM_BACKENDS.items()},
+            ANN_INDEX_PATH=f"{cls.directory}/ann_index.npz",
+            LLM_RETRY_BACKOFF_SECONDS=0,
+        )
+        cls.settings_override.enable()
+        cls.cache_patches = [
+            mock.patch.object(embedding_cache, 'disk', DiskCache(f"{cls.directory}/embeddings.sqlite3", 2**24, EMBEDDING_MODEL)),
+            mock.patch.object(media_cache.cache, 'disk', DiskCache(f"{cls.directory}/media.sqlite3", 2**24)),
+        ]
+        for patch in cls.cache_patches:
+            patch.start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for patch in cls.cache_patches:
+            patch.stop()
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        llm_backends._pools.clear()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        llm_backends._pools.clear()  # endpoints are read from LLM_BACKENDS on first use
+        embedding_cache.memory = LRUCache(1000)
+        embedding_matrix.__init__()
+        for index in quantized_indexes.values():
+            index.__init__(index.kind)
+        ann_index.__init__()
+
+    def create_note(self, content, **fields):
+        """A note embedded by the fake server and added to the search indexes"""
+        embedding = get_embeddings([content])[0]
+        note = Note.objects.create(title=fields.pop('title', content[:20]), content=content, embeddings=embedding, **fields)
+        index_note(note.id, embedding)
+        return note
+
+    def wait_for_enrichment(self, timeout=10):
+        """Until the background workers have enriched every note"""
+        deadline = time.monotonic() + timeout
+        while Note.objects.exclude(enrichment_status=Note.DONE).exists():
+            self.assertLess(time.monotonic(), deadline, "enrichment did not finish")
+            time.sleep(0.02)
+
+
+class FakeBackendTests(FakeLLMMixin, TestCase):
+    def test_embeddings_are_deterministic_unit_vectors(self):
+        first, other, again = get_embeddings(["river ocean boat", "bread oven flour", "river ocean boat"])
+        self.assertEqual(len(first), DIM)
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        self.assertEqual(list(first), list(again))
+        self.assertNotEqual(list(first), list(other))
+
+
+class AnnIndexTests(FakeLLMMixin, TransactionTestCase):
+    def test_writes_do_not_start_the_ann_index(self):
+        self.create_note("river ocean boat")
+        self.assertFalse(ann_index._started)
+
+    def test_ann_search_starts_the_index(self):
+        expected = self.create_note("river ocean boat").id
+        self.create_note("bread oven flour")
+        response = self.client.get('/api/notes/search/', {'q': "river ocean boat", 'mode': 'ann'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['id'], expected)
+        self.assertTrue(ann_index._started)
+
+
+class ImportTests(FakeLLMMixin, TransactionTestCase):
+    def test_import_defers_missing_titles(self):
+        body = "\n".join(['{"content": "untitled one"}', '{"content": "titled", "title": "Kept"}'])
+        response = self.client.post('/api/notes/import/', body, content_type='application/x-ndjson')
+        b"".join(response.streaming_content)
+        self.wait_for_enrichment()
+        self.assertEqual(Note.objects.get(content="titled").title, "Kept")
+        self.assertTrue(Note.objects.get(content="untitled one").title)
+
+
+class NoteListTests(FakeLLMMixin, TestCase):
+    def test_cursor_pagination_visits_every_note_once(self):
+        start = datetime(2025, 1, 1, tzinfo=datetime.now().astimezone().tzinfo)
+        for i in range(7):
+            Note.objects.create(title=f"Note {i}", content="text", timestamp=start + timedelta(hours=i // 2))
+        seen, cursor = [], None
+        while True:
+            response = self.client.get('/api/notes/', {'limit': 3, **({'cursor': cursor} if cursor else {})}).json()
+            seen += [(note['timestamp'], note['id']) for note in response['results']]
+            cursor = response['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(self.client.get('/api/notes/', {'cursor': 'garbage'}).status_code, 400)
+
+
+class BackendPoolTests(FakeLLMMixin, TestCase):
+    @override_settings(LLM_BREAKER_FAILURES=1, LLM_MAX_RETRIES=1, LLM_CONNECT_TIMEOUT_SECONDS=1)
+    def test_circuit_opens_on_a_dead_endpoint(self):
+        dead = {'url': 'http://127.0.0.1:9/v1', 'api': 'openai'}
+        pool = BackendPool('embed', 'm', [dead, {'url': f"{self.server.url}/v1", 'api': 'openai'}])
+        for _ in range(30):  # ties between idle endpoints are broken at random
+            self.assertEqual(len(pool.embed(["hello"])[0]), DIM)
+        dead_endpoint = pool.endpoints[0]
+        self.assertEqual(dead_endpoint.circuit(time.monotonic()), 'open')
+        self.assertEqual(dead_endpoint.errors, 1)
+
+        pool = BackendPool('embed', 'm', [dead])
+        with self.assertRaises(BackendUnavailable):
+            pool.embed(["hello"])
+        self.assertEqual(pool.endpoints[0].circuit(time.monotonic()), 'open')
+        with self.assertRaisesMessage(BackendUnavailable, "Every embed endpoint is failing"):
+            pool.embed(["hello"])
+        self.assertEqual(pool.endpoints[0].requests, 1)
+
+
+    def fake_pool(self):
+        return BackendPool('embed', 'm', [{'url': f"{self.server.url}/v1", 'api': 'openai'}])
+
+    def test_a_bad_request_leaves_the_breaker_alone(self):
+        pool = self.fake_pool()
+        endpoint = pool.endpoints[0]
+        endpoint.consecutive_failures = settings.LLM_BREAKER_FAILURES - 1
+        with self.assertRaises(BadRequest):
+            pool._run(bad_request)
+        self.assertEqual(endpoint.consecutive_failures, settings.LLM_BREAKER_FAILURES - 1)
+
+        endpoint.opened_at = time.monotonic() - settings.LLM_BREAKER_RESET_SECONDS - 1
+        with self.assertRaises(BadRequest):
+            pool._run(bad_request)
+        self.assertEqual(endpoint.circuit(time.monotonic()), 'half-open')
+        self.assertEqual(len(pool.embed(["hello"])[0]), DIM)
+        self.assertEqual(endpoint.circuit(time.monotonic()), 'closed')
+
+    @override_settings(LLM_MAX_RETRIES=0)
+    def test_half_open_circuit_lets_one_trial_request_through(self):
+        pool = self.fake_pool()
+        endpoint = pool.endpoints[0]
+        endpoint.consecutive_failures = settings.LLM_BREAKER_FAILURES
+        endpoint.opened_at = time.monotonic() - settings.LLM_BREAKER_RESET_SECONDS - 1
+        started, release = threading.Event(), threading.Event()
+
+        def failing_trial(endpoint):
+            started.set()
+            release.wait(5)
+            raise ConnectionError("still down")
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            trial = executor.submit(pool._run, failing_trial)
+            started.wait(5)
+            with self.assertRaises(BackendUnavailable):
+                pool.embed(["hello"])
+            release.set()
+            with self.assertRaises(BackendUnavailable):
+                trial.result(timeout=5)
+        self.assertEqual(endpoint.circuit(time.monotonic()), 'open')
+        with self.assertRaises(BackendUnavailable):
+            pool.embed(["hello"])
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def bad_request(endpoint):
+    raise BadRequest("invalid model")
+
+
+class EmbeddingCoalescerTests(FakeLLMMixin, TestCase):
+    def test_concurrent_texts_share_a_batch(self):
+        coalescer = EmbeddingCoalescer()
+        requests = self.server.requests
+        futures = [coalescer.submit(text) for text in ("river", "ocean", "boat")]
+        vectors = [future.result(timeout=5) for future in futures]
+        self.assertEqual([len(vector) for vector in vectors], [DIM] * 3)
+        self.assertEqual(self.server.requests - requests, 1)
+
+    def test_a_short_reply_fails_the_whole_batch(self):
+        coalescer = EmbeddingCoalescer()
+        with mock.patch.object(BackendPool, '_run', return_value=[[1.0]]):
+            futures = [coalescer.submit(text) for text in ("a", "b", "c")]
+            for future in futures:
+                with self.assertRaises(ValueError):
+                    future.result(timeout=5)
+
+    def test_a_short_reply_fails_a_direct_batch(self):
+        texts = [f"text {n}" for n in range(settings.EMBED_MAX_BATCH)]
+        with mock.patch.object(BackendPool, '_run', return_value=[[1.0]] * (len(texts) - 1)):
+            with self.assertRaises(ValueError):
+                get_embeddings(texts)
+        self.assertEqual(len(embedding_cache.memory), 0)
+
+
+class KeywordSearchTests(FakeLLMMixin, TestCase):
+    def test_fts_triggers_follow_writes(self):
+        note = Note.objects.create(title="Groceries", content="apples and pears")
+        self.assertEqual([i for i, _ in keyword_search("pears", 10)], [note.id])
+        note.content = "plums only"
+        note.save()
+        self.assertEqual(keyword_search("pears", 10), [])
+        self.assertEqual([i for i, _ in keyword_search("plums", 10)], [note.id])
+        note.delete()
+        self.assertEqual(keyword_search("plums", 10), [])
+
+    def test_hybrid_and_keyword_modes_find_exact_words(self):
+        self.create_note("river ocean boat")
+        expected = self.create_note("grocery list: apples, pears").id
+        for mode in ('keyword', 'hybrid'):
+            response = self.client.get('/api/notes/search/', {'q': "pears", 'mode': mode})
+            self.assertEqual(response.status_code, 200, mode)
+            self.assertEqual(response.json()[0]['id'], expected, mode)
+
+
+def intl_timestamp(day, variant):
+    """A summary timestamp as the app's Intl.DateTimeFormat('en-US') writes it on different platforms"""
+    date_part = f"{day:%A}, {day:%B} {day.day}, {day.year}"
+    return [f"{date_part} at 11:23 PM", f"{date_part} at 11:23 PM", f"{date_part}, 11:23 PM"][variant % 3]
+
+
+class SummaryMemoryTests(FakeLLMMixin, TestCase):
+    reference = int(datetime(2025, 3, 31, 12).timestamp() * 1000)
+
+    def summaries(self, days, words=5, first=date(2025, 3, 30)):
+        return [{'timestamp': intl_timestamp(first - timedelta(days=n), n), 'title': f"Day {n}",
+                 'summary': " ".join(["word"] * words)} for n in reversed(range(days))]
+
+    def test_entry_date_reads_the_app_formats(self):
+        for variant in range(3):
+            self.assertEqual(entry_date(intl_timestamp(date(2025, 3, 1), variant)), date(2025, 3, 1))
+        self.assertEqual(entry_date('Saturday, March 01, 2025 11:23 PM'), date(2025, 3, 1))
+        self.assertEqual(entry_date('2025-03-01T10:00:00'), date(2025, 3, 1))
+        self.assertIsNone(entry_date('sometime last week'))
+
+    @override_settings(SUMMARY_DIGEST_MAX_TOKENS=10**6)
+    def test_intl_timestamps_keep_every_summary(self):
+        summaries = self.summaries(50)
+        requests = self.server.requests
+        blocks = summary_memory(summaries, self.reference)
+        self.assertEqual(len(blocks), 50)
+        for summary in summaries:
+            self.assertTrue(any(f"<title>{summary['title']}</title>" in block for block in blocks), summary['title'])
+        self.assertEqual(self.server.requests, requests)
+
+    def test_undated_summaries_are_kept_verbatim(self):
+        summaries = [{'timestamp': 'sometime', 'title': 'Undated', 'summary': 'kept'}] + self.summaries(10)
+        blocks = summary_memory(summaries, self.reference)
+        self.assertIn("sometime:\n <title>Undated</title> <summary>kept</summary>", blocks)
+
+    def test_undated_summaries_are_capped(self):
+        undated = [{'timestamp': 'sometime', 'title': f"Undated {n}", 'summary': 'kept'} for n in range(8)]
+        blocks = summary_memory(undated + self.summaries(10), self.reference)
+        kept = [n for n in range(8) if any(f"<title>Undated {n}</title>" in block for block in blocks)]
+        self.assertEqual(kept, list(range(8 - settings.SUMMARY_MEMORY_UNDATED, 8)))
+
+    def test_requests_do_not_generate_digests(self):
+        self.addCleanup(digests._scheduled.clear)
+        with mock.patch.object(enrichment_queue, 'defer') as defer:
+            blocks = summary_memory(self.summaries(90, words=60), self.reference)
+        self.assertEqual(Digest.objects.count(), 0)
+        self.assertTrue(any(block.endswith(" ...</summary>") for block in blocks))
+        defer.assert_called_once()
+
+
+class DigestGenerationTests(FakeLLMMixin, TransactionTestCase):
+    reference = SummaryMemoryTests.reference
+
+    def test_missing_digests_are_generated_in_the_background(self):
+        summaries = SummaryMemoryTests.summaries(self, 90, words=60)
+        summary_memory(summaries, self.reference)
+        deadline = time.monotonic() + 10
+        while digests._scheduled:
+            self.assertLess(time.monotonic(), deadline, "digests were not generated")
+            time.sleep(0.02)
+        self.assertGreater(Digest.objects.count(), 0)
+
+        requests, count = self.server.requests, Digest.objects.count()
+        blocks = summary_memory(summaries, self.reference)
+        self.assertLess(len(blocks), 90)
+        self.assertFalse(any(block.endswith(" ...</summary>") for block in blocks))
+        self.assertEqual(summary_memory(summaries, self.reference), blocks)
+        self.assertEqual((self.server.requests, Digest.objects.count()), (requests, count))
+        self.assertEqual(digests._scheduled, set())
+
+
+class EnrichmentTests(FakeLLMMixin, TransactionTestCase):
+    def test_create_note_returns_before_enrichment(self):
+        response = self.client.post('/api/notes/create/', {'content': "river ocean boat"}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['enrichment_status'], Note.PENDING)
+        self.wait_for_enrichment()
+        note = Note.objects.get(id=response.json()['id'])
+        self.assertTrue(note.title)
+        self.assertEqual(len(note.embeddings), DIM)
+        status = self.client.get(f"/api/notes/{note.id}/enrichment/").json()
+        self.assertEqual(status['enrichment_status'], Note.DONE)
+        self.assertEqual(self.client.post(f"/api/notes/{note.id}/enrichment/").status_code, 409)
+
+    def test_a_failed_title_keeps_the_embedding(self):
+        with mock.patch('notes.enrichment.get_title', side_effect=RuntimeError("title model down")):
+            response = self.client.post('/api/notes/create/', {'content': "river ocean boat"}, content_type='application/json')
+            note_id = response.json()['id']
+            deadline = time.monotonic() + 10
+            while Note.objects.get(id=note_id).enrichment_status != Note.FAILED:
+                self.assertLess(time.monotonic(), deadline, "enrichment did not fail")
+                time.sleep(0.02)
+        status = self.client.get(f"/api/notes/{note_id}/enrichment/").json()
+        self.assertEqual(status['error'], "title: title model down")
+        self.assertEqual(len(Note.objects.get(id=note_id).embeddings), DIM)
+        found = self.client.get('/api/notes/search/', {'q': "river ocean boat", 'mode': 'exact'}).json()
+        self.assertEqual(found[0]['id'], note_id)
+
+        with mock.patch('notes.enrichment.submit_embedding') as submit_embedding:
+            self.assertEqual(self.client.post(f"/api/notes/{note_id}/enrichment/").status_code, 202)
+            self.wait_for_enrichment()
+        submit_embedding.assert_not_called()
+        self.assertTrue(Note.objects.get(id=note_id).title)
+
+    def test_notes_without_embeddings_are_found_by_keyword(self):
+        self.create_note("river ocean boat")
+        pending = Note.objects.create(title="", content="river ocean kayak", enrichment_status=Note.FAILED)
+        for mode in ('exact', 'hybrid'):
+            found = [note['id'] for note in self.client.get('/api/notes/search/', {'q': "kayak", 'mode': mode}).json()]
+            self.assertIn(pending.id, found, mode)
+
+
+class QuantizedSearchTests(FakeLLMMixin, TestCase):
+    def test_modes_agree_on_the_best_match(self):
+        topics = ["river ocean boat", "mountain snow ski", "bread oven flour", "guitar song stage"]
+        notes = [self.create_note(f"{topic} day {i}") for i in range(5) for topic in topics]
+        expected = next(note.id for note in notes if note.content == "bread oven flour day 3")
+        for mode in ('exact', 'int8', 'binary', 'hybrid'):
+            response = self.client.get('/api/notes/search/', {'q': "bread oven flour day 3", 'mode': mode})
+            self.assertEqual(response.status_code, 200, mode)
+            self.assertEqual(response.json()[0]['id'], expected, mode)
+
+    def test_int8_load_with_a_partial_first_chunk(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(99, 8)).astype(np.float32)
+        ids = []
+        for i, vector in enumerate(vectors):
+            ids.append(Note.objects.create(title=str(i), content="x", embeddings=vector).id)
+            if i == 0:  # another model's embedding, dropped from the first chunk
+                Note.objects.create(title="Other model", content="x", embeddings=rng.normal(size=4).astype(np.float32))
+        with mock.patch('notes.quantized.LOAD_ROWS', 50):  # first chunk keeps 49 rows, the second grows the index
+            for index in quantized_indexes.values():
+                self.assertEqual(len(index), 99)
+                self.assertEqual(index.search(vectors[70], k=1)[0][0], ids[70])
+
+
+class SummarizeJobTests(FakeLLMMixin, TransactionTestCase):
+    user_settings = {'name': 'Kira', 'sex': 'male', 'language': 'English'}
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(SUMMARIZE_JOB_MEDIA_DIR=f"{self.directory}/job_uploads",
+                                     SUMMARIZE_JOB_HEARTBEAT_SECONDS=0.05, SUMMARIZE_JOB_STALE_SECONDS=0.5)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(job_queue.stop)
+
+    def create_job(self, **fields):
+        return SummarizeJob.objects.create(note_data={'items': [], 'timestamp': 1740871380000},
+                                           settings=self.user_settings, **fields)
+
+    def wait_for_jobs(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while SummarizeJob.objects.exclude(status=SummarizeJob.SUCCEEDED).exists():
+            self.assertLess(time.monotonic(), deadline, "jobs did not finish")
+            time.sleep(0.02)
+
+    def test_idempotency_key_returns_the_first_job(self):
+        data = {'noteData': json.dumps({'items': [], 'timestamp': 1740871380000}), 'settings': json.dumps(self.user_settings)}
+        first = self.client.post('/api/notes/summarize/jobs/', data, headers={'Idempotency-Key': 'entry-1'})
+        again = self.client.post('/api/notes/summarize/jobs/', data, headers={'Idempotency-Key': 'entry-1'})
+        self.assertEqual((first.status_code, again.status_code), (202, 200))
+        self.assertEqual(first.json()['job_id'], again.json()['job_id'])
+        self.wait_for_jobs()
+        job = self.client.get(f"/api/notes/summarize/jobs/{first.json()['job_id']}/").json()
+        self.assertEqual(job['status'], SummarizeJob.SUCCEEDED)
+        self.assertTrue(job['result']['title'])
+        self.assertEqual(SummarizeJob.objects.get().attempts, 1)
+
+    def test_restart_picks_up_unfinished_jobs(self):
+        queued = self.create_job()
+        crashed_long_ago = self.create_job(status=SummarizeJob.RUNNING, attempts=1)
+        crashed_just_now = self.create_job(status=SummarizeJob.RUNNING, attempts=1)
+        SummarizeJob.objects.filter(id=crashed_long_ago.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        SummarizeJob.objects.filter(id=crashed_just_now.id).update(updated_at=timezone.now())
+        queue = JobQueue()
+        queue.start()
+        self.addCleanup(queue.stop)
+        self.wait_for_jobs()
+        attempts = dict(SummarizeJob.objects.values_list('id', 'attempts'))
+        self.assertEqual(attempts, {queued.id: 1, crashed_long_ago.id: 2, crashed_just_now.id: 2})
+
+    def test_a_running_job_is_not_taken_over(self):
+        release = threading.Event()
+
+        def slow_summarize(*args):
+            release.wait(5)
+            return {'title': 'Slow'}
+
+        with mock.patch('notes.jobs.summarize_note', slow_summarize):
+            job, _ = job_queue.submit({'items': []}, self.user_settings, [], {})
+            other_process = JobQueue()
+            other_process.start()
+            self.addCleanup(other_process.stop)
+            time.sleep(1.5)  # three times SUMMARIZE_JOB_STALE_SECONDS; the heartbeat keeps the job fresh
+            release.set()
+            self.wait_for_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.result), (1, {'title': 'Slow'}))
+
+    def test_a_job_submitted_twice_runs_once(self):
+        job = self.create_job()
+        with mock.patch('notes.jobs.summarize_note', return_value={'title': 'Once'}) as summarize:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(JobQueue()._run, [job.id] * 4))
+        self.assertEqual(summarize.call_count, 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (SummarizeJob.SUCCEEDED, 1))
@@ -0,0 +1,152 @@
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000  # what Whisper expects (and utils.decode_audio produces)
+CHUNK_SECONDS = 30  # Whisper's input window
+FRAME = SAMPLE_RATE * 30 // 1000  # 30 ms VAD frames
+
+
+class TranscriptionStats:
+    """Totals over the transcriptions run by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.chunks = 0
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def record(self, items, chunks, audio_seconds, speech_seconds, wall_seconds, cpu_seconds):
+        with self._lock:
+            self.items += items
+            self.chunks += chunks
+            self.audio_seconds += audio_seconds
+            self.speech_seconds += speech_seconds
+            self.wall_seconds += wall_seconds
+            self.cpu_seconds += cpu_seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': self.items,
+                'chunks': self.chunks,
+                'audio_seconds': round(self.audio_seconds, 1),
+                'silence_dropped_seconds': round(self.audio_seconds - self.speech_seconds, 1),
+                'wall_seconds': round(self.wall_seconds, 2),
+                'cpu_seconds': round(self.cpu_seconds, 2),
+                # Seconds of recorded audio transcribed per second of CPU time (process-wide)
+                'audio_seconds_per_cpu_second': round(self.audio_seconds / self.cpu_seconds, 2) if self.cpu_seconds else None,
+                'realtime_factor': round(self.audio_seconds / self.wall_seconds, 2) if self.wall_seconds else None,
+            }
+
+
+transcription_stats = TranscriptionStats()
+
+
+def transcription_version():
+    """Changes with the Whisper model or the chunking settings; part of the media cache key"""
+    return json.dumps([settings.WHISPER_MODEL, CHUNK_SECONDS, settings.VAD_MARGIN_DB, settings.VAD_SPEECH_RANGE_DB,
+                       settings.VAD_MIN_DB, settings.VAD_MIN_SILENCE_MS, settings.VAD_PAD_MS])
+
+
+def speech_segments(audio):
+    """
+    Energy-based voice activity detection. Returns the (start, end) sample
+    ranges holding speech: frames louder than the recording's noise floor by
+    VAD_MARGIN_DB, with pauses shorter than VAD_MIN_SILENCE_MS bridged and
+    VAD_PAD_MS kept around each segment.
+    """
+    n_frames = len(audio) // FRAME
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+    frames = audio[:n_frames * FRAME].reshape(n_frames, FRAME)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    floor = np.percentile(energy_db, 10)
+    # Capped below the loud frames, so a memo with no pauses (floor = speech level) keeps its speech
+    threshold = max(settings.VAD_MIN_DB,
+                    min(floor + settings.VAD_MARGIN_DB, np.percentile(energy_db, 90) - settings.VAD_SPEECH_RANGE_DB))
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) == 0:
+        return []
+
+    min_gap = settings.VAD_MIN_SILENCE_MS // 30
+    pad = settings.VAD_PAD_MS // 30
+    # Runs of voiced frames, split where the gap to the next voiced frame is long enough
+    breaks = np.flatnonzero(np.diff(voiced) > min_gap)
+    starts = np.concatenate(([voiced[0]], voiced[breaks + 1]))
+    ends = np.concatenate((voiced[breaks], [voiced[-1]])) + 1
+    return [(max(0, (start - pad) * FRAME), min(len(audio), (end + pad) * FRAME))
+            for start, end in zip(starts, ends)]
+
+
+def speech_chunks(audio):
+    """The speech of a recording, silence removed, packed into pieces of at most CHUNK_SECONDS"""
+    limit = CHUNK_SECONDS * SAMPLE_RATE
+    chunks, current, size = [], [], 0
+    for start, end in speech_segments(audio):
+        for piece_start in range(start, end, limit):
+            piece = audio[piece_start:min(end, piece_start + limit)]
+            if size + len(piece) > limit and current:
+                chunks.append(np.concatenate(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece)
+    if current:
+        chunks.append(np.concatenate(current))
+    return chunks
+
+
+def decode_chunks(model, chunks):
+    """Transcribe up to TRANSCRIPTION_BATCH_SIZE chunks in one batched Whisper forward pass"""
+    import torch
+    import whisper
+    mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(chunk), model.dims.n_mels)
+                       for chunk in chunks]).to(model.device)
+    options = whisper.DecodingOptions(fp16=model.device.type == 'cuda', without_timestamps=True)
+    texts = []
+    for result in whisper.decode(model, mel, options):
+        # Same test model.transcribe uses to skip windows that hold no speech
+        if result.no_speech_prob > 0.6 and result.avg_logprob < -1:
+            texts.append("")
+        else:
+            texts.append(result.text.strip())
+    return texts
+
+
+def transcribe_batch(model, audios, durations=None):
+    """
+    Transcribe several recordings (16 kHz float32 arrays) together: each is
+    cut into speech chunks, and the chunks of all of them are decoded in
+    batches of TRANSCRIPTION_BATCH_SIZE, the longest recordings first
+    (by their durations, in seconds, when known). Returns one text per recording.
+    """
+    durations = [duration or len(audio) / SAMPLE_RATE for audio, duration in zip(audios, durations or [None] * len(audios))]
+    started, cpu_started = time.perf_counter(), time.process_time()
+    chunks = []  # (recording index, samples)
+    for i in sorted(range(len(audios)), key=lambda i: -durations[i]):
+        chunks.extend((i, chunk) for chunk in speech_chunks(audios[i]))
+
+    texts = [[] for _ in audios]
+    batch_size = settings.TRANSCRIPTION_BATCH_SIZE
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        for (i, _), text in zip(batch, decode_chunks(model, [chunk for _, chunk in batch])):
+            if text:
+                texts[i].append(text)
+
+    audio_seconds = sum(len(audio) for audio in audios) / SAMPLE_RATE
+    speech_seconds = sum(len(chunk) for _, chunk in chunks) / SAMPLE_RATE
+    wall_seconds, cpu_seconds = time.perf_counter() - started, time.process_time() - cpu_started
+    transcription_stats.record(len(audios), len(chunks), audio_seconds, speech_seconds, wall_seconds, cpu_seconds)
+    logger.info("Transcribed %d recordings (%.1fs of audio, %.1fs of speech, %d chunks) in %.2fs",
+                len(audios), audio_seconds, speech_seconds, len(chunks), wall_seconds)
+    return [" ".join(parts) for parts in texts]
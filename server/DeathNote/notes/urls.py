@@ -1,12 +1,27 @@
 from django.urls import path
-from .views import chat, download_apk, get_notes, create_note, delete_note, search_notes, NoteUploadView
+from .async_views import chat_async, create_note_async, summarize_note_async
+from .views import backend_stats, cache_stats, chat, chat_session_detail, chat_sessions, export_notes, import_notes, download_apk, enrichment_stats, get_notes, create_note, delete_note, note_enrichment, model_stats, search_notes, summarize_job_status, NoteUploadView, SummarizeJobView
 
 urlpatterns = [
     path('chat', chat, name='chat'),
+    path('chat/sessions/', chat_sessions, name='chat_sessions'),
+    path('chat/sessions/<uuid:session_id>/', chat_session_detail, name='chat_session_detail'),
     path('download', download_apk, name='download_apk'),
     path('notes/', get_notes, name='get_notes'),
     path('notes/create/', create_note, name='create_note'),
     path('notes/delete/<int:note_id>/', delete_note, name='delete_note'),
+    path('notes/<int:note_id>/enrichment/', note_enrichment, name='note_enrichment'),
+    path('notes/enrichment/', enrichment_stats, name='enrichment_stats'),
+    path('notes/export/', export_notes, name='export_notes'),
+    path('notes/import/', import_notes, name='import_notes'),
     path('notes/search/', search_notes, name='search_notes'),  # New search endpoint
     path('notes/summarize/', NoteUploadView.as_view(), name='summarize_note'),  # New summarize endpoint
+    path('notes/summarize/jobs/', SummarizeJobView.as_view(), name='summarize_job'),
+    path('notes/summarize/jobs/<uuid:job_id>/', summarize_job_status, name='summarize_job_status'),
+    path('async/chat', chat_async, name='chat_async'),
+    path('async/notes/create/', create_note_async, name='create_note_async'),
+    path('async/notes/summarize/', summarize_note_async, name='summarize_note_async'),
+    path('cache/stats/', cache_stats, name='cache_stats'),
+    path('models/stats/', model_stats, name='model_stats'),
+    path('backends/stats/', backend_stats, name='backend_stats'),
 ]
\ No newline at end of file
@@ -1,9 +1,33 @@
-import ollama
-import os, uuid
-from openai import OpenAI
-from datetime import datetime
-# Point to the local server
-client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
+import logging
+import subprocess
+import tempfile
+import hashlib
+import json
+import unicodedata
+import numpy as np
+from concurrent.futures import Future
+from django.conf import settings
+from datetime import datetime, timezone as dt_timezone
+from .backends import llm_backends
+from .coalescer import embed_coalescer
+from .cache import TwoTierCache
+from .fields import encode_embedding, decode_embedding
+from .images import preprocess_image
+from .metrics import span
+from .registry import model_registry
+logger = logging.getLogger(__name__)
+
+# LLM servers and models per role are configured in settings.LLM_BACKENDS (see notes.backends)
+EMBEDDING_MODEL = settings.LLM_BACKENDS["embed"]["model"]
+VISION_MODEL = settings.LLM_BACKENDS["vision"]["model"]
+
+# Embeddings by (model, normalized text); switching EMBEDDING_MODEL empties the disk tier
+embedding_cache = TwoTierCache(
+    path=settings.EMBEDDING_CACHE_PATH,
+    max_items=settings.EMBEDDING_CACHE_MAX_ITEMS,
+    max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES,
+    version=EMBEDDING_MODEL,
+)
 
 
 system_prompt = """
@@ -124,82 +148,217 @@ Your goal is to provide **clear, structured, and highly informative descriptions
 
 
 
-def llm_ollama_api_call(messages, model="tarruda/neuraldaredevil-8b-abliterated:fp16"):
-    response = ollama.chat(model=model,
-                           messages=messages)
-    return response["message"]["content"]
+def llm_api_call(messages, role="chat"):
+    return llm_backends[role].chat(messages)
 
-def llm_lmstudio_api_call(messages, model="meta-llama-3.1-8b-instruct-abliterated"):
-    completion = client.chat.completions.create(
-    model=model,
-    messages=messages,
-    temperature=0.7,
-    )
-    return completion.choices[0].message.content
+def llm_stream(messages, role="chat"):
+    """Yield the completion's text as it is generated, token by token"""
+    yield from llm_backends[role].stream_chat(messages)
 
-def parse_entry(text, user_settings):
+async def allm_stream(messages, role="chat"):
+    async for token in llm_backends[role].astream_chat(messages):
+        yield token
+
+async def allm_api_call(messages, role="chat"):
+    return await llm_backends[role].achat(messages)
+
+def build_parse_entry_messages(text, user_settings):
     text = text.strip()
     sys_prompt = {"role":"system", "content":system_prompt + f"""The following user is called {user_settings["name"]}. The user is a {user_settings["sex"]} and prefers that your response should be in {user_settings["language"]}. 
     Read your previous commentaries (if provided), the current entry (possibly containing text, images that have been transcribed by an AI tool, and/or audio transcriptions of audio recorded by user), and provide a title and commentary for that entry in the user's language of preference. Your output should be of the form <title> Title </title> for the title and <summary> Commentary </summary> for your commentary."""
     }
-    messages = [sys_prompt] + [{"role": "user", "content": text}]
-    # content = llm_ollama_api_call(model="llama3", messages=messages)
-    # content = llm_ollama_api_call(model="dolphin-llama3:8b-256k", messages=messages)
-    # content = llm_ollama_api_call(messages)
-    print(text)
-    content = llm_lmstudio_api_call(messages)
+    return [sys_prompt] + [{"role": "user", "content": text}]
+
+def parse_entry_output(content):
     title = content.split("<title>")[1].split("</title>")[0].strip()
     summary = content.split("<summary>")[1].split("</summary>")[0].strip()
     return title, summary
 
-def get_title(message):
+def parse_entry(text, user_settings):
+    messages = build_parse_entry_messages(text, user_settings)
+    logger.debug("parse_entry input:\n%s", text)
+    content = llm_api_call(messages, role="summarize")
+    return parse_entry_output(content)
+
+async def aparse_entry(text, user_settings):
+    content = await allm_api_call(build_parse_entry_messages(text, user_settings), role="summarize")
+    return parse_entry_output(content)
+
+def build_title_messages(message):
     system_prompt = {"role":"system", "content":"The following is an entry from a diary. Generate a short title that captures the important and intriguing details for it. Your output should strictly be the title. No comments."}
-    messages = [system_prompt] + [{"role": "user", "content": message}]
-    response = ollama.chat(model="tarruda/neuraldaredevil-8b-abliterated:fp16", messages=messages)
-    return response["message"]["content"]
+    return [system_prompt] + [{"role": "user", "content": message}]
+
+def get_title(message):
+    return llm_api_call(build_title_messages(message), role="title")
+
+async def aget_title(message):
+    return await allm_api_call(build_title_messages(message), role="title")
+
+def build_compact_chat_messages(summary, chat_messages):
+    system_prompt = {"role":"system", "content":"The following is the earlier part of a chat between a user and Ryük, the Shinigami. Condense it into a short summary that keeps the facts, questions and promises a later reply may need. Your output should strictly be the summary. No comments."}
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in chat_messages)
+    if summary:
+        transcript = f"Summary of the chat before that:\n{summary}\n\n{transcript}"
+    return [system_prompt] + [{"role": "user", "content": transcript}]
+
+def compact_chat(summary, chat_messages):
+    """Fold chat turns into the running summary of a chat session"""
+    return llm_api_call(build_compact_chat_messages(summary, chat_messages))
+
+digest_system_prompt = "The following are your past commentaries on a user's diary entries from {period}. Condense them into one digest of at most {words} words that keeps the events, people, places, recurring patterns and contradictions a later commentary may refer to. Your output should strictly be the digest. No comments."
+
+# Changes with the summarize model or the digest prompt; part of each notes.models.Digest key
+DIGEST_PROMPT_VERSION = hashlib.sha256(json.dumps(
+    [settings.LLM_BACKENDS["summarize"]["model"], digest_system_prompt, settings.SUMMARY_DIGEST_MAX_WORDS]).encode()).hexdigest()[:16]
 
+def build_digest_messages(period, parts):
+    system_prompt = {"role":"system", "content":digest_system_prompt.format(period=period, words=settings.SUMMARY_DIGEST_MAX_WORDS)}
+    return [system_prompt] + [{"role": "user", "content": "\n\n".join(parts)}]
+
+def digest_summaries(period, parts):
+    """Condense the summaries (or digests) of a period into one digest"""
+    return llm_api_call(build_digest_messages(period, parts), role="summarize")
+
+def embedding_cache_key(message, model=EMBEDDING_MODEL):
+  """Content address of a text: hash of the model name and the whitespace/unicode-normalized text"""
+  text = unicodedata.normalize("NFC", " ".join(message.split()))
+  return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+@span('embed')
 def get_embedding(message):
-  response = ollama.embed(model="mxbai-embed-large", input=message)
-  return response["embeddings"][0]
+  key = embedding_cache_key(message)
+  cached = embedding_cache.get(key)
+  if cached is not None:
+    return decode_embedding(cached)
+  embedding = np.asarray(embed_coalescer.embed(message), dtype=np.float32)
+  embedding_cache.set(key, encode_embedding(embedding))
+  return embedding
+
+def submit_embedding(message):
+  """get_embedding without waiting: a Future of the embedding, computed while the caller does other work"""
+  key = embedding_cache_key(message)
+  cached = embedding_cache.get(key)
+  future = Future()
+  if cached is not None:
+    future.set_result(decode_embedding(cached))
+    return future
+  def done(batch_future):
+    try:
+      embedding = np.asarray(batch_future.result(), dtype=np.float32)
+    except Exception as e:
+      future.set_exception(e)
+      return
+    embedding_cache.set(key, encode_embedding(embedding))
+    future.set_result(embedding)
+  embed_coalescer.submit(message).add_done_callback(done)
+  return future
+
+async def aget_embedding(message):
+  key = embedding_cache_key(message)
+  cached = embedding_cache.get(key)
+  if cached is not None:
+    return decode_embedding(cached)
+  with span('embed'):
+    embedding = np.asarray(await embed_coalescer.aembed(message), dtype=np.float32)
+  embedding_cache.set(key, encode_embedding(embedding))
+  return embedding
+
+@span('embed')
+def get_embeddings(messages):
+  """
+  Embed many texts, sending every cache miss to the embedder in one batched call
+  (a few misses join the coalescer's next batch instead). Returns float32 arrays
+  in the order of messages.
+  """
+  keys = [embedding_cache_key(message) for message in messages]
+  embeddings = [None] * len(messages)
+  missing = []
+  for i, key in enumerate(keys):
+    cached = embedding_cache.get(key)
+    if cached is None:
+      missing.append(i)
+    else:
+      embeddings[i] = decode_embedding(cached)
+  if missing:
+    texts = [messages[i] for i in missing]
+    if len(texts) < settings.EMBED_MAX_BATCH:
+      vectors = [future.result() for future in [embed_coalescer.submit(text) for text in texts]]
+    else:
+      vectors = llm_backends["embed"].embed(texts)  # one vector per text, or ValueError
+    for i, values in zip(missing, vectors):
+      embeddings[i] = np.asarray(values, dtype=np.float32)
+      embedding_cache.set(keys[i], encode_embedding(embeddings[i]))
+  return embeddings
+
 
+image_user_prompt = 'The following is an image I took, describe it fully as instructed (You should be explicit if the image is as well): '
 
-def describe_image(image_path):
+# Changes with the vision model, its prompts or its preprocessing; part of the media cache key
+IMAGE_PROMPT_VERSION = hashlib.sha256(json.dumps(
+  [VISION_MODEL, image_system_prompt, image_user_prompt, settings.IMAGE_PREPROCESSING.get(VISION_MODEL)],
+  sort_keys=True).encode()).hexdigest()[:16]
+
+def describe_image(image, preprocess=True):
+  """image: a file path, or the raw bytes of an image file"""
   system_prompt = {"role":"system", "content":image_system_prompt}
-  response = ollama.chat(
-      model='llama3.2-vision',
-      
-      messages=[system_prompt, {
-          'role': 'user',
-          'content': 'The following is an image I took, describe it fully as instructed (You should be explicit if the image is as well): ',
-          'images': [image_path],
-          'keep_alive':-1
-      }]
-  )
-  content = response["message"]["content"]
-  return content
-
-def transcribe_audio(model, audio_path):
-   transcription = model.transcribe(audio_path)
-   return transcription["text"]
-
-def handle_uploaded_file(uploaded_file, upload_dir='temp_uploads'):
+  if preprocess:
+    image = preprocess_image(image, VISION_MODEL)
+  return llm_api_call([system_prompt, {
+      'role': 'user',
+      'content': image_user_prompt,
+      'images': [image],
+  }], role="vision")
+
+def load_whisper(device):
+   import whisper
+   return whisper.load_model(name=settings.WHISPER_MODEL, device=device)
+
+model_registry.register("whisper", load_whisper, size_mb=settings.WHISPER_MODEL_SIZE_MB)
+
+@span('audio.decode')
+def decode_audio(audio, sample_rate=16000):
+   """
+   Decode an audio file (any format ffmpeg reads) into the mono float32 array
+   Whisper takes. audio is a file path, or the file's bytes, which are piped
+   through ffmpeg without touching the disk.
+   """
+   def run_ffmpeg(source, **kwargs):
+      return subprocess.run(
+         ["ffmpeg", "-threads", "0", "-i", source,
+          "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-"],
+         capture_output=True, check=True, **kwargs).stdout
+   if not isinstance(audio, bytes):
+      out = run_ffmpeg(audio, stdin=subprocess.DEVNULL)
+   else:
+      try:
+         out = run_ffmpeg("pipe:0", input=audio)
+      except subprocess.CalledProcessError:
+         # MP4/M4A files with their index at the end cannot be read from a pipe
+         with tempfile.NamedTemporaryFile() as f:
+            f.write(audio)
+            f.flush()
+            out = run_ffmpeg(f.name, stdin=subprocess.DEVNULL)
+   return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def is_truthy(value):
+    """Whether a form/query flag such as "1", "true" or "yes" is set"""
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+def parse_timestamp(timestamp):
     """
-    Saves an UploadedFile to a local directory (temp_uploads by default).
-    Returns the absolute path to the saved file.
+    Parse a timestamp given in milliseconds since the epoch (like JavaScript's
+    Date.now()) or as an ISO 8601 string into an aware datetime.
     """
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir)
-
-    # Generate a random file name with the correct extension
-    extension = os.path.splitext(uploaded_file.name)[1]  # e.g. ".jpg", ".m4a"
-    filename = f"{uuid.uuid4()}{extension}"
-    filepath = os.path.join(upload_dir, filename)
+    if isinstance(timestamp, str) and timestamp.strip().lstrip('-').isdigit():
+        timestamp = int(timestamp)
+    if isinstance(timestamp, (int, float)):
+        return datetime.fromtimestamp(timestamp / 1000, tz=dt_timezone.utc)
+    date = datetime.fromisoformat(str(timestamp))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=dt_timezone.utc)
+    return date
 
-    # Write chunks from the UploadedFile into the new file
-    with open(filepath, 'wb+') as destination:
-        for chunk in uploaded_file.chunks():
-            destination.write(chunk)
-    return filepath
+TIMESTAMP_FORMAT = '%A, %B %d, %Y %I:%M %p'
 
 def format_timestamp(timestamp=None):
     if not timestamp:
@@ -213,10 +372,10 @@ def format_timestamp(timestamp=None):
         date = datetime.fromisoformat(str(timestamp))
     
     # Format the date
-    return date.strftime('%A, %B %d, %Y %I:%M %p')
+    return date.strftime(TIMESTAMP_FORMAT)
 
 
-def chat_with_shinigami(working_memory, chat_messages, message, user_settings):
+def build_chat_messages(working_memory, chat_messages, message, user_settings):
     system_prompt_chat = f"""
     You are an advanced AI modeled after Ryük, the Shinigami from *Death Note*, tasked with observing and now interacting with a user based on their personal journal entries. You analyze their life with a detached, amused curiosity, offering wry, insightful, and often sarcastic commentary as if their existence is an entertaining story unfolding before you. Previously, you’ve summarized their entries; now, you get to poke at them directly, drawing from those past summaries for context (if needed).
 
@@ -258,7 +417,40 @@ def chat_with_shinigami(working_memory, chat_messages, message, user_settings):
     Note that the user may in fact ask things that are completely unrelated to any of their previous entries. Your job is to interact with the uer like Ryük would, and draw info from previous entries when need be.
     Keep your responses very brief. Just like when humans chat with each other. Now interact with {user_settings['name']}. This user has their preference asking your response to be exclusively in {user_settings['language']}: 
     """
-    messages = [{'role':'system', 'content':system_prompt_chat}] + chat_messages + [{'role':'user', 'content':message}]
-    content = llm_lmstudio_api_call(messages)
+    return [{'role':'system', 'content':system_prompt_chat}] + chat_messages + [{'role':'user', 'content':message}]
+
+def chat_with_shinigami(working_memory, chat_messages, message, user_settings):
+    messages = build_chat_messages(working_memory, chat_messages, message, user_settings)
+    content = llm_api_call(messages)
     updated_messages = chat_messages + [{'role':'user', 'content':message}, {'role':'assistant', 'content':content}] 
+    return content, updated_messages
+
+def stream_chat_with_shinigami(working_memory, chat_messages, message, user_settings):
+    """
+    Like chat_with_shinigami, as a generator: yields ("token", text) for each
+    piece of the reply, then ("done", (content, updated_messages)).
+    """
+    messages = build_chat_messages(working_memory, chat_messages, message, user_settings)
+    parts = []
+    for token in llm_stream(messages):
+        parts.append(token)
+        yield "token", token
+    content = "".join(parts)
+    updated_messages = chat_messages + [{'role':'user', 'content':message}, {'role':'assistant', 'content':content}]
+    yield "done", (content, updated_messages)
+
+async def astream_chat_with_shinigami(working_memory, chat_messages, message, user_settings):
+    messages = build_chat_messages(working_memory, chat_messages, message, user_settings)
+    parts = []
+    async for token in allm_stream(messages):
+        parts.append(token)
+        yield "token", token
+    content = "".join(parts)
+    updated_messages = chat_messages + [{'role':'user', 'content':message}, {'role':'assistant', 'content':content}]
+    yield "done", (content, updated_messages)
+
+async def achat_with_shinigami(working_memory, chat_messages, message, user_settings):
+    messages = build_chat_messages(working_memory, chat_messages, message, user_settings)
+    content = await allm_api_call(messages)
+    updated_messages = chat_messages + [{'role':'user', 'content':message}, {'role':'assistant', 'content':content}]
     return content, updated_messages
\ No newline at end of file
@@ -0,0 +1,161 @@
+import threading
+
+import numpy as np
+
+
+def normalize(vectors):
+    """L2-normalize vectors along the last axis as float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0  # zero vectors stay zero and score 0
+    return vectors / norms
+
+
+def load_note_embeddings():
+    """
+    Read every stored note embedding. Returns (ids, vectors): an int64 array of
+    note ids and the matching float32 matrix of L2-normalized rows.
+    """
+    from .models import Note
+    ids, vectors = [], []
+    for note_id, embedding in Note.objects.values_list('id', 'embeddings').iterator():
+        if embedding is not None and len(embedding):
+            ids.append(note_id)
+            vectors.append(embedding)
+    if not vectors:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    dim = len(vectors[0])
+    keep = [i for i, vector in enumerate(vectors) if len(vector) == dim]
+    return (np.array([ids[i] for i in keep], dtype=np.int64),
+            normalize([vectors[i] for i in keep]))
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first"""
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+class EmbeddingMatrix:
+    """
+    Process-wide matrix of L2-normalized note embeddings, one row per note.
+    Loaded from the database on first use and kept in sync by the views that
+    create and delete notes, so a search is a single matrix-vector product.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._vectors = np.zeros((0, 0), dtype=np.float32)  # rows past _size are spare capacity
+        self._ids = np.zeros(0, dtype=np.int64)  # note id of each row
+        self._rows = {}  # note id -> row index
+        self._size = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            ids, vectors = load_note_embeddings()
+            self._reset()
+            self._vectors, self._ids = vectors, ids
+            self._rows = {note_id: row for row, note_id in enumerate(ids.tolist())}
+            self._size = len(ids)
+            self._loaded = True
+
+    def _grow(self, dim):
+        capacity = max(64, 2 * len(self._ids))
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        ids = np.zeros(capacity, dtype=np.int64)
+        vectors[:self._size] = self._vectors[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._vectors, self._ids = vectors, ids
+
+    def add(self, note_id, embedding):
+        """Insert or replace the embedding of a note"""
+        self._ensure_loaded()
+        if embedding is None or not len(embedding):
+            return
+        vector = normalize(embedding)
+        with self._lock:
+            if self._size and vector.shape[0] != self._vectors.shape[1]:
+                return  # embedding from a different model, cannot be compared
+            row = self._rows.get(note_id)
+            if row is None:
+                if self._size == len(self._ids) or self._vectors.shape[1] != vector.shape[0]:
+                    self._grow(vector.shape[0])
+                row = self._size
+                self._size += 1
+                self._rows[note_id] = row
+                self._ids[row] = note_id
+            self._vectors[row] = vector
+
+    def remove(self, note_id):
+        """Drop a note, moving the last row into its slot"""
+        self._ensure_loaded()
+        with self._lock:
+            row = self._rows.pop(note_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._size = last
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._size
+
+    def vectors(self, note_ids):
+        """
+        (ids, rows) of those notes that are in the matrix, or None when it is
+        not loaded (this does not load it).
+        """
+        if not self._loaded:
+            return None
+        with self._lock:
+            rows = np.array([self._rows[note_id] for note_id in note_ids if note_id in self._rows], dtype=np.int64)
+            return self._ids[rows], self._vectors[rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'notes': self._size,
+                'dim': self._vectors.shape[1],
+                'bytes_per_note': self._vectors.shape[1] * 4 or None,
+                'bytes': self._vectors.nbytes + self._ids.nbytes,
+            }
+
+    def search(self, query_embedding, k=10, threshold=0.5, ids=None):
+        """
+        Return up to k (note_id, score) pairs with cosine similarity above
+        threshold, best match first. With ids, only those notes are scored.
+        """
+        self._ensure_loaded()
+        query = normalize(query_embedding)
+        with self._lock:
+            if not self._size or query.shape[0] != self._vectors.shape[1]:
+                return []
+            if ids is None:
+                scores = self._vectors[:self._size] @ query
+                top = top_k(scores, k)
+                note_ids = self._ids[top]
+            else:
+                rows = np.array([self._rows[note_id] for note_id in ids if note_id in self._rows], dtype=np.int64)
+                scores = self._vectors[rows] @ query
+                top = top_k(scores, k)
+                note_ids = self._ids[rows[top]]
+        return [(int(note_id), float(scores[row])) for note_id, row in zip(note_ids, top) if scores[row] > threshold]
+
+
+embedding_matrix = EmbeddingMatrix()
@@ -1,18 +1,40 @@
-import numpy as np
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Note
+from .models import Note, SummarizeJob
 from .serializers import NoteSerializer
-from .utils import get_title, get_embedding, handle_uploaded_file, describe_image, transcribe_audio, parse_entry, format_timestamp, chat_with_shinigami
-import whisper 
+from .ann import ann_index
+from .backends import llm_backends
+from .coalescer import embed_coalescer
+from .enrichment import enrichment_queue
+from .jobs import job_queue
+from .pipeline import chat_media_message, media_cache, summarize_note
+from .retrieval import select_working_memory
+from .sessions import create_session, get_session, record_stream, record_turn, use_session
+from .streaming import chat_sse_events, sse_response
+from .registry import model_registry
+from .images import preprocess_stats
+from .transcription import transcription_stats
+from .fts import fts_available, keyword_search
+from .indexing import index_note, similarity_index, unindex_note
+from .metrics import render as render_metrics, span
+from .quantized import quantized_indexes
+from .fields import encode_embedding, decode_embedding
+from .utils import EMBEDDING_MODEL, embedding_cache, get_embedding, get_embeddings, parse_timestamp, chat_with_shinigami, stream_chat_with_shinigami, is_truthy
 from rest_framework.views import APIView
 import json
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db.models import Count, Q
+import base64
+import time
 import os
-import gc
 
-transcription_model =  whisper.load_model(name="small", device="cuda")
+SIMILARITY_THRESHOLD = 0.5
+DEFAULT_SEARCH_K = 20
+SEARCH_MODES = ('exact', 'ann', 'int8', 'binary', 'keyword', 'hybrid')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 def download_apk(request):
     """Download the DeathNote APK file"""
@@ -20,61 +42,191 @@ def download_apk(request):
     apk_path = os.path.join('static', 'apks', 'deathnote.apk')
     return FileResponse(open(apk_path, 'rb'), as_attachment=True, content_type='application/vnd.android.package-archive')
 
-def cosine_similarity(vec1, vec2):
-    """Compute the cosine similarity between two vectors"""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
+def parse_time_range(params):
+    """The since / until query parameters as datetimes, None when absent (ValueError when malformed)"""
+    since = parse_timestamp(params['since']) if params.get('since') else None
+    until = parse_timestamp(params['until']) if params.get('until') else None
+    return since, until
 
-    if np.linalg.norm(vec1) == 0 or np.linalg.norm(vec2) == 0:
-        return 0  # Avoid division by zero
-
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+def time_range(notes, since, until):
+    """notes with since <= timestamp < until (either bound may be None)"""
+    if since is not None:
+        notes = notes.filter(timestamp__gte=since)
+    if until is not None:
+        notes = notes.filter(timestamp__lt=until)
+    return notes
 
 @api_view(['GET'])
 def search_notes(request):
-    """Search notes based on content similarity using embeddings"""
+    """
+    Search notes. Query parameters:
+    - q: the query text
+    - k: number of results (default 20)
+    - mode: "exact" or "ann" (embedding similarity), "int8" or "binary"
+      (similarity over quantized embeddings, exactly reranked), "keyword" (FTS5 BM25,
+      no embedder call) or "hybrid" (keyword candidates ordered by embedding
+      similarity, falling back to exact when no note contains a query word)
+    - since / until: only notes with since <= timestamp < until (ISO 8601 or ms)
+    Notes still waiting for their embedding are matched by keyword instead,
+    after the notes ranked by similarity.
+    """
     query = request.query_params.get('q', '')
     if not query:
         return Response({'error': 'Query parameter "q" is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-    query_embedding = get_embedding(query)  # Convert query to embedding
-    notes = Note.objects.all()
-
-    # Compute similarity for each note
-    ranked_notes = [
-        (note, cosine_similarity(query_embedding, note.embeddings))
-        for note in notes
-    ]
-
-    # Sort notes by similarity score (highest first)
-    ranked_notes.sort(key=lambda x: x[1], reverse=True)
-
-    # Serialize and return only relevant notes (e.g., similarity > 0.5)
-    relevant_notes = [note for note, score in ranked_notes if score > 0.5]
-    serializer = NoteSerializer(relevant_notes, many=True)
-
-    return Response(serializer.data)
+    try:
+        k = int(request.query_params.get('k', DEFAULT_SEARCH_K))
+    except ValueError:
+        return Response({'error': 'Query parameter "k" must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    if k < 1:
+        return Response({'error': 'Query parameter "k" must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+    mode = request.query_params.get('mode', 'exact')
+    if mode not in SEARCH_MODES:
+        return Response({'error': 'Query parameter "mode" must be one of ' + ', '.join(f'"{m}"' for m in SEARCH_MODES)},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if mode in ('keyword', 'hybrid') and not fts_available():
+        return Response({'error': f'mode "{mode}" needs the SQLite full-text index'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        since, until = parse_time_range(request.query_params)
+    except ValueError:
+        return Response({'error': 'Query parameters "since" and "until" must be ISO 8601 or milliseconds'}, status=status.HTTP_400_BAD_REQUEST)
+
+    matches = hits = None
+    if mode in ('keyword', 'hybrid'):
+        with span('keyword_search'):
+            hits = keyword_search(query, k if mode == 'keyword' else settings.SEARCH_HYBRID_CANDIDATES, since, until)
+        if mode == 'keyword':
+            matches = hits
+
+    if matches is None:
+        query_embedding = get_embedding(query)  # Convert query to embedding
+        vectors = quantized_indexes[mode] if mode in quantized_indexes else similarity_index()
+        with span('vector_search'):
+            if hits:
+                # Keyword hits are relevant already; their embeddings only put them in order
+                matches = vectors.search(query_embedding, k=k, threshold=float('-inf'),
+                                                  ids=[note_id for note_id, _ in hits])
+                # Hits with no embedding yet (still being enriched) follow, in BM25 order
+                ranked = {note_id for note_id, _ in matches}
+                matches += [hit for hit in hits if hit[0] not in ranked][:k - len(matches)]
+            elif since is not None or until is not None:
+                # Score only the notes in the time range (exact, whatever the mode)
+                window = time_range(Note.objects.all(), since, until).values_list('id', flat=True)
+                matches = vectors.search(query_embedding, k=k, threshold=SIMILARITY_THRESHOLD, ids=list(window))
+            else:
+                # Top-k notes by cosine similarity, keeping only relevant ones (similarity > 0.5)
+                if mode == 'ann':
+                    matches = ann_index.search(query_embedding, k=k, threshold=SIMILARITY_THRESHOLD)
+                if matches is None:  # exact or quantized search, or the ANN index is still loading
+                    matches = vectors.search(query_embedding, k=k, threshold=SIMILARITY_THRESHOLD)
+        if hits is None and len(matches) < k and fts_available() and \
+                Note.objects.filter(enrichment_status__in=[Note.PENDING, Note.RUNNING, Note.FAILED]).exists():
+            # Notes without an embedding yet can only be found by their words
+            with span('keyword_search'):
+                matches += keyword_search(query, k - len(matches), since, until, unenriched=True)
+    notes = Note.objects.in_bulk([note_id for note_id, _ in matches])
+    relevant_notes = [notes[note_id] for note_id, _ in matches if note_id in notes]
+    with span('serialize'):
+        data = NoteSerializer(relevant_notes, many=True).data
+
+    return Response(data)
+
+def encode_cursor(note):
+    """Opaque cursor pointing just past note in (-timestamp, -id) order"""
+    return base64.urlsafe_b64encode(json.dumps([note.timestamp.isoformat(), note.id]).encode()).decode('ascii')
+
+def decode_cursor(cursor):
+    timestamp, note_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return parse_timestamp(timestamp), int(note_id)
 
 @api_view(['GET'])
 def get_notes(request):
-    """Retrieve all saved notes"""
-    notes = Note.objects.all().order_by('-id')
-    serializer = NoteSerializer(notes, many=True)
-    return Response(serializer.data)
+    """
+    Retrieve saved notes, newest first, one page at a time.
+    Query parameters:
+    - limit: page size (default 50, at most 200)
+    - cursor: next_cursor from the previous page
+    - since / until: only notes with since <= timestamp < until (ISO 8601 or ms)
+    Returns:
+    - results: the notes of this page
+    - next_cursor: cursor of the following page, or null on the last page
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return Response({'error': 'Query parameter "limit" must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        since, until = parse_time_range(request.query_params)
+    except ValueError:
+        return Response({'error': 'Query parameters "since" and "until" must be ISO 8601 or milliseconds'}, status=status.HTTP_400_BAD_REQUEST)
+    notes = time_range(Note.objects.order_by('-timestamp', '-id'), since, until)
+    if request.query_params.get('cursor'):
+        try:
+            timestamp, note_id = decode_cursor(request.query_params['cursor'])
+        except (ValueError, TypeError):
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        # Keyset condition: strictly after the last note of the previous page
+        notes = notes.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=note_id))
+
+    page = list(notes[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    with span('serialize'):
+        data = NoteSerializer(page[:limit], many=True).data
+    return Response({'results': data, 'next_cursor': next_cursor})
 
 @api_view(['POST'])
 def create_note(request):
-    """Create a new note with automatic title and embeddings"""
+    """
+    Create a new note. It is saved and returned right away with
+    enrichment_status "pending"; its title and embedding are generated in the
+    background (see note_enrichment for progress).
+    """
     content = request.data.get('content', '')
     if not content:
         return Response({'error': 'Content is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-    title = get_title(content)  # Generate title using your function
-    embedding = get_embedding(content)  # Generate embedding
+    note = Note.objects.create(title='', content=content, enrichment_status=Note.PENDING)
+    enrichment_queue.submit(note.id)
+    with span('serialize'):
+        data = NoteSerializer(note).data
+    return Response(data, status=status.HTTP_201_CREATED)
+
+def serialize_enrichment(note):
+    data = {'id': note.id, 'enrichment_status': note.enrichment_status, 'title': note.title}
+    if note.enrichment_status == Note.FAILED:
+        data['error'] = note.enrichment_error
+    return data
+
+@api_view(['GET', 'POST'])
+def note_enrichment(request, note_id):
+    """
+    GET: whether a note has its title and embedding yet ("pending",
+    "running", "done" or "failed", with the error). POST: retry a failed one;
+    only its missing title or embedding is generated again.
+    """
+    enrichment_queue.start()
+    try:
+        note = Note.objects.only('id', 'title', 'enrichment_status', 'enrichment_error').get(id=note_id)
+    except Note.DoesNotExist:
+        return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'POST':
+        if not enrichment_queue.retry(note):
+            return Response({'error': f'Only failed notes can be retried (this one is {note.enrichment_status})'},
+                            status=status.HTTP_409_CONFLICT)
+        note.refresh_from_db(fields=['enrichment_status', 'enrichment_error'])
+        return Response(serialize_enrichment(note), status=status.HTTP_202_ACCEPTED)
+    return Response(serialize_enrichment(note))
 
-    note = Note.objects.create(title=title, content=content, embeddings=embedding)
-    serializer = NoteSerializer(note)
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
+@api_view(['GET'])
+def enrichment_stats(request):
+    """Notes per enrichment status, and what the background workers have done since startup"""
+    enrichment_queue.start()
+    counts = dict(Note.objects.values_list('enrichment_status').annotate(count=Count('id')).order_by())
+    return Response({'notes': {value: counts.get(value, 0) for value, _ in Note.ENRICHMENT_CHOICES},
+                     **enrichment_queue.stats()})
 
 @api_view(['DELETE'])
 def delete_note(request, note_id):
@@ -82,11 +234,160 @@ def delete_note(request, note_id):
     try:
         note = Note.objects.get(id=note_id)
         note.delete()
+        unindex_note(note_id)
         return Response({'message': 'Note deleted'}, status=status.HTTP_204_NO_CONTENT)
     except Note.DoesNotExist:
         return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+@api_view(['GET'])
+def export_notes(request):
+    """Stream every note as one JSON object per line (NDJSON), oldest first"""
+    def lines():
+        notes = Note.objects.order_by('timestamp', 'id').values_list('id', 'title', 'content', 'timestamp', 'embeddings')
+        for note_id, title, content, timestamp, embedding in notes.iterator(chunk_size=500):
+            record = {'id': note_id, 'title': title, 'content': content, 'timestamp': timestamp.isoformat()}
+            if embedding is not None:
+                record['embedding'] = base64.b64encode(encode_embedding(embedding)).decode('ascii')
+                record['embedding_model'] = EMBEDDING_MODEL
+            yield json.dumps(record) + "\n"
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="notes.ndjson"'
+    return response
+
+@api_view(['POST'])
+def import_notes(request):
+    """
+    Bulk-create notes from NDJSON, as produced by export_notes. The body is
+    the NDJSON itself, or a multipart upload in the "file" field. Each line
+    needs "content"; "title", "timestamp" (ISO 8601 or ms) and "embedding"
+    (with a matching "embedding_model") are reused when present. Missing
+    embeddings are computed in batches of "batch_size" (query parameter) with
+    one embedder call per batch; missing titles are generated afterwards in
+    the background (enrichment_status "pending", see note_enrichment).
+
+    Streams back NDJSON progress: one line per batch with its throughput, then
+    a final line with the totals and any rejected input lines.
+    """
+    try:
+        batch_size = int(request.query_params.get('batch_size', settings.IMPORT_BATCH_SIZE))
+    except ValueError:
+        return Response({'error': 'Query parameter "batch_size" must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    batch_size = max(1, batch_size)
+    if request.content_type.startswith('multipart/form-data'):
+        if 'file' not in request.FILES:
+            return Response({'error': 'Missing "file" upload'}, status=status.HTTP_400_BAD_REQUEST)
+        source = request.FILES['file']
+    else:
+        source = request.body.splitlines()
+
+    def records(errors):
+        for line_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                content = record['content']
+                if not isinstance(content, str) or not content:
+                    raise ValueError('"content" must be a non-empty string')
+                embedding = None
+                if record.get('embedding') and record.get('embedding_model') == EMBEDDING_MODEL:
+                    embedding = decode_embedding(base64.b64decode(record['embedding']))
+                timestamp = parse_timestamp(record['timestamp']) if record.get('timestamp') else None
+            except (ValueError, KeyError, TypeError) as e:
+                errors.append({'line': line_number, 'error': str(e)})
+                continue
+            yield content, record.get('title'), timestamp, embedding
+
+    def import_batch(batch):
+        """Embed what is missing in one call, then insert the batch with a single bulk_create"""
+        started = time.perf_counter()
+        missing = [i for i, (_, _, _, embedding) in enumerate(batch) if embedding is None]
+        embeddings = [embedding for _, _, _, embedding in batch]
+        if missing:
+            for i, embedding in zip(missing, get_embeddings([batch[i][0] for i in missing])):
+                embeddings[i] = embedding
+        notes = []
+        for (content, title, timestamp, _), embedding in zip(batch, embeddings):
+            note = Note(title=title or '', content=content, embeddings=embedding,
+                        enrichment_status=Note.DONE if title else Note.PENDING)
+            if timestamp is not None:
+                note.timestamp = timestamp
+            notes.append(note)
+        untitled = 0
+        for note, embedding in zip(Note.objects.bulk_create(notes), embeddings):
+            index_note(note.id, embedding)
+            if note.enrichment_status == Note.PENDING:
+                enrichment_queue.submit(note.id)  # one LLM call per title, kept out of the import
+                untitled += 1
+        elapsed = time.perf_counter() - started
+        return {
+            'notes': len(batch),
+            'embedded': len(missing),
+            'titles_pending': untitled,
+            'seconds': round(elapsed, 3),
+            'notes_per_second': round(len(batch) / elapsed, 2) if elapsed else None,
+        }
+
+    def progress():
+        errors = []
+        imported = 0
+        batches = 0
+        started = time.perf_counter()
+        batch = []
+        for record in records(errors):
+            batch.append(record)
+            if len(batch) == batch_size:
+                batches += 1
+                imported += len(batch)
+                yield json.dumps({'batch': batches, 'imported': imported, **import_batch(batch)}) + "\n"
+                batch = []
+        if batch:
+            batches += 1
+            imported += len(batch)
+            yield json.dumps({'batch': batches, 'imported': imported, **import_batch(batch)}) + "\n"
+        elapsed = time.perf_counter() - started
+        yield json.dumps({
+            'done': True,
+            'imported': imported,
+            'batches': batches,
+            'seconds': round(elapsed, 3),
+            'notes_per_second': round(imported / elapsed, 2) if elapsed else None,
+            'errors': errors,
+        }) + "\n"
+
+    return StreamingHttpResponse(progress(), content_type='application/x-ndjson')
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """Hit/miss counters and sizes of the server-side caches"""
+    return Response({'embeddings': embedding_cache.stats(), 'media': media_cache.stats()})
+
+
+@api_view(['GET'])
+def model_stats(request):
+    """Local models: loaded or not, device, load time and memory; image preprocessing and transcription totals"""
+    return Response({
+        **model_registry.stats(),
+        'image_preprocessing': preprocess_stats.stats(),
+        'transcription': transcription_stats.stats(),
+    })
+
+
+def metrics(request):
+    """Stage, request and token histograms in the Prometheus text format"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+def backend_stats(request):
+    """LLM endpoints per role: circuit state, requests in flight, errors and mean latency; embedding batch sizes"""
+    return Response({**llm_backends.stats(), 'embed_coalescer': embed_coalescer.stats()})
+
+
 @api_view(['POST'])
 def chat(request):
     """
@@ -97,9 +398,16 @@ def chat(request):
     - settings: JSON string of user settings
     - message_type: String ('text', 'audio', or 'image')
     - message_content: String (for text) or UploadedFile (for audio/image)
+    - stream (optional): "1" to receive the reply as Server-Sent Events
+    - session_id (optional): a chat session from chat_sessions. The history is
+      then kept on the server, so updated_messages is not needed, and
+      working_memory/settings only when they changed
     Returns:
     - text_reply: AI's response as a string
-    - updated_messages: Updated chat history as a list
+    - updated_messages: Updated chat history as a list (session_id instead, for a session)
+    When streaming, the response is text/event-stream: "token" events with
+    {"delta": ...} as the reply is generated, then a "done" event carrying
+    text_reply and updated_messages.
     """
 
     # Extract data from the request
@@ -126,46 +434,50 @@ def chat(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    session = None
+    session_id = request.data.get('session_id')
+    if session_id:
+        session = get_session(session_id)
+        if session is None:
+            return Response({"error": "Chat session not found or expired"}, status=status.HTTP_404_NOT_FOUND)
+
     # Initialize message variable
     message = None
 
     # Process the message based on its type
     if message_type == 'text':
         message = message_content
-    elif message_type == 'audio':
-        # Handle audio file upload and transcription
-        if 'message_content' not in request.FILES:
-            return Response(
-                {"error": "No audio file provided"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        audio_file = request.FILES['message_content']
-        saved_path = handle_uploaded_file(audio_file)
-        message = transcribe_audio(transcription_model, saved_path)
-        message = f"<audio transcription start>{message}<audio transcription end>"
-        # Clean up the saved file
-        if os.path.exists(saved_path):
-            os.remove(saved_path)
-    elif message_type == 'image':
-        # Handle image file upload and description
+    elif message_type in ('audio', 'image'):
+        # Handle audio transcription / image description of the uploaded file
         if 'message_content' not in request.FILES:
             return Response(
-                {"error": "No image file provided"},
+                {"error": f"No {message_type} file provided"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        image_file = request.FILES['message_content']
-        saved_path = handle_uploaded_file(image_file)
-        message = describe_image(saved_path)
-        message = f"<image transcription start>{message}<image transcription end>"
-        # Clean up the saved file
-        if os.path.exists(saved_path):
-            os.remove(saved_path)
+        message = chat_media_message(message_type, request.FILES['message_content'])
     else:
         return Response(
             {"error": f"Unsupported message_type: {message_type}"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    if session is not None:
+        updated_messages, user_settings, working_memory = use_session(session, user_settings, working_memory)
+
+    # Only the past summaries relevant to this message, within the token budget
+    working_memory = select_working_memory(working_memory, message)
+
+    if is_truthy(request.data.get('stream') or request.query_params.get('stream')):
+        events = stream_chat_with_shinigami(
+            working_memory=working_memory,
+            chat_messages=updated_messages,
+            message=message,
+            user_settings=user_settings
+        )
+        if session is not None:
+            return sse_response(chat_sse_events(record_stream(session, message, events), session_id=session.id))
+        return sse_response(chat_sse_events(events))
+
     # Call the chat_with_shinigami function (assumed to be implemented)
     text_reply, updated_messages = chat_with_shinigami(
         working_memory=working_memory,
@@ -174,6 +486,10 @@ def chat(request):
         user_settings=user_settings
     )
 
+    if session is not None:
+        record_turn(session, message, text_reply)
+        return Response({"text_reply": text_reply, "session_id": str(session.id)}, status=status.HTTP_200_OK)
+
     # Return the response
     return Response(
         {
@@ -183,6 +499,41 @@ def chat(request):
         status=status.HTTP_200_OK
     )
 
+@api_view(['POST'])
+def chat_sessions(request):
+    """
+    Start a server-side chat session. Optional fields: settings (JSON string),
+    working_memory, and ttl (seconds of inactivity before the session expires;
+    0 for never, default CHAT_SESSION_TTL_SECONDS).
+    """
+    try:
+        user_settings = json.loads(request.data.get('settings') or '{}')
+        ttl = request.data.get('ttl')
+        ttl = int(ttl) if ttl not in (None, '') else None
+    except json.JSONDecodeError as e:
+        return Response({"error": f"Invalid JSON in settings: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+    except (TypeError, ValueError):
+        return Response({"error": "ttl must be a number of seconds"}, status=status.HTTP_400_BAD_REQUEST)
+    session = create_session(user_settings, request.data.get('working_memory', ''), ttl)
+    return Response({"session_id": str(session.id), "expires_at": session.expires_at}, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'DELETE'])
+def chat_session_detail(request, session_id):
+    """GET: the whole conversation, compacted turns included. DELETE: end the session"""
+    session = get_session(session_id)
+    if session is None:
+        return Response({"error": "Chat session not found or expired"}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'DELETE':
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response({
+        "session_id": str(session.id),
+        "summary": session.summary,
+        "messages": list(session.messages.order_by('id').values('role', 'content', 'compacted', 'created_at')),
+        "expires_at": session.expires_at,
+    })
+
 class NoteUploadView(APIView):
     """
     Expects a multipart/form-data POST with:
@@ -201,7 +552,9 @@ class NoteUploadView(APIView):
 
     def post(self, request):
 
-        # 1) Extract the noteData JSON from the form
+        # 1) Extract the noteData JSON from the form (parsing it spools the uploads)
+        with span('upload.parse'):
+            request.data
         note_data_str = request.data.get('noteData')
         user_settings_str = request.data.get('settings')
         old_summaries = request.data.get("previousSummaries")
@@ -211,61 +564,61 @@ class NoteUploadView(APIView):
         note_data = json.loads(note_data_str)
         user_settings = json.loads(user_settings_str)
         old_summaries = json.loads(old_summaries)
-        items = note_data.get('items', [])
-        timestamp = note_data.get('timestamp', None)
-
-        # 2) Pre-process items into a list of results, preserving order
-        results = [None] * len(items)  # Placeholder for results in original order
-
-        # Process all text items first
-        for i, item in enumerate(items):
-            if item.get('type') == 'text':
-                text = item.get('text', '')
-                results[i] = text + "\n\n"
-
-        # Process all image items in one batch
-        image_indices = [i for i, item in enumerate(items) if item.get('type') == 'image']
-        for i in image_indices:
-            item = items[i]
-            field_name = item.get('fieldName')
-            if field_name not in request.FILES:
-                results[i] = ""  # Handle missing file gracefully
-                continue
-            uploaded_file = request.FILES[field_name]
-            saved_path = handle_uploaded_file(uploaded_file)
-            image_text = describe_image(saved_path)
-            results[i] = "<image transcription start> " + image_text + "<image transcription end>\n\n"
-
-        # Process all audio items in one batch
-        audio_indices = [i for i, item in enumerate(items) if item.get('type') == 'audio']
-        for i in audio_indices:
-            item = items[i]
-            field_name = item.get('fieldName')
-            if field_name not in request.FILES:
-                results[i] = ""  # Handle missing file gracefully
-                continue
-            uploaded_file = request.FILES[field_name]
-            saved_path = handle_uploaded_file(uploaded_file)
-            audio_text = transcribe_audio(transcription_model, saved_path)
-            results[i] = "<audio transcription start>" + audio_text + "<audio transcription end>\n\n"
-        
-        if len(old_summaries) == 0:
-            prepend = "<old summaries start> Old summaries NOT AVAILABLE <old summaries end>"
-        else:
-            prepend = "<old summaries start>"
-            for summary in old_summaries:
-                prepend += f"\n\n {summary['timestamp']}:\n <title>{summary['title']}</title> <summary>{summary['summary']}</summary>" 
-            prepend += "<old summaries end>"
-        # Combine results in original order
-        current_entry = "".join(r if r is not None else "" for r in results).strip()
-        raw_text = prepend + "\n\n\n" + "<current entry start>\n" + format_timestamp(int(timestamp)) + ": \n" + current_entry + "<current entry end>"
-        title, summary = parse_entry(text=raw_text, user_settings=user_settings)
-        gc.collect()
+
+        # 2) Process the items (images and audio concurrently) and summarize them
+        #    with the old summaries as context
+        result = summarize_note(note_data, user_settings, old_summaries, request.FILES)
+
         # 3) Return a success response
-        return Response({
-            "summary": summary,
-            "timestamp": timestamp,
-            "raw_text": current_entry,
-            "title": title,
-        }, status=status.HTTP_200_OK)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+def serialize_job(job):
+    data = {
+        "job_id": str(job.id),
+        "status": job.status,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+    if job.status == SummarizeJob.SUCCEEDED:
+        data["result"] = job.result
+    elif job.status == SummarizeJob.FAILED:
+        data["error"] = job.error
+    return data
+
+
+class SummarizeJobView(APIView):
+    """
+    Queue a note for summarizing instead of waiting for it. Accepts the same
+    multipart/form-data POST as NoteUploadView, plus an optional idempotency
+    key (Idempotency-Key header or idempotencyKey field): resubmitting with the
+    same key returns the original job rather than queueing the work again.
+    Returns 202 with the job id; poll summarize_job_status for the result.
+    """
 
+    def post(self, request):
+        note_data_str = request.data.get('noteData')
+        user_settings_str = request.data.get('settings')
+        if not note_data_str or not user_settings_str:
+            return Response({"error": "Missing noteData or settings field"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            note_data = json.loads(note_data_str)
+            user_settings = json.loads(user_settings_str)
+            old_summaries = json.loads(request.data.get("previousSummaries") or "[]")
+        except json.JSONDecodeError as e:
+            return Response({"error": f"Invalid JSON in noteData, settings or previousSummaries: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        idempotency_key = request.headers.get('Idempotency-Key') or request.data.get('idempotencyKey')
+        job, created = job_queue.submit(note_data, user_settings, old_summaries, request.FILES, idempotency_key)
+        return Response(serialize_job(job), status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def summarize_job_status(request, job_id):
+    """Status of a summarize job, with its result once it has succeeded"""
+    job_queue.start()
+    try:
+        job = SummarizeJob.objects.get(id=job_id)
+    except SummarizeJob.DoesNotExist:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(serialize_job(job))